@@ -2,69 +2,169 @@
 
 import argparse
 
-import sklearn.feature_extraction.text
+import numpy
 import sklearn.metrics.pairwise
 
+from . import (
+    clusters,
+    corpus,
+    cosine_similarity,
+    dedupe,
+    featurecache,
+    incremental,
+    profiling,
+    sinks,
+)
+
 
 def read_strings_from_file(file_path):
-    with open(file_path, "r") as file:
-        return [line.strip() for line in file]
+    # Strings are decoded on access; the vectorizer reads each one once
+    return corpus.load(file_path, strip=True)
+
+
+def iter_similar_pairs(vectorizer, similarity_threshold, start=0, chunk_size=1024):
+    """Yield ``(i, j, score)`` for pairs above the threshold, in row order.
+
+    Only the columns of strings ``start`` onwards are computed, so an
+    incremental run costs O(n * new) instead of O(n^2), and rows are
+    compared ``chunk_size`` at a time so at most a ``chunk_size x (n - start)``
+    block of similarities is held.
+    """
+    count = vectorizer.shape[0]
+
+    for chunk_start in range(0, count, chunk_size):
+        chunk_stop = min(chunk_start + chunk_size, count)
+        # Columns left of both start and the chunk's first pair are skipped
+        lowest = max(start, chunk_start + 1)
+        if lowest >= count:
+            break
+
+        # Calculate the cosine similarity between pairs of strings
+        cosine_similarities = sklearn.metrics.pairwise.cosine_similarity(
+            vectorizer[chunk_start:chunk_stop], vectorizer[lowest:]
+        )
+        # Later rows of the chunk also see columns up to their own index,
+        # which are not pairs (i < j); they are blanked in place
+        for i in range(max(chunk_start, lowest), chunk_stop):
+            cosine_similarities[i - chunk_start, : i - lowest + 1] = -numpy.inf
+
+        # Get indices of pairs (i < j) that meet the similarity threshold
+        rows, cols = numpy.nonzero(cosine_similarities > similarity_threshold)
+        for row, column in zip(rows.tolist(), cols.tolist()):
+            yield (
+                row + chunk_start,
+                column + lowest,
+                float(cosine_similarities[row, column]),
+            )
 
 
-def main(similarity_threshold, file_path):
+def similar_pairs(vectorizer, similarity_threshold, start=0):
+    """Return ``(i, j, score)`` for pairs above the threshold, in row order."""
+    return list(iter_similar_pairs(vectorizer, similarity_threshold, start))
+
+
+def main(
+    similarity_threshold,
+    file_path,
+    *,
+    feature_cache=None,
+    state_path=None,
+    profiler=profiling.DISABLED,
+    deduplicate=False,
+    nfkc=False,
+    output_format="text",
+    output_path=None,
+    cluster=False,
+):
     # Example list of strings
-    string_list = read_strings_from_file(file_path)
+    with profiler.phase("read"):
+        string_list = read_strings_from_file(file_path)
+
+    # Score each distinct normalized string once
+    deduplicated = None
+    scored = string_list
+    if deduplicate or nfkc:
+        with profiler.phase("dedupe"):
+            deduplicated = dedupe.Deduplicated(string_list, nfkc)
+        scored = deduplicated.unique
+
+    # Resume from the previous run's matches if the file was only appended to
+    start, selected_indices = 0, []
+    if state_path is not None:
+        params = {"engine": "bootfamily", "threshold": similarity_threshold}
+        start, selected_indices = incremental.load_state(
+            state_path, string_list, params
+        )
 
     # Convert the list of strings to a matrix of token counts
-    vectorizer = sklearn.feature_extraction.text.CountVectorizer().fit_transform(
-        string_list
-    )
+    with profiler.phase("featurize"):
+        vectorizer = cosine_similarity.count_matrix(scored, feature_cache)
 
-    # Calculate the cosine similarity between pairs of strings
-    cosine_similarities = sklearn.metrics.pairwise.cosine_similarity(
-        vectorizer, vectorizer
-    )
+    def self_match(k):
+        # A string is identical to itself unless it has no tokens
+        similarity = 1.0 if vectorizer[k].nnz else 0.0
+        return (similarity,) if similarity > similarity_threshold else None
 
-    # Get indices of pairs that meet the similarity threshold
-    selected_indices = [
-        (i, j)
-        for i in range(len(string_list) - 1)
-        for j in range(i + 1, len(string_list))
-        if cosine_similarities[i, j] > similarity_threshold
-    ]
+    profiler.add_pairs(len(scored) * (len(scored) - 1) // 2 - start * (start - 1) // 2)
 
-    # Sort the pairs by ascending similarity score
-    selected_indices.sort(key=lambda pair: cosine_similarities[pair[0], pair[1]])
+    if cluster:
+        # Join matches as they are found instead of collecting them
+        union_find = clusters.UnionFind(len(string_list))
+        with profiler.phase("score"):
+            matches = iter_similar_pairs(vectorizer, similarity_threshold)
+            if deduplicated is None:
+                union_find.add_matches(matches)
+            else:
+                deduplicated.cluster(union_find, matches, self_match)
+        with profiler.phase("output"):
+            clusters.print_clusters(
+                string_list, union_find.components(), len(string_list)
+            )
+        return
+
+    with profiler.phase("score"):
+        selected_indices += similar_pairs(vectorizer, similarity_threshold, start)
+
+    if deduplicated is not None:
+        selected_indices = list(deduplicated.expand(selected_indices, self_match))
+
+    # Sort the pairs by ascending similarity score, ties in row order
+    with profiler.phase("sort"):
+        selected_indices.sort(key=lambda pair: (pair[2], pair[0], pair[1]))
+
+    if state_path is not None:
+        incremental.save_state(state_path, string_list, params, selected_indices)
+
+    def format_match(i, j, similarity):
+        return f"Score: {similarity:.3f}\n{string_list[i]}\n{string_list[j]}\n\n"
+
+    sink = sinks.open_sink(output_format, string_list, format_match, path=output_path)
+    report = sink.report_file
 
     # Print the pairs with similarity scores above the threshold
     print(
         "Pairs with similarity scores above"
-        f" {similarity_threshold} (ordered by ascending score):"
+        f" {similarity_threshold} (ordered by ascending score):",
+        file=report,
     )
-    for i, j in selected_indices:
-        similarity = cosine_similarities[i, j]
-        print(f"Score: {similarity:.3f}")
-        print(f"{string_list[i]}")
-        print(f"{string_list[j]}")
-        print()
+    with profiler.phase("output"), sink:
+        for i, j, similarity in selected_indices:
+            sink.write(i, j, similarity)
 
     # Report the total count of pairs and the count of selected pairs
-    total_count = len(
-        list(
-            (i, j)
-            for i in range(len(string_list) - 1)
-            for j in range(i + 1, len(string_list))
-        )
-    )
+    total_count = len(string_list) * (len(string_list) - 1) // 2
     count_of_selected_pairs = len(selected_indices)
-    print(f"\nTotal number of pairs: {total_count:,}")
+    print(f"\nTotal number of pairs: {total_count:,}", file=report)
     print(
         "Number of pairs with similarity scores above"
-        f" {similarity_threshold}: {count_of_selected_pairs:,}"
+        f" {similarity_threshold}: {count_of_selected_pairs:,}",
+        file=report,
     )
 
+    profiler.add_matches(count_of_selected_pairs)
 
-if __name__ == "__main__":
+
+def run(argv=None):
     parser = argparse.ArgumentParser(
         description="Calculate cosine similarity between pairs of strings."
     )
@@ -82,5 +182,34 @@ if __name__ == "__main__":
         "containing strings (default: data.txt)",
     )
 
-    args = parser.parse_args()
-    main(args.similarity_threshold, args.file_path)
+    featurecache.add_feature_cache_arg(parser)
+    incremental.add_incremental_arg(parser)
+    dedupe.add_dedupe_args(parser)
+    clusters.add_cluster_arg(parser)
+    sinks.add_output_args(parser)
+    profiling.add_profile_args(parser)
+
+    args = parser.parse_args(argv)
+    sinks.check_output_args(parser, args)
+    if args.incremental and (args.dedupe or args.nfkc):
+        parser.error("--dedupe cannot be combined with --incremental")
+    if args.cluster and (args.incremental or args.output_format != "text"):
+        parser.error("--cluster only writes text and cannot be incremental")
+    profiler = profiling.from_args(args)
+    main(
+        args.similarity_threshold,
+        args.file_path,
+        feature_cache=featurecache.from_args(args),
+        state_path=args.incremental,
+        profiler=profiler,
+        deduplicate=args.dedupe,
+        nfkc=args.nfkc,
+        output_format=args.output_format,
+        output_path=args.output,
+        cluster=args.cluster,
+    )
+    profiler.report()
+
+
+if __name__ == "__main__":
+    run()
@@ -1,42 +1,494 @@
 # Needleman-Wunsch Algorithm
 
 import argparse
+import heapq
+import math
 
 import numpy
 
+from . import corpus, dedupe, incremental, profiling, sinks
+
+# Hirschberg recursion stops at halves whose full matrix has this many cells
+FULL_CELLS = 4096
+# Pairs whose longer string is at most this long are scored by the scalar
+# kernel, which beats the per-row NumPy calls up to about this length
+# (the britishcouch-scalar-* and britishcouch-vectorized-* cases of
+# tests/bench_engines.py)
+SCALAR_MAX_LENGTH = 16
+
 
 def read_strings_from_file(file_path):
-    with open(file_path, "r") as file:
-        return [line.strip() for line in file]
+    return corpus.load(file_path, strip=True).tolist()
 
 
 def needleman_wunsch(str1, str2, match_score=2, mismatch_score=-1, gap_penalty=-1):
-    len_str1 = len(str1) + 1
-    len_str2 = len(str2) + 1
+    # The recurrence is symmetric, so keep two rows along the shorter string
+    if len(str1) < len(str2):
+        str1, str2 = str2, str1
 
-    # Initialize the scoring matrix
-    score_matrix = numpy.zeros((len_str1, len_str2), dtype=int)
+    # The first row and column are zero: leading gaps are free
+    previous = [0] * (len(str2) + 1)
+    current = [0] * (len(str2) + 1)
 
-    for i in range(1, len_str1):
-        for j in range(1, len_str2):
-            match = score_matrix[i - 1, j - 1] + (
-                match_score if str1[i - 1] == str2[j - 1] else mismatch_score
+    for char1 in str1:
+        for j, char2 in enumerate(str2, 1):
+            match = previous[j - 1] + (
+                match_score if char1 == char2 else mismatch_score
             )
-            delete = score_matrix[i - 1, j] + gap_penalty
-            insert = score_matrix[i, j - 1] + gap_penalty
-            score_matrix[i, j] = max(match, delete, insert)
+            delete = previous[j] + gap_penalty
+            insert = current[j - 1] + gap_penalty
+            current[j] = max(match, delete, insert)
+        previous, current = current, previous
+
+    return previous[-1]
+
+
+def build_alphabet(strings):
+    """Assign a small integer code to every distinct character in strings."""
+    alphabet = {}
+    for string in strings:
+        for char in string:
+            alphabet.setdefault(char, len(alphabet))
+    return alphabet
+
+
+def encode(string, alphabet):
+    """Encode string as a uint8 code array (uint16 for very large alphabets)."""
+    dtype = numpy.uint8 if len(alphabet) <= 256 else numpy.uint16
+    return numpy.fromiter((alphabet[char] for char in string), dtype, len(string))
+
+
+def score_upper_bound(len1, len2, match_score=2):
+    """Best score an alignment of strings of these lengths could reach.
+
+    The first row and column of the matrix are zero, so a leading overhang
+    is free and at best every character of the shorter string is matched.
+    This holds while a match is the best substitution and gaps do not
+    score, as with the defaults.
+    """
+    return match_score * min(len1, len2)
+
+
+class ScoreBuffers:
+    """Rows for :func:`needleman_wunsch_codes`, allocated once and reused
+    for every pair of strings up to ``capacity`` characters whose codes are
+    below ``symbols``.
+
+    They also hold the arrays that only depend on the scores.
+    """
+
+    def __init__(
+        self, capacity, symbols, match_score=2, mismatch_score=-1, gap_penalty=-1
+    ):
+        self.capacity = capacity
+        self.symbols = symbols
+        self.scores = (match_score, mismatch_score, gap_penalty)
+        self.row = numpy.empty(capacity + 1, dtype=int)
+        self.candidates = numpy.empty(capacity + 1, dtype=int)
+        self.vertical = numpy.empty(capacity, dtype=int)
+        self.same = numpy.empty((symbols, capacity), dtype=bool)
+        self.substitution = numpy.empty((symbols, capacity), dtype=int)
+        self.codes = numpy.arange(symbols)[:, None]
+        self.offsets = numpy.arange(capacity + 1, dtype=int) * gap_penalty
+
+        # reach[capacity - x] is the most a path can still gain with x more
+        # characters of the longer string than of the shorter one left: a
+        # gap per surplus character, or a lost match plus a gap per missing
+        # one when x is negative
+        surplus = capacity - numpy.arange(2 * capacity + 1, dtype=int)
+        self.reach = numpy.where(
+            surplus >= 0, gap_penalty * surplus, (match_score - gap_penalty) * surplus
+        )
+
+    @classmethod
+    def for_codes(cls, codes, match_score=2, mismatch_score=-1, gap_penalty=-1):
+        """Buffers large enough for any pair of the code arrays in codes."""
+        capacity = max(map(len, codes), default=0)
+        symbols = max((int(c.max()) + 1 for c in codes if len(c)), default=0)
+        return cls(capacity, symbols, match_score, mismatch_score, gap_penalty)
+
+
+def needleman_wunsch_codes(
+    codes1,
+    codes2,
+    match_score=2,
+    mismatch_score=-1,
+    gap_penalty=-1,
+    floor=None,
+    buffers=None,
+):
+    """Row-vectorized equivalent of :func:`needleman_wunsch` on code arrays.
+
+    Each row is computed at once: the diagonal and vertical moves are plain
+    array operations and the horizontal gap chain
+    ``H[j] = max(T[j], H[j - 1] + gap)`` is resolved with a prefix max, since
+    it unrolls to ``j * gap + max(T[k] - k * gap for k <= j)``.  Only two
+    rows are kept, in ``buffers`` (a :class:`ScoreBuffers`) when given, so
+    scoring many pairs allocates nothing per row or per pair.
+
+    With ``floor``, return None as soon as no path through the current row
+    can end above it.  Like :func:`score_upper_bound` this assumes a match
+    is the best substitution and gaps do not score.
+    """
+    # The recurrence is symmetric, so vectorize along the longer string.
+    if len(codes1) > len(codes2):
+        codes1, codes2 = codes2, codes1
+    if buffers is None:
+        buffers = ScoreBuffers.for_codes(
+            (codes1, codes2), match_score, mismatch_score, gap_penalty
+        )
+
+    columns = len(codes2) + 1
+    offsets = buffers.offsets[:columns]
+    row = buffers.row[:columns]
+    candidates = buffers.candidates[:columns]
+    vertical = buffers.vertical[: columns - 1]
+    row.fill(0)
+    candidates[0] = 0
+
+    # substitution[c] scores code c against each character of codes2
+    same = buffers.same[:, : columns - 1]
+    substitution = buffers.substitution[:, : columns - 1]
+    numpy.equal(buffers.codes, codes2, out=same)
+    numpy.multiply(same, match_score - mismatch_score, out=substitution)
+    substitution += mismatch_score
+
+    if floor is not None:
+        # With ``left`` characters of codes1 to go, cell k can still gain at
+        # most match * left + reach[capacity - (len(codes2) - k - left)].
+        # The free column-0 cells of later rows are covered by k = 0, since
+        # codes1 is the shorter string.
+        start = buffers.capacity - len(codes2)
+        # The bound drops by at most match - mismatch per row, so after a
+        # check it is safe to skip the rows that could not close the slack
+        drop = max(match_score - mismatch_score, 1)
+        next_check = 1
+
+    for done, code in enumerate(codes1, 1):
+        numpy.add(row[:-1], substitution[code], out=candidates[1:])
+        numpy.add(row[1:], gap_penalty, out=vertical)
+        numpy.maximum(candidates[1:], vertical, out=candidates[1:])
+        numpy.subtract(candidates, offsets, out=candidates)
+        numpy.maximum.accumulate(candidates, out=row)
+        numpy.add(row, offsets, out=row)
+        if floor is not None and done >= next_check:
+            left = len(codes1) - done
+            reach = buffers.reach[start + left : start + left + columns]
+            best = (row + reach).max() + match_score * left
+            if best <= floor:
+                return None
+            next_check = done - (floor - best) // drop
+
+    return int(row[-1])
+
+
+def global_rows(codes1, codes2, match_score=2, mismatch_score=-1, gap_penalty=-1):
+    """Last row and last column of the global alignment matrix of two code
+    arrays, computed in linear space.
+
+    Unlike :func:`needleman_wunsch` every gap is charged, leading ones
+    included.
+    """
+    columns = len(codes2) + 1
+    offsets = numpy.arange(columns, dtype=int) * gap_penalty
+    row = offsets.copy()
+    candidates = numpy.empty(columns, dtype=int)
+    last_column = [row[-1]]
+
+    for done, code in enumerate(codes1, 1):
+        substitution = numpy.where(codes2 == code, match_score, mismatch_score)
+        candidates[0] = done * gap_penalty
+        numpy.maximum(
+            row[:-1] + substitution, row[1:] + gap_penalty, out=candidates[1:]
+        )
+        row = numpy.maximum.accumulate(candidates - offsets) + offsets
+        last_column.append(row[-1])
+
+    return row, numpy.array(last_column)
+
+
+def full_alignment(codes1, codes2, match_score=2, mismatch_score=-1, gap_penalty=-1):
+    """Global alignment of two short code arrays by a full-matrix traceback.
+
+    Returns the alignment's ``(i, j)`` columns, with None for a gap.
+    """
+    codes1, codes2 = codes1.tolist(), codes2.tolist()
+    matrix = [[j * gap_penalty for j in range(len(codes2) + 1)]]
+    for i, code1 in enumerate(codes1, 1):
+        above, row = matrix[-1], [i * gap_penalty]
+        for j, code2 in enumerate(codes2, 1):
+            substitution = match_score if code1 == code2 else mismatch_score
+            row.append(
+                max(
+                    above[j - 1] + substitution,
+                    above[j] + gap_penalty,
+                    row[j - 1] + gap_penalty,
+                )
+            )
+        matrix.append(row)
+
+    columns = []
+    i, j = len(codes1), len(codes2)
+    while i or j:
+        score = matrix[i][j]
+        if i and j:
+            substitution = (
+                match_score if codes1[i - 1] == codes2[j - 1] else mismatch_score
+            )
+            if score == matrix[i - 1][j - 1] + substitution:
+                i, j = i - 1, j - 1
+                columns.append((i, j))
+                continue
+        if i and score == matrix[i - 1][j] + gap_penalty:
+            i -= 1
+            columns.append((i, None))
+        else:
+            j -= 1
+            columns.append((None, j))
+    columns.reverse()
+    return columns
+
+
+def hirschberg(codes1, codes2, match_score=2, mismatch_score=-1, gap_penalty=-1):
+    """Global alignment of two code arrays in linear space.
+
+    Hirschberg's divide and conquer: the middle row of codes1 is aligned to
+    the column of codes2 where the forward scores of the top half and the
+    backward scores of the bottom half add up to the best total, and both
+    halves are aligned recursively.  Small halves fall back to
+    :func:`full_alignment`, whose matrices stay within ``FULL_CELLS``.
+    """
+    scores = (match_score, mismatch_score, gap_penalty)
+    if len(codes1) <= 1 or len(codes1) * len(codes2) <= FULL_CELLS:
+        return full_alignment(codes1, codes2, *scores)
+
+    middle = len(codes1) // 2
+    forward, _ = global_rows(codes1[:middle], codes2, *scores)
+    backward, _ = global_rows(codes1[middle:][::-1], codes2[::-1], *scores)
+    split = int(numpy.argmax(forward + backward[::-1]))
+
+    top = hirschberg(codes1[:middle], codes2[:split], *scores)
+    bottom = hirschberg(codes1[middle:], codes2[split:], *scores)
+    return top + [
+        (None if i is None else i + middle, None if j is None else j + split)
+        for i, j in bottom
+    ]
+
+
+def alignment_columns(codes1, codes2, match_score=2, mismatch_score=-1, gap_penalty=-1):
+    """An alignment scoring :func:`needleman_wunsch_codes`, in linear space.
+
+    Leading gaps are free, so the best alignment skips a prefix of one of
+    the strings and globally aligns the rest.  The scores of every such
+    start come from one pass over the reversed strings, and the rest is
+    aligned by :func:`hirschberg`.
+    """
+    scores = (match_score, mismatch_score, gap_penalty)
+    # skip_codes2[c] scores codes1 against the last c codes of codes2 and
+    # skip_codes1[r] the last r codes of codes1 against codes2
+    skip_codes2, skip_codes1 = global_rows(codes1[::-1], codes2[::-1], *scores)
+
+    if skip_codes1.max() >= skip_codes2.max():
+        skip = len(codes1) - int(numpy.argmax(skip_codes1))
+        rest = hirschberg(codes1[skip:], codes2, *scores)
+        return [(i, None) for i in range(skip)] + [
+            (None if i is None else i + skip, j) for i, j in rest
+        ]
+
+    skip = len(codes2) - int(numpy.argmax(skip_codes2))
+    rest = hirschberg(codes1, codes2[skip:], *scores)
+    return [(None, j) for j in range(skip)] + [
+        (i, None if j is None else j + skip) for i, j in rest
+    ]
 
-    return score_matrix[len_str1 - 1, len_str2 - 1]
 
+def format_alignment(str1, str2):
+    """Three lines showing an optimal case-insensitive alignment of two
+    strings: each string with ``-`` for gaps and a line marking matches
+    with ``|`` and mismatches with ``.`` between them."""
+    lowered1, lowered2 = str1.lower(), str2.lower()
+    # Show the original characters unless lowercasing changed a length
+    if len(lowered1) != len(str1) or len(lowered2) != len(str2):
+        str1, str2 = lowered1, lowered2
+    alphabet = build_alphabet((lowered1, lowered2))
+    codes1, codes2 = encode(lowered1, alphabet), encode(lowered2, alphabet)
 
-def calculate_similarity(str1, str2):
+    top, marks, bottom = [], [], []
+    for i, j in alignment_columns(codes1, codes2):
+        top.append("-" if i is None else str1[i])
+        bottom.append("-" if j is None else str2[j])
+        if i is None or j is None:
+            marks.append(" ")
+        else:
+            marks.append("|" if codes1[i] == codes2[j] else ".")
+    return f"{''.join(top)}\n{''.join(marks)}\n{''.join(bottom)}\n"
+
+
+def needleman_wunsch_vectorized(
+    str1, str2, match_score=2, mismatch_score=-1, gap_penalty=-1, alphabet=None
+):
+    """:func:`needleman_wunsch_codes` on strings, encoded with ``alphabet``
+    (built from the two strings if not given)."""
+    if alphabet is None:
+        alphabet = build_alphabet((str1, str2))
+    return needleman_wunsch_codes(
+        encode(str1, alphabet),
+        encode(str2, alphabet),
+        match_score,
+        mismatch_score,
+        gap_penalty,
+    )
+
+
+def needleman_wunsch_score(str1, str2, alphabet=None):
+    """Score with whichever kernel is faster for the lengths of the strings.
+
+    ``alphabet`` must cover both strings when given.
+    """
+    if max(len(str1), len(str2)) <= SCALAR_MAX_LENGTH:
+        return needleman_wunsch(str1, str2)
+    return needleman_wunsch_vectorized(str1, str2, alphabet=alphabet)
+
+
+def calculate_similarity(str1, str2, alphabet=None):
+    """Similarity of two strings; ``alphabet`` must cover both lowercased."""
     len_max = max(len(str1), len(str2))
     if len_max == 0:
         return 0.0
-    return needleman_wunsch(str1.lower(), str2.lower()) / len_max
+    return needleman_wunsch_score(str1.lower(), str2.lower(), alphabet) / len_max
+
+
+def score_floor(similarity_threshold, len_max):
+    """Largest integer score whose similarity does not exceed the threshold.
+
+    A pair of strings matches exactly when its score is above the floor;
+    the division is the same as in :func:`calculate_similarity`, so
+    comparing scores agrees with comparing similarities.
+    """
+    floor = math.floor(similarity_threshold * len_max)
+    while (floor + 1) / len_max <= similarity_threshold:
+        floor += 1
+    while floor / len_max > similarity_threshold:
+        floor -= 1
+    return floor
+
+
+def length_table(lowered, strings, similarity_threshold):
+    """Group strings by length and find which groups can match each other.
+
+    Returns ``(groups, feasible)``: the group number of every string and a
+    boolean matrix whose ``[a, b]`` is False when no string of group ``a``
+    can match a string of group ``b``, by :func:`score_upper_bound`.  Groups
+    are numbered in order of length.
+    """
+    # Scores use the lowercased strings and similarities the originals,
+    # whose lengths can differ for a few characters
+    keys = [(len(low), len(string)) for low, string in zip(lowered, strings)]
+    distinct = sorted(set(keys))
+    number = {key: k for k, key in enumerate(distinct)}
+
+    feasible = numpy.zeros((len(distinct), len(distinct)), dtype=bool)
+    floors = {}
+    for a, (scored_a, len_a) in enumerate(distinct):
+        for b in range(a, len(distinct)):
+            scored_b, len_b = distinct[b]
+            len_max = max(len_a, len_b)
+            if len_max == 0:
+                possible = 0.0 > similarity_threshold
+            else:
+                if len_max not in floors:
+                    floors[len_max] = score_floor(similarity_threshold, len_max)
+                bound = score_upper_bound(scored_a, scored_b)
+                possible = bound > floors[len_max]
+            feasible[a, b] = feasible[b, a] = possible
+
+    groups = numpy.array([number[key] for key in keys], dtype=numpy.intp)
+    return groups, feasible
+
+
+def iter_similar_pairs(strings, similarity_threshold, start=0, counts=None):
+    """Yield ``(similarity, i, j)`` for pairs above the threshold.
+
+    Pairs are generated in row-major order; with ``start`` only pairs whose
+    second string is at index ``start`` or later are scored.
+
+    Pairs whose lengths alone rule them out are skipped a row at a time and
+    alignments stop as soon as they cannot reach the threshold.  If
+    ``counts`` is a dict its ``"total"``, ``"pruned"`` (by length) and
+    ``"stopped"`` (early in the alignment) pair counts are increased.
+    """
+    total_pairs = 0
+    pruned_pairs = 0
+    stopped_pairs = 0
+
+    # Lowercase and encode every string once up front
+    lowered = [string.lower() for string in strings]
+    alphabet = build_alphabet(lowered)
+    codes = [encode(string, alphabet) for string in lowered]
+    groups, feasible = length_table(lowered, strings, similarity_threshold)
+    floors = {}
+    buffers = ScoreBuffers.for_codes(codes)
+
+    try:
+        for i in range(len(strings)):
+            first = max(i + 1, start)
+            if first >= len(strings):
+                continue
+            total_pairs += len(strings) - first
+
+            # One lookup per pair in the row rules out every length group
+            # that cannot reach the threshold
+            candidates = numpy.flatnonzero(feasible[groups[i], groups[first:]])
+            pruned_pairs += len(strings) - first - len(candidates)
+
+            for j in (candidates + first).tolist():
+                len_max = max(len(strings[i]), len(strings[j]))
+                if len_max == 0:
+                    yield 0.0, i, j
+                    continue
 
+                floor = floors.get(len_max)
+                if floor is None:
+                    floor = floors[len_max] = score_floor(similarity_threshold, len_max)
+                if max(len(codes[i]), len(codes[j])) <= SCALAR_MAX_LENGTH:
+                    score = needleman_wunsch(lowered[i], lowered[j])
+                else:
+                    score = needleman_wunsch_codes(
+                        codes[i], codes[j], floor=floor, buffers=buffers
+                    )
+                if score is None:
+                    stopped_pairs += 1
+                elif score > floor:
+                    yield score / len_max, i, j
+    finally:
+        if counts is not None:
+            counts["total"] = counts.get("total", 0) + total_pairs
+            counts["pruned"] = counts.get("pruned", 0) + pruned_pairs
+            counts["stopped"] = counts.get("stopped", 0) + stopped_pairs
 
-def main():
+
+class RunningStats:
+    """Count, min and max of the match scores, updated as they stream by."""
+
+    def __init__(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def track(self, matches):
+        for match in matches:
+            score = match[0]
+            self.count += 1
+            self.min = score if self.min is None else min(self.min, score)
+            self.max = score if self.max is None else max(self.max, score)
+            yield match
+
+
+def format_match(similarity, str1, str2):
+    return f"\nscore: {similarity:0.3f}\n{str1}\n{str2}\n"
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="String similarity using Needleman-Wunsch algorithm."
     )
@@ -52,48 +504,139 @@ def main():
         help="Threshold for similarity score.",
     )
     parser.add_argument(
-        "--top-n", type=int, default=None, help="Filter and display the top N scores."
+        "--top-n",
+        type=int,
+        default=None,
+        help="Display only the N highest scores, kept in a bounded heap.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Print matches as soon as they are found, unsorted.",
     )
+    parser.add_argument(
+        "--show-alignment",
+        action="store_true",
+        help="Print an optimal alignment of each matching pair, computed in"
+        " linear space with Hirschberg's algorithm.",
+    )
+    incremental.add_incremental_arg(parser)
+    dedupe.add_dedupe_args(parser)
+    sinks.add_output_args(parser)
+    profiling.add_profile_args(parser)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    sinks.check_output_args(parser, args)
+    if args.incremental and (args.dedupe or args.nfkc):
+        parser.error("--dedupe cannot be combined with --incremental")
+    if args.top_n is not None and args.stream:
+        parser.error("--top-n cannot be combined with --stream")
+    if args.show_alignment and args.output_format != "text":
+        parser.error("--show-alignment only applies to text output")
+    profiler = profiling.from_args(args)
 
-    strings = read_strings_from_file(args.file_path)
+    with profiler.phase("read"):
+        strings = read_strings_from_file(args.file_path)
 
     total_strings = len(strings)
-    results = []
 
-    for i in range(total_strings):
-        for j in range(i + 1, total_strings):
-            str1 = strings[i]
-            str2 = strings[j]
-            similarity = calculate_similarity(str1, str2)
+    with profiler.phase("dedupe"):
+        deduplicated = dedupe.from_args(args, strings)
+
+    counts = {}
+    if deduplicated is None:
+        profiler.add_pairs(total_strings * (total_strings - 1) // 2)
+        matches = iter_similar_pairs(strings, args.similarity_threshold, counts=counts)
+    else:
+        # Score each distinct normalized string once, then expand the matches
+        # back to the original lines
+        unique = deduplicated.unique
+        profiler.add_pairs(len(unique) * (len(unique) - 1) // 2)
 
-            if similarity > args.similarity_threshold:
-                results.append((similarity, str1, str2))
+        alphabet = build_alphabet(string.lower() for string in unique)
 
-    # Sort results by increasing similarity
-    results.sort(key=lambda x: x[0])
+        def self_match(k):
+            similarity = calculate_similarity(unique[k], unique[k], alphabet)
+            return (similarity,) if similarity > args.similarity_threshold else None
 
-    # Filter and display the top N scores if specified
-    if args.top_n is not None:
-        results = results[: args.top_n]
+        unique_matches = (
+            (u, v, similarity)
+            for similarity, u, v in iter_similar_pairs(
+                unique, args.similarity_threshold, counts=counts
+            )
+        )
+        matches = (
+            (similarity, i, j)
+            for i, j, similarity in deduplicated.expand(unique_matches, self_match)
+        )
+
+    # Resume from the previous run's matches if the file was only appended to
+    if args.incremental:
+        params = {"engine": "britishcouch", "threshold": args.similarity_threshold}
+        start, previous = incremental.load_state(args.incremental, strings, params)
+        profiler.add_pairs(-start * (start - 1) // 2)
+        with profiler.phase("score"):
+            results = previous + list(
+                iter_similar_pairs(strings, args.similarity_threshold, start, counts)
+            )
+        # Sort results by increasing similarity, ties in row-major order
+        results.sort()
+        incremental.save_state(args.incremental, strings, params, results)
+        matches = iter(results)
+
+    stats = RunningStats()
+    matches = stats.track(matches)
 
-    if results:
-        # Print the sorted results
-        for result in results:
-            print(f"\nscore: {result[0]:0.3f}")
-            print(result[1])
-            print(result[2])
+    def format_row(i, j, similarity):
+        text = format_match(similarity, strings[i], strings[j])
+        if args.show_alignment:
+            text += format_alignment(strings[i], strings[j])
+        return text
 
+    sink = sinks.from_args(args, strings, format_row)
+    with sink:
+        if args.stream:
+            # Scoring and printing are interleaved, so both count as scoring
+            with profiler.phase("score"):
+                for similarity, i, j in matches:
+                    sink.write(i, j, similarity)
+                    sink.flush()
+        else:
+            with profiler.phase("score"):
+                if args.top_n is not None:
+                    # Only the N best matches are ever held in memory
+                    results = heapq.nlargest(args.top_n, matches)
+                else:
+                    results = list(matches)
+
+            # Sort results by increasing similarity
+            with profiler.phase("sort"):
+                results.sort()
+
+            with profiler.phase("output"):
+                for similarity, i, j in results:
+                    sink.write(i, j, similarity)
+
+    if stats.count:
         # Print additional information
-        print()
-        print(f"Min similarity score: {results[0][0]:0.3f}")
-        print(f"Max similarity score: {results[-1][0]:0.3f}")
-        print(f"Total strings: {total_strings:,}")
+        report = sink.report_file
+        print(file=report)
+        print(f"Min similarity score: {stats.min:0.3f}", file=report)
+        print(f"Max similarity score: {stats.max:0.3f}", file=report)
+        print(f"Total strings: {total_strings:,}", file=report)
         print(
             f"Strings with similarity greater than"
-            f" {args.similarity_threshold}: {len(results):,}"
+            f" {args.similarity_threshold}: {stats.count:,}",
+            file=report,
         )
+        print(
+            f"Pairs pruned by length: {counts['pruned']:,} of {counts['total']:,}",
+            file=report,
+        )
+        print(f"Alignments stopped early: {counts['stopped']:,}", file=report)
+
+    profiler.add_matches(stats.count)
+    profiler.report()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+# connected components of the match graph
+
+import sys
+
+
+class UnionFind:
+    """Disjoint sets over ``0 .. count - 1`` with union by size and path
+    compression.
+
+    Matches are added one pair at a time as the engines produce them, so
+    clustering needs O(n) memory however many pairs match.
+    """
+
+    def __init__(self, count):
+        self.parent = list(range(count))
+        self.size = [1] * count
+        self.unions = 0
+
+    def find(self, item):
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # Point every node on the path straight at the root
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        self.unions += 1
+
+    def components(self):
+        """Return the sets with more than one member, largest first.
+
+        Members are in ascending order and ties are ordered by their first
+        member.
+        """
+        members = {}
+        for item in range(len(self.parent)):
+            root = self.find(item)
+            if self.size[root] > 1:
+                members.setdefault(root, []).append(item)
+        return sorted(members.values(), key=lambda group: (-len(group), group[0]))
+
+    def add_matches(self, matches):
+        """Union the ``(i, j, ...)`` pairs of an iterable of matches."""
+        for i, j, *_ in matches:
+            self.union(i, j)
+
+
+def print_clusters(strings, components, total, file=None):
+    """Print each cluster with its size, representative and members.
+
+    The representative is the cluster's first line.
+    """
+    file = sys.stdout if file is None else file
+    clustered = 0
+    for number, component in enumerate(components, 1):
+        clustered += len(component)
+        print(
+            f"Cluster {number}: {len(component):,} strings,"
+            f" representative: {strings[component[0]]}",
+            file=file,
+        )
+        for line in component:
+            print(f"  {strings[line]}", file=file)
+        print(file=file)
+
+    print(f"Clusters: {len(components):,}", file=file)
+    print(f"Clustered strings: {clustered:,} of {total:,}", file=file)
+
+
+def add_cluster_arg(parser):
+    parser.add_argument(
+        "--cluster",
+        action="store_true",
+        help="Group matching strings into connected components with a"
+        " union-find as pairs are scored, and print the clusters instead of"
+        " the pairs.",
+    )
@@ -0,0 +1,216 @@
+# memory-mapped corpus loader shared by the engines
+
+import argparse
+import collections.abc
+import mmap
+import os
+import pathlib
+
+import numpy
+
+# Binary corpus layout: magic (which ends in a NUL no text file starts
+# with), the format version (uint8) and zero padding to 16 bytes, the line
+# count (uint64), count + 1 byte offsets (int64) into the data, then the
+# UTF-8 lines back to back without separators.  Everything is little-endian
+# and 8-byte aligned.
+MAGIC = b"MTCORPUS\0"
+VERSION = 1
+HEADER_BYTES = 24
+SCAN_BYTES = 1 << 24
+
+# Bytes that end a line on their own, as in str.splitlines(): \n, \v, \f,
+# \r and \x1c-\x1e.  U+0085, U+2028 and U+2029 are encoded as C2 85 and
+# E2 80 A8/A9, whose lead bytes are flagged as candidates.
+_SEPARATOR, _LEAD = 1, 2
+_BYTE_KINDS = numpy.zeros(256, numpy.uint8)
+_BYTE_KINDS[[0x0A, 0x0B, 0x0C, 0x0D, 0x1C, 0x1D, 0x1E]] = _SEPARATOR
+_BYTE_KINDS[[0xC2, 0xE2]] = _LEAD
+
+
+def _map(path):
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return numpy.zeros(0, numpy.uint8)
+        # The map stays valid after the file is closed
+        return numpy.frombuffer(
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ), numpy.uint8
+        )
+
+
+def _following(data, positions, offset):
+    """The bytes ``offset`` after each position, or -1 past the end."""
+    after = positions + offset
+    inside = after < len(data)
+    following = numpy.full(len(positions), -1, numpy.int16)
+    following[inside] = data[after[inside]]
+    return following
+
+
+def line_bounds(data):
+    """Return ``(starts, ends)`` of the lines in UTF-8 bytes.
+
+    Lines are split as ``str.splitlines()`` splits the decoded text: at
+    ``\n``, ``\r\n``, ``\r``, ``\v``, ``\f``, ``\x1c``-``\x1e``, U+0085,
+    U+2028 and U+2029.  Separators are not part of the line, and a trailing
+    one does not start an empty last line.  The scan runs in fixed-size
+    chunks so it never holds a mask of the whole file.
+    """
+    candidates = []
+    for start in range(0, len(data), SCAN_BYTES):
+        chunk = data[start : start + SCAN_BYTES]
+        # Comparisons are cheaper than looking every byte up in _BYTE_KINDS
+        maybe = (chunk <= 0x1E) | (chunk == 0xC2) | (chunk == 0xE2)
+        candidates.append(numpy.flatnonzero(maybe) + start)
+    positions = (
+        numpy.concatenate(candidates) if candidates else numpy.zeros(0, numpy.int64)
+    ).astype(numpy.int64)
+    positions = positions[_BYTE_KINDS[data[positions]] != 0]
+
+    # A \n is a one-byte separator; only the rarer candidates need a closer
+    # look at the bytes that follow them
+    kinds = data[positions]
+    lengths = numpy.ones(len(positions), numpy.int64)
+    special = numpy.flatnonzero(kinds != ord("\n"))
+    if len(special):
+        kinds, at = kinds[special], positions[special]
+        following = _following(data, at, 1)
+        # \r\n is one separator: the \r covers both and the \n, always the
+        # next candidate, is skipped
+        crlf = special[(kinds == ord("\r")) & (following == ord("\n"))]
+        lengths[crlf] = 2
+        lengths[crlf + 1] = 0
+        lengths[special[_BYTE_KINDS[kinds] == _LEAD]] = 0
+        lengths[special[(kinds == 0xC2) & (following == 0x85)]] = 2
+        lengths[
+            special[
+                (kinds == 0xE2)
+                & (following == 0x80)
+                & numpy.isin(_following(data, at, 2), (0xA8, 0xA9))
+            ]
+        ] = 3
+
+    separators = lengths > 0
+    ends = positions[separators]
+    following_starts = ends + lengths[separators]
+    if len(data) and (len(ends) == 0 or following_starts[-1] < len(data)):
+        ends = numpy.append(ends, len(data))
+    else:
+        following_starts = following_starts[:-1]
+    starts = numpy.zeros(len(ends), numpy.int64)
+    starts[1:] = following_starts
+    return starts, ends
+
+
+class Corpus(collections.abc.Sequence):
+    """Newline-delimited strings backed by a memory-mapped file.
+
+    Only the line offsets are built up front; each string is decoded when it
+    is accessed, so opening a large file is cheap.  Kernels that work on raw
+    bytes can use :meth:`packed` instead.  With ``strip`` every string has its
+    surrounding whitespace removed, as ``line.strip()`` would.
+    """
+
+    def __init__(self, data, starts, ends, strip=False):
+        self.data = data
+        self.starts = starts
+        self.ends = ends
+        self.strip = strip
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _decode(self, start, end):
+        string = self.data[start:end].tobytes().decode("utf-8")
+        return string.strip() if self.strip else string
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("corpus index out of range")
+        return self._decode(self.starts[index], self.ends[index])
+
+    def __iter__(self):
+        for start, end in zip(self.starts.tolist(), self.ends.tolist()):
+            yield self._decode(start, end)
+
+    def tolist(self):
+        return list(self)
+
+    def packed(self):
+        """Return ``(data, starts, ends)``: the UTF-8 bytes and line bounds.
+
+        ``data`` is a read-only view of the mapped file; line ``i`` is
+        ``data[starts[i]:ends[i]]`` before any stripping.
+        """
+        return self.data, self.starts, self.ends
+
+
+def _unpack(path, data):
+    invalid = f"{path} is not a valid version {VERSION} binary corpus"
+    if len(data) < HEADER_BYTES or data[len(MAGIC)] != VERSION:
+        raise ValueError(invalid)
+    count = int(data[HEADER_BYTES - 8 : HEADER_BYTES].view("<u8")[0])
+    base = HEADER_BYTES + 8 * (count + 1)
+    if count >= len(data) // 8 or base > len(data):
+        raise ValueError(invalid)
+
+    offsets = data[HEADER_BYTES:base].view("<i8")
+    if offsets[0] != 0 or offsets[-1] != len(data) - base:
+        raise ValueError(invalid)
+    if numpy.any(offsets[1:] < offsets[:-1]):
+        raise ValueError(invalid)
+    return data[base:], offsets[:-1], offsets[1:]
+
+
+def load(path, strip=False):
+    """Open a text or binary corpus file as a :class:`Corpus`.
+
+    Raises:
+      ValueError: the file starts with the binary corpus magic but its
+        version, line count or offsets do not match its contents
+    """
+    data = _map(path)
+    if data[: len(MAGIC)].tobytes() != MAGIC:
+        return Corpus(data, *line_bounds(data), strip=strip)
+    return Corpus(*_unpack(path, data), strip=strip)
+
+
+def pack(source, destination):
+    """Write the lines of ``source`` as a binary corpus, so later runs load
+    the offset index instead of scanning for newlines."""
+    data, starts, ends = load(source).packed()
+    lengths = ends - starts
+    offsets = numpy.zeros(len(starts) + 1, "<i8")
+    numpy.cumsum(lengths, out=offsets[1:])
+
+    destination = pathlib.Path(destination)
+    staging = destination.with_name(f".{destination.name}.tmp")
+    with open(staging, "wb") as file:
+        file.write(MAGIC + bytes([VERSION]))
+        file.write(bytes(HEADER_BYTES - 8 - len(MAGIC) - 1))
+        file.write(numpy.array([len(starts)], "<u8").tobytes())
+        file.write(offsets.tobytes())
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            file.write(data[start:end])
+    os.replace(staging, destination)
+    return len(starts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Pack a newline-delimited file into a binary corpus that"
+        " every engine can read in place of the text file."
+    )
+    parser.add_argument("source", help="newline-delimited text file")
+    parser.add_argument("destination", help="binary corpus file to write")
+    args = parser.parse_args(argv)
+
+    count = pack(args.source, args.destination)
+    print(f"Packed {count:,} lines into {args.destination}")
+
+
+if __name__ == "__main__":
+    main()
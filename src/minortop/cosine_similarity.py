@@ -1,69 +1,178 @@
 # cosine_similarity
 
+import argparse
+
 import numpy
+import sklearn
 import sklearn.feature_extraction.text
-import sklearn.metrics.pairwise
-
-from . import args_common
+import sklearn.preprocessing
 
+from . import args_common, corpus, featurecache, profiling
 
-def add_subparsers(parser):
-    subparsers = parser.add_subparsers(
-        dest="cosine_similarity", help="Calculate cosine similarity between strings."
-    )
 
-    parser = subparsers.add_parser(
-        "cosine-similarity",
-        help="cosine-similarity help",
-        aliases=["cosine"],
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Calculate cosine similarity between strings."
     )
 
     parser.add_argument("--data-path", required=True, help="path to data.txt")
+    parser.add_argument(
+        "--top", type=int, default=5, help="number of most similar pairs to show"
+    )
+    parser.add_argument(
+        "--bottom", type=int, default=5, help="number of least similar pairs to show"
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1024,
+        help="rows multiplied at a time; bounds peak memory to chunk-size x n",
+    )
+    featurecache.add_feature_cache_arg(parser)
+    profiling.add_profile_args(parser)
     args_common.add_common_args(parser)
 
     return parser
 
 
 def read_items(file_path):
-    with open(file_path, "r") as file:
-        string_list = file.read().splitlines()
-    return string_list
+    return corpus.load(file_path)
+
+
+def count_matrix(string_list, feature_cache=None):
+    """CountVectorizer token counts, with tokenization read from the cache."""
+    vectorizer = sklearn.feature_extraction.text.CountVectorizer()
+    if feature_cache is None:
+        return vectorizer.fit_transform(string_list)
+
+    analyze = vectorizer.build_analyzer()
+    tokens = feature_cache.features(
+        string_list,
+        "count-vectorizer-tokens",
+        lambda string: numpy.array(analyze(string), dtype=str),
+        params=(sklearn.__version__,),
+        normalize=featurecache.lowercase_words,
+    )
+    # The default analyzer lowercases and its tokens never span whitespace,
+    # so strings differing only in case or spacing share cached tokens, and
+    # counting the cached tokens gives the same matrix
+    return sklearn.feature_extraction.text.CountVectorizer(
+        analyzer=lambda document: document.tolist()
+    ).fit_transform(tokens)
+
+
+def _row_best(scores, k, largest):
+    """Columns of the k best scores in one row, ties going to lower columns."""
+    if len(scores) <= k:
+        return numpy.arange(len(scores))
+    if largest:
+        kth = numpy.partition(scores, len(scores) - k)[len(scores) - k]
+        better = numpy.flatnonzero(scores > kth)
+    else:
+        kth = numpy.partition(scores, k - 1)[k - 1]
+        better = numpy.flatnonzero(scores < kth)
+    tied = numpy.flatnonzero(scores == kth)[: k - len(better)]
+    return numpy.concatenate((better, tied))
+
+
+def _ordered(scores, rows, cols, largest):
+    return numpy.lexsort((cols, rows, -scores if largest else scores))
+
+
+def _select(scores, rows, cols, k, largest):
+    # Candidates are few, so sort them and keep the first k
+    keep = _ordered(scores, rows, cols, largest)[:k]
+    return scores[keep], rows[keep], cols[keep]
+
+
+def top_bottom_pairs(counts, top=5, bottom=5, chunk_size=1024):
+    """Find the most and least similar pairs of rows in a sparse count matrix.
+
+    Row blocks of the L2-normalized matrix are multiplied against its
+    transpose one at a time, and only the running top/bottom candidates are
+    kept, so the full n x n similarity matrix is never built.  Each row of
+    a block is cut to its upper triangle with a slice, so nothing else of
+    the block's size is allocated.
+
+    Returns:
+      tuple: two lists of ``(i, j, score)`` with ``i < j``, the first in
+      descending and the second in ascending order of score, ties ordered
+      by ``(i, j)``.
+    """
+    normalized = sklearn.preprocessing.normalize(counts).tocsr()
+    transposed = normalized.T.tocsr()
+    count = normalized.shape[0]
+
+    empty = (numpy.empty(0), numpy.empty(0, dtype=int), numpy.empty(0, dtype=int))
+    best, worst = empty, empty
+
+    for start in range(0, count, chunk_size):
+        stop = min(start + chunk_size, count)
+        block = (normalized[start:stop] @ transposed).toarray()
+
+        # Only the strict upper triangle (j > i) holds distinct pairs
+        found = {True: [best], False: [worst]}
+        for i in range(start, stop):
+            scores = block[i - start, i + 1 :]
+            for largest, k in ((True, top), (False, bottom)):
+                if k > 0 and len(scores):
+                    cols = _row_best(scores, k, largest)
+                    rows = numpy.full(len(cols), i)
+                    found[largest].append((scores[cols], rows, cols + i + 1))
+        del block
+
+        if top > 0:
+            best = _select(
+                *(numpy.concatenate(part) for part in zip(*found[True])),
+                top,
+                largest=True,
+            )
+        if bottom > 0:
+            worst = _select(
+                *(numpy.concatenate(part) for part in zip(*found[False])),
+                bottom,
+                largest=False,
+            )
+
+    return (
+        [(i, j, score) for score, i, j in zip(*best)],
+        [(i, j, score) for score, i, j in zip(*worst)],
+    )
 
 
-def main(args):
-    string_list = read_items(args.data_path)
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    profiler = profiling.from_args(args)
+    with profiler.phase("read"):
+        string_list = read_items(args.data_path)
 
     # Convert the list of strings into a matrix of token counts
-    vectorizer = sklearn.feature_extraction.text.CountVectorizer().fit_transform(
-        string_list
-    )
-
-    # Calculate the cosine similarity between each pair of strings
-    cosine_similarities = sklearn.metrics.pairwise.cosine_similarity(vectorizer)
+    with profiler.phase("featurize"):
+        vectorizer = count_matrix(string_list, featurecache.from_args(args))
 
-    # Flatten the upper triangular part of the matrix (excluding the diagonal)
-    flat_cosine_similarities = cosine_similarities[
-        numpy.triu_indices(len(cosine_similarities), k=1)
-    ]
-
-    # Get the indices of the top 5 and bottom 5 values
-    top_indices = numpy.argsort(flat_cosine_similarities)[-5:][::-1]
-    bottom_indices = numpy.argsort(flat_cosine_similarities)[:5]
+    with profiler.phase("score"):
+        top_pairs, bottom_pairs = top_bottom_pairs(
+            vectorizer, args.top, args.bottom, args.chunk_size
+        )
+    profiler.add_pairs(len(string_list) * (len(string_list) - 1) // 2)
+    profiler.add_matches(len(top_pairs) + len(bottom_pairs))
 
-    # Output the top 5 items and scores
-    print("Top 5 items and scores:")
-    for index in top_indices:
-        item1, item2 = numpy.unravel_index(index, cosine_similarities.shape)
-        score = flat_cosine_similarities[index]
+    # Output the top items and scores
+    print(f"Top {args.top} items and scores:")
+    for item1, item2, score in top_pairs:
         print(
             f"Items: '{string_list[item1]}' and '{string_list[item2]}', Score = {score}"
         )
 
-    # Output the bottom 5 items and scores
-    print("\nBottom 5 items and scores:")
-    for index in bottom_indices:
-        item1, item2 = numpy.unravel_index(index, cosine_similarities.shape)
-        score = flat_cosine_similarities[index]
+    # Output the bottom items and scores
+    print(f"\nBottom {args.bottom} items and scores:")
+    for item1, item2, score in bottom_pairs:
         print(
             f"Items: '{string_list[item1]}' and '{string_list[item2]}', Score = {score}"
         )
+
+    profiler.report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# normalize-and-deduplicate stage
+
+import unicodedata
+
+
+def normalize(string, nfkc=False):
+    """Casefold and collapse runs of whitespace, after NFKC if requested."""
+    if nfkc:
+        string = unicodedata.normalize("NFKC", string)
+    return " ".join(string.split()).casefold()
+
+
+class Deduplicated:
+    """The distinct normalized strings of a corpus and the lines behind each.
+
+    ``unique[k]`` is the normalized text shared by the lines in
+    ``groups[k]``.  Groups are ordered by first occurrence and hold line
+    indices in ascending order.  Engines score ``unique`` and call
+    :meth:`expand` to map their matches back to the original lines.
+    """
+
+    def __init__(self, strings, nfkc=False):
+        self.unique = []
+        self.groups = []
+        index = {}
+        for i, string in enumerate(strings):
+            key = normalize(string, nfkc)
+            k = index.setdefault(key, len(self.unique))
+            if k == len(self.unique):
+                self.unique.append(key)
+                self.groups.append([])
+            self.groups[k].append(i)
+
+    def multiplicity(self, k):
+        return len(self.groups[k])
+
+    def expand(self, matches, self_match):
+        """Yield ``(i, j, *rest)`` with ``i < j`` for the lines behind matches.
+
+        Args:
+          matches (Iterable[tuple]): ``(u, v, *rest)`` matches between
+            unique strings
+          self_match (Callable[[int], Optional[tuple]]): the ``rest`` of a
+            match between two lines that both normalize to ``unique[k]``, or
+            None if such lines do not match
+        """
+        for k, group in enumerate(self.groups):
+            if len(group) < 2:
+                continue
+            rest = self_match(k)
+            if rest is None:
+                continue
+            for a in range(len(group) - 1):
+                for b in range(a + 1, len(group)):
+                    yield (group[a], group[b], *rest)
+
+        for u, v, *rest in matches:
+            for i in self.groups[u]:
+                for j in self.groups[v]:
+                    yield (i, j, *rest) if i < j else (j, i, *rest)
+
+    def cluster(self, union_find, matches, self_match):
+        """Add the lines behind matches between unique strings to a
+        :class:`minortop.clusters.UnionFind` over the original lines.
+
+        Lines in one group are joined when ``self_match(k)`` is not None;
+        a match ``(u, v, ...)`` joins the first lines of the two groups.
+        """
+        for k, group in enumerate(self.groups):
+            if len(group) > 1 and self_match(k) is not None:
+                for line in group[1:]:
+                    union_find.union(group[0], line)
+        for u, v, *_ in matches:
+            union_find.union(self.groups[u][0], self.groups[v][0])
+
+
+def add_dedupe_args(parser):
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="Casefold and collapse whitespace, then score each distinct"
+        " string once and expand the matches back to the original lines.",
+    )
+    parser.add_argument(
+        "--nfkc",
+        action="store_true",
+        help="Also apply Unicode NFKC normalization (implies --dedupe).",
+    )
+
+
+def from_args(args, strings):
+    if not (args.dedupe or args.nfkc):
+        return None
+    return Deduplicated(strings, nfkc=args.nfkc)
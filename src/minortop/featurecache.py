@@ -0,0 +1,219 @@
+# persistent per-string feature cache
+
+import hashlib
+import os
+import pathlib
+import shutil
+import uuid
+
+import numpy
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Past this many segments of one feature they are merged into one, so a
+# lookup reads a bounded number of key files however many runs wrote them
+MAX_SEGMENTS = 8
+KEY_DTYPE = numpy.dtype("S16")
+
+
+def lowercase(string):
+    """Normal form of features computed from the lowercased string."""
+    return string.lower()
+
+
+def lowercase_words(string):
+    """Normal form of features computed from the lowercased words alone."""
+    return " ".join(string.lower().split())
+
+
+def feature_key(string, feature, params=()):
+    """Hash a normalized string together with the feature name and its
+    parameters."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((feature, tuple(params))).encode())
+    digest.update(b"\0")
+    digest.update(string.encode("utf-8", "surrogatepass"))
+    return digest.digest()
+
+
+class FeatureCache:
+    """On-disk store of per-string feature arrays shared by all engines.
+
+    Features are 1-D arrays computed from a single string.  They are stored
+    in immutable segments, one directory per batch of newly computed
+    strings, holding ``keys.npy`` (sorted 16-byte digests), ``offsets.npy``
+    and ``values.npy`` with the entries in key order, so a lookup is a
+    binary search of the keys it wants.  Cached arrays are returned as slices
+    of memory-mapped files.  A segment's mtime is its last use; once the
+    store grows past ``max_bytes`` the least recently used segments are
+    deleted.
+
+    Entries are keyed by the string's normal form, so strings that only
+    differ in ways the feature ignores, such as case, share one entry.
+    Each write adds a segment and past ``MAX_SEGMENTS`` a feature's segments
+    are compacted into one.
+
+    Segments are written to a temporary directory and renamed into place,
+    so several processes may share a cache: at worst they store the same
+    features twice.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def features(
+        self, strings, feature, compute, params=(), dtype=None, normalize=None
+    ):
+        """Return one feature array per string, computing only cache misses.
+
+        Args:
+          strings (List[str]): strings to featurize
+          feature (str): feature name, also the segment sub-directory
+          compute (Callable[[str], array_like]): featurizes one normalized
+            string
+          params (tuple): parameters that change the feature's value
+          dtype: dtype of the stored values, inferred when None
+          normalize (Callable[[str], str]): maps a string to the form the
+            feature depends on, such as :func:`lowercase`; strings are used
+            as they are when None
+        """
+        if normalize is not None:
+            strings = [normalize(string) for string in strings]
+        keys = [feature_key(string, feature, params) for string in strings]
+        found = self._lookup(feature, set(keys))
+
+        missing = {}
+        for key, string in zip(keys, strings):
+            if key not in found and key not in missing:
+                missing[key] = numpy.asarray(compute(string), dtype=dtype)
+        self.hits += len(strings) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            found.update(missing)
+            self._write_segment(feature, missing)
+            self._compact(feature)
+            self._evict()
+
+        return [found[key] for key in keys]
+
+    def _segments(self, feature=None):
+        root = self.directory if feature is None else self.directory / feature
+        pattern = "*/*/keys.npy" if feature is None else "*/keys.npy"
+        # Staging directories of in-flight writes start with a dot
+        return [
+            path.parent
+            for path in root.glob(pattern)
+            if not path.parent.name.startswith(".")
+        ]
+
+    @staticmethod
+    def _read_segment(segment):
+        """The memory-mapped sorted keys, offsets and values of a segment.
+
+        Returns None if another process removed the segment meanwhile.
+        """
+        try:
+            keys = numpy.load(segment / "keys.npy", mmap_mode="r")
+            offsets = numpy.load(segment / "offsets.npy", mmap_mode="r")
+            values = numpy.load(segment / "values.npy", mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        if keys.dtype != KEY_DTYPE:  # written before keys were sorted
+            return None
+        return keys, offsets, values
+
+    def _lookup(self, feature, wanted):
+        # numpy drops trailing NUL bytes from S16 items, so found entries
+        # are keyed by the wanted digests rather than by the stored ones
+        wanted = list(wanted)
+        remaining = numpy.array(wanted, dtype=KEY_DTYPE)
+        indices = numpy.arange(len(wanted))
+        found = {}
+        for segment in self._segments(feature):
+            if not len(remaining):
+                break
+            contents = self._read_segment(segment)
+            if contents is None or not len(contents[0]):
+                continue
+            keys, offsets, values = contents
+            rows = numpy.searchsorted(keys, remaining)
+            rows[rows == len(keys)] = 0
+            hits = keys[rows] == remaining
+            if not hits.any():
+                continue
+            for index, row in zip(indices[hits].tolist(), rows[hits].tolist()):
+                found[wanted[index]] = values[offsets[row] : offsets[row + 1]]
+            remaining, indices = remaining[~hits], indices[~hits]
+            os.utime(segment)
+        return found
+
+    def _compact(self, feature):
+        segments = self._segments(feature)
+        if len(segments) <= MAX_SEGMENTS:
+            return
+        merged = {}
+        for segment in segments:
+            contents = self._read_segment(segment)
+            if contents is None:
+                continue
+            keys, offsets, values = contents
+            raw = keys.tobytes()
+            for row in range(len(keys)):
+                key = raw[16 * row : 16 * row + 16]
+                merged[key] = values[offsets[row] : offsets[row + 1]]
+        self._write_segment(feature, merged)
+        for segment in segments:
+            shutil.rmtree(segment, ignore_errors=True)
+
+    def _write_segment(self, feature, arrays):
+        keys = sorted(arrays)
+        values = [arrays[key] for key in keys]
+        lengths = [len(array) for array in values]
+        offsets = numpy.zeros(len(values) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=offsets[1:])
+
+        root = self.directory / feature
+        root.mkdir(parents=True, exist_ok=True)
+        name = uuid.uuid4().hex
+        staging = root / f".{name}.tmp"
+        staging.mkdir()
+        keys = numpy.frombuffer(b"".join(keys), dtype=KEY_DTYPE)
+        numpy.save(staging / "keys.npy", keys)
+        numpy.save(staging / "offsets.npy", offsets)
+        numpy.save(staging / "values.npy", numpy.concatenate(values))
+        staging.rename(root / name)
+
+    def size(self):
+        return sum(
+            path.stat().st_size
+            for segment in self._segments()
+            for path in segment.iterdir()
+        )
+
+    def _evict(self):
+        segments = sorted(self._segments(), key=lambda path: path.stat().st_mtime)
+        total = self.size()
+        # The newest segment is always kept, even if it alone exceeds the cap
+        for segment in segments[:-1]:
+            if total <= self.max_bytes:
+                break
+            total -= sum(path.stat().st_size for path in segment.iterdir())
+            shutil.rmtree(segment, ignore_errors=True)
+
+
+def add_feature_cache_arg(parser):
+    parser.add_argument(
+        "--feature-cache",
+        default=None,
+        metavar="DIR",
+        help="Directory of a persistent per-string feature cache.",
+    )
+
+
+def from_args(args):
+    if args.feature_cache is None:
+        return None
+    return FeatureCache(args.feature_cache)
@@ -0,0 +1,62 @@
+# incremental append mode
+
+import hashlib
+import json
+import os
+import pathlib
+
+
+def fingerprint(strings):
+    digest = hashlib.sha256()
+    for string in strings:
+        digest.update(string.encode("utf-8", "surrogatepass"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def load_state(path, strings, params):
+    """Return ``(start, matches)`` saved by a previous run.
+
+    ``start`` is the number of leading strings whose pairs were already
+    scored, so only pairs with ``j >= start`` remain.  It is 0, with no
+    matches, when there is no usable state: the file is missing, the run
+    used different parameters, or the corpus was edited rather than
+    appended to.
+    """
+    path = pathlib.Path(path)
+    if not path.exists():
+        return 0, []
+
+    state = json.loads(path.read_text())
+    count = state["line_count"]
+    if (
+        state["params"] != json.loads(json.dumps(params))
+        or count > len(strings)
+        or state["fingerprint"] != fingerprint(strings[:count])
+    ):
+        return 0, []
+    return count, [tuple(match) for match in state["matches"]]
+
+
+def save_state(path, strings, params, matches):
+    """Record the corpus and every accepted match for the next run."""
+    path = pathlib.Path(path)
+    state = {
+        "params": params,
+        "line_count": len(strings),
+        "fingerprint": fingerprint(strings),
+        "matches": [list(match) for match in matches],
+    }
+    staging = path.with_name(f".{path.name}.tmp")
+    staging.write_text(json.dumps(state))
+    os.replace(staging, path)
+
+
+def add_incremental_arg(parser):
+    parser.add_argument(
+        "--incremental",
+        default=None,
+        metavar="STATE",
+        help="State file from the previous run; when the input has only been"
+        " appended to, only pairs involving new lines are scored.",
+    )
@@ -21,11 +21,11 @@ References:
 """
 
 import argparse
+import importlib
 import logging
 import sys
 
-from minortop import __version__, args_common
-from minortop import cosine_similarity as cosine_similarity_module
+from minortop import __version__, args_common, profiling
 
 __author__ = "Taylor Monacelli"
 __copyright__ = "Taylor Monacelli"
@@ -83,6 +83,75 @@ def setup_logging(loglevel, logger=None):
     logger.addHandler(handler)
 
 
+# Subcommand registry: name -> (module, entry point, help, aliases).
+# Engine modules pull in numpy, scikit-learn, Biopython and friends at import
+# time, so they are only imported once their subcommand actually runs.  The
+# entry point receives the remaining command line arguments as a list.
+SUBCOMMANDS = {
+    "cosine-similarity": (
+        "minortop.cosine_similarity",
+        "main",
+        "Top and bottom pairs by token-count cosine similarity.",
+        ["cosine"],
+    ),
+    "bootfamily": (
+        "minortop.bootfamily",
+        "run",
+        "Pairs above a token-count cosine similarity threshold.",
+        ["token-cosine"],
+    ),
+    "britishcouch": (
+        "minortop.britishcouch",
+        "main",
+        "String similarity using the Needleman-Wunsch algorithm.",
+        ["needleman-wunsch"],
+    ),
+    "portflower": (
+        "minortop.portflower",
+        "main",
+        "Levenshtein, Jaccard and character cosine scoring.",
+        ["levenshtein"],
+    ),
+    "reasonlabel": (
+        "minortop.reasonlabel",
+        "main",
+        "Compare strings using Jaro-Winkler similarity.",
+        ["jaro-winkler"],
+    ),
+    "refuseapprove": (
+        "minortop.refuseapprove",
+        "main",
+        "Pairs above a PairwiseAligner alignment score.",
+        ["align"],
+    ),
+    "soundex": (
+        "minortop.soundex",
+        "main",
+        "String similarity using the Soundex algorithm.",
+        [],
+    ),
+    "pack-corpus": (
+        "minortop.corpus",
+        "main",
+        "Pack a text file into a binary corpus with a stored line index.",
+        [],
+    ),
+}
+
+_ALIASES = {
+    alias: name
+    for name, (_module, _entry, _help, aliases) in SUBCOMMANDS.items()
+    for alias in [name] + aliases
+}
+
+
+def run_subcommand(name, argv):
+    """Import the engine behind subcommand ``name`` and run it with argv"""
+    module_name, entry_point, _help, _aliases = SUBCOMMANDS[_ALIASES[name]]
+    module = importlib.import_module(module_name)
+    return getattr(module, entry_point)(argv)
+
+
 parser = argparse.ArgumentParser(
     description="Just a command, sub command, subsub command demonstration"
 )
@@ -94,7 +163,12 @@ parser.add_argument(
 )
 
 args_common.add_common_args(parser)
-cosine_similarity_module.add_subparsers(parser)
+profiling.add_profile_args(parser)
+
+subparsers = parser.add_subparsers(dest="subcommand", metavar="<algo>")
+for _name, (_module, _entry, _help, _aliases) in SUBCOMMANDS.items():
+    # Options are parsed by the engine itself, including its --help
+    subparsers.add_parser(_name, help=_help, aliases=_aliases, add_help=False)
 
 
 def main(args):
@@ -107,13 +181,23 @@ def main(args):
       args (List[str]): command line parameters as list of strings
           (for example  ``["--verbose", "42"]``).
     """
-    args = parser.parse_args(args)
+    args, engine_args = parser.parse_known_args(args)
+    if args.subcommand is None:
+        if engine_args:
+            parser.error(f"unrecognized arguments: {' '.join(engine_args)}")
+        parser.print_help()
+        return 1
+
     setup_logging(args.loglevel)
     _logger.debug("Starting crazy calculations...")
-    cosine_similarity = getattr(args, "cosine_similarity", None)
 
-    if cosine_similarity:
-        cosine_similarity_module.main(args)
+    # Profiling is done by the engine, which knows its own phases
+    if args.profile:
+        engine_args.append("--profile")
+    if args.profile_stats:
+        engine_args += ["--profile-stats", args.profile_stats]
+
+    run_subcommand(args.subcommand, engine_args)
 
     _logger.info("Script ends here")
 
@@ -1,11 +1,24 @@
 # levenshtein, jaccard and cosine
 
 import argparse
+import collections
+import concurrent.futures
 import logging
 import math
 import os
 
 import Levenshtein
+import numpy
+
+from . import (
+    clusters,
+    corpus,
+    dedupe,
+    featurecache,
+    incremental,
+    profiling,
+    sinks,
+)
 
 
 class SimilarityCalculator:
@@ -15,6 +28,39 @@ class SimilarityCalculator:
     def calculate_similarity(self, string1, string2):
         return self.algorithm.calculate_similarity(string1, string2)
 
+    def row_scorer(self, strings):
+        # Algorithms may provide a corpus-level scorer; otherwise score per pair
+        build = getattr(self.algorithm, "row_scorer", None)
+        if build is not None:
+            return build(strings)
+        return PairwiseRowScorer(strings, self)
+
+    def warm_feature_cache(self, strings):
+        # Featurizes cache misses once, before worker processes would each
+        # compute and store them
+        warm = getattr(self.algorithm, "warm_feature_cache", None)
+        if warm is not None:
+            warm(strings)
+
+
+class PairwiseRowScorer:
+    def __init__(self, strings, similarity_calculator):
+        self.strings = strings
+        self.similarity_calculator = similarity_calculator
+
+    def score_rows(self, rows, score_threshold, start=0):
+        # Only pairs with j >= start are scored (see incremental mode)
+        strings = self.strings
+        pairs = []
+        for i in rows:
+            for j in range(max(i + 1, start), len(strings)):
+                similarity = self.similarity_calculator.calculate_similarity(
+                    strings[i], strings[j]
+                )
+                if similarity <= score_threshold:
+                    pairs.append(((i, j), similarity))
+        return pairs
+
 
 class LevenshteinAlgorithm:
     @staticmethod
@@ -22,7 +68,90 @@ class LevenshteinAlgorithm:
         return Levenshtein.distance(string1.lower(), string2.lower())
 
 
+class BKTreeLevenshteinAlgorithm(LevenshteinAlgorithm):
+    @staticmethod
+    def row_scorer(strings):
+        return BKTreeScorer(strings)
+
+
+class BKTree:
+    """Burkhard-Keller metric tree over the lowercased strings.
+
+    Children are keyed by their Levenshtein distance to the parent, so a
+    query with radius ``r`` only descends into children whose key lies
+    within ``r`` of the query's distance to the parent (triangle
+    inequality).  ``visits`` counts every node whose distance was computed.
+    """
+
+    def __init__(self, strings):
+        self.strings = [string.lower() for string in strings]
+        self.root = None
+        self.visits = 0
+        self.queries = 0
+        for index in range(len(self.strings)):
+            self._add(index)
+
+    def _add(self, index):
+        string = self.strings[index]
+        if self.root is None:
+            self.root = (index, {})
+            return
+        node = self.root
+        while True:
+            distance = Levenshtein.distance(string, self.strings[node[0]])
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (index, {})
+                return
+            node = child
+
+    def query(self, string, radius):
+        """Return ``(index, distance)`` for every string within radius."""
+        return self._query(string.lower(), radius)
+
+    def _query(self, string, radius):
+        self.queries += 1
+        matches = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            index, children = stack.pop()
+            self.visits += 1
+            distance = Levenshtein.distance(string, self.strings[index])
+            if distance <= radius:
+                matches.append((index, distance))
+            for key, child in children.items():
+                if distance - radius <= key <= distance + radius:
+                    stack.append(child)
+        return matches
+
+
+class BKTreeScorer:
+    def __init__(self, strings):
+        self.tree = BKTree(strings)
+
+    @property
+    def stats(self):
+        return {"nodes visited": self.tree.visits, "queries": self.tree.queries}
+
+    def score_rows(self, rows, score_threshold, start=0):
+        # Distances are integers, so a fractional threshold rounds down
+        radius = math.floor(score_threshold)
+        pairs = []
+        if radius < 0:
+            return pairs
+        for i in rows:
+            first = max(i + 1, start)
+            matches = self.tree._query(self.tree.strings[i], radius)
+            pairs.extend(
+                ((i, j), distance) for j, distance in sorted(matches) if j >= first
+            )
+        return pairs
+
+
 class JaccardAlgorithm:
+    def __init__(self, feature_cache=None):
+        self.feature_cache = feature_cache
+
     @staticmethod
     def calculate_similarity(string1, string2):
         set1 = set(string1.lower())
@@ -31,6 +160,100 @@ class JaccardAlgorithm:
         union = len(set1.union(set2))
         return 1.0 - intersection / union if union != 0 else 0.0
 
+    def row_scorer(self, strings):
+        return JaccardBitsetScorer(strings, self.feature_cache)
+
+    def warm_feature_cache(self, strings):
+        if self.feature_cache is not None:
+            featurize(strings, "char-set", char_codes, self.feature_cache)
+
+
+def char_codes(string):
+    """Sorted code points of the distinct lowercased characters."""
+    return numpy.array(sorted(set(map(ord, string.lower()))), dtype=numpy.uint32)
+
+
+def char_counts(string):
+    """Interleaved ``(code point, count)`` pairs of the lowercased characters."""
+    counts = sorted(collections.Counter(map(ord, string.lower())).items())
+    return numpy.array([value for item in counts for value in item], numpy.uint32)
+
+
+def featurize(strings, feature, compute, feature_cache=None):
+    if feature_cache is None:
+        return [compute(string) for string in strings]
+    # Both features lowercase first, so strings differing in case share one
+    # cache entry
+    return feature_cache.features(
+        strings,
+        feature,
+        compute,
+        dtype=numpy.uint32,
+        normalize=featurecache.lowercase,
+    )
+
+
+def _flatten(arrays):
+    # Row index of every element alongside the concatenated values
+    lengths = [len(array) for array in arrays]
+    rows = numpy.repeat(numpy.arange(len(arrays)), lengths)
+    values = numpy.concatenate(arrays) if arrays else numpy.zeros(0, numpy.uint32)
+    return rows, values
+
+
+def popcount(words):
+    """Count set bits along the last axis of a uint64 array."""
+    if hasattr(numpy, "bitwise_count"):
+        counts = numpy.bitwise_count(words)
+    else:  # numpy < 2.0
+        counts = numpy.unpackbits(words.view(numpy.uint8), axis=-1)
+    return counts.sum(axis=-1, dtype=numpy.int64)
+
+
+class JaccardBitsetScorer:
+    """Jaccard distance over per-string character bitmasks.
+
+    Every string's lowercased character set is encoded once as a row of
+    uint64 words over the corpus alphabet, so a whole row of the triangle is
+    scored with vectorized AND/OR and popcount.
+    """
+
+    def __init__(self, strings, feature_cache=None):
+        rows, codes = _flatten(
+            featurize(strings, "char-set", char_codes, feature_cache)
+        )
+        alphabet = numpy.unique(codes)
+        words = max(1, (len(alphabet) + 63) // 64)
+
+        bits = numpy.searchsorted(alphabet, codes)
+        self.masks = numpy.zeros((len(strings), words), dtype=numpy.uint64)
+        numpy.bitwise_or.at(
+            self.masks,
+            (rows, bits // 64),
+            numpy.left_shift(numpy.uint64(1), (bits % 64).astype(numpy.uint64)),
+        )
+
+    def distances(self, i, first=None):
+        """Return the distances from string ``i`` to strings ``first`` onwards.
+
+        ``first`` defaults to ``i + 1``, every later string.
+        """
+        mask = self.masks[i]
+        others = self.masks[i + 1 if first is None else first :]
+        intersection = popcount(others & mask)
+        union = popcount(others | mask)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return numpy.where(union != 0, 1.0 - intersection / union, 0.0)
+
+    def score_rows(self, rows, score_threshold, start=0):
+        pairs = []
+        for i in rows:
+            first = max(i + 1, start)
+            distances = self.distances(i, first)
+            for offset in numpy.flatnonzero(distances <= score_threshold):
+                pairs.append(((i, first + int(offset)), float(distances[offset])))
+        return pairs
+
 
 class CosineSimilarityAlgorithm:
     @staticmethod
@@ -51,31 +274,274 @@ class CosineSimilarityAlgorithm:
         )
 
 
-def read_file(file_path):
-    with open(file_path, "r") as file:
-        return file.read().splitlines()
+class CosineMatrixScorer:
+    """Character-frequency cosine similarity computed by matrix products.
 
+    The corpus is turned into one character-count matrix; blocks of rows
+    are then scored against the rest of the corpus with a single matrix
+    multiplication.  The counts are integers, so the dot products are exact,
+    and dividing them by the product of the two magnitudes repeats the
+    arithmetic of :class:`CosineSimilarityAlgorithm`: scores are the same to
+    the last bit and ties fall on the same side of the threshold.
+    """
 
-def find_pairs_below_score(strings, score_threshold, similarity_calculator):
+    block_size = 256
+
+    def __init__(self, strings, feature_cache=None):
+        rows, pairs = _flatten(
+            featurize(strings, "char-counts", char_counts, feature_cache)
+        )
+        rows, codes, frequencies = rows[::2], pairs[::2], pairs[1::2]
+        alphabet = numpy.unique(codes)
+
+        counts = numpy.zeros((len(strings), max(1, len(alphabet))))
+        counts[rows, numpy.searchsorted(alphabet, codes)] = frequencies
+
+        self.counts = counts
+        # Sums of squared counts are exact, so these are math.sqrt's results
+        self.magnitudes = numpy.sqrt(numpy.square(counts).sum(axis=1))
+
+    def score_rows(self, rows, score_threshold, start=0):
+        rows = list(rows)
+        pairs = []
+        for block_start in range(0, len(rows), self.block_size):
+            block_rows = rows[block_start : block_start + self.block_size]
+            # Columns left of the first pair of every row in the block
+            # would only be thrown away, so they are not multiplied
+            lowest = max(min(block_rows) + 1, start)
+            block = self.counts[block_rows] @ self.counts[lowest:].T
+            for dot_products, i in zip(block, block_rows):
+                first = max(i + 1, start)
+                magnitudes = self.magnitudes[i] * self.magnitudes[first:]
+                similarities = numpy.divide(
+                    dot_products[first - lowest :],
+                    magnitudes,
+                    out=numpy.zeros(len(magnitudes)),
+                    where=magnitudes != 0,
+                )
+                for offset in numpy.flatnonzero(similarities <= score_threshold):
+                    pairs.append(
+                        ((i, first + int(offset)), float(similarities[offset]))
+                    )
+        return pairs
+
+
+class BatchedCosineSimilarityAlgorithm(CosineSimilarityAlgorithm):
+    def __init__(self, feature_cache=None):
+        self.feature_cache = feature_cache
+
+    def row_scorer(self, strings):
+        return CosineMatrixScorer(strings, self.feature_cache)
+
+    def warm_feature_cache(self, strings):
+        if self.feature_cache is not None:
+            featurize(strings, "char-counts", char_counts, self.feature_cache)
+
+
+def read_file(file_path):
+    return corpus.load(file_path).tolist()
+
+
+def pair_count(count, start=0):
+    """Number of pairs ``(i, j)``, ``i < j``, with ``j >= start``."""
+    start = min(max(start, 0), count)
+    new = count - start
+    return start * new + new * (new - 1) // 2
+
+
+def balanced_row_blocks(count, blocks, start=0):
+    """Split the rows of the upper triangle into contiguous blocks.
+
+    Row ``i`` holds ``count - max(i + 1, start)`` pairs, only those with
+    ``j >= start`` being scored, so the blocks are cut where the running
+    pair count reaches each multiple of ``total / blocks`` rather than at
+    equal row counts: before or after the row that crosses it, whichever
+    is nearer.
+    """
+    total = pair_count(count, start)
+    if total == 0:
+        return [range(count)] if count else []
+
+    bounds = [0]
+    seen = 0
+    for i in range(count):
+        before, seen = seen, seen + count - max(i + 1, start)
+        # Pair counts are scaled by blocks to keep the targets integers
+        while len(bounds) < blocks and seen * blocks >= total * len(bounds):
+            target = total * len(bounds)
+            nearer_before = target - before * blocks < seen * blocks - target
+            cut = i if nearer_before and i > bounds[-1] else i + 1
+            if cut <= bounds[-1]:
+                break
+            bounds.append(cut)
+    if bounds[-1] != count:
+        bounds.append(count)
+    return [range(start, stop) for start, stop in zip(bounds, bounds[1:])]
+
+
+_worker_scorer = None
+
+
+def _init_worker(strings, similarity_calculator):
+    # Runs once per worker process so the corpus is neither pickled nor
+    # featurized per task
+    global _worker_scorer
+    _worker_scorer = similarity_calculator.row_scorer(strings)
+
+
+def _scorer_stats(scorer):
+    return dict(getattr(scorer, "stats", {}))
+
+
+def _score_block(rows, score_threshold, start):
+    before = _scorer_stats(_worker_scorer)
+    pairs = _worker_scorer.score_rows(rows, score_threshold, start)
+    after = _scorer_stats(_worker_scorer)
+    return pairs, {key: after[key] - before.get(key, 0) for key in after}
+
+
+# Pairs covered by one call in the serial loop, so streaming consumers such
+# as --cluster only hold one block's matches at a time
+PAIRS_PER_BLOCK = 1 << 20
+
+
+def iter_pair_blocks(
+    strings,
+    score_threshold,
+    similarity_calculator,
+    workers=1,
+    stats=None,
+    start=0,
+    scorer=None,
+):
+    """Yield lists of ``((i, j), score)`` within the threshold, in row order.
+
+    Each list holds the matches of one block of rows.  ``scorer`` reuses a
+    row scorer already built for ``strings`` in the serial case.
+    """
+    if stats is None:
+        stats = {}
+    count = len(strings)
+    if workers <= 1:
+        if scorer is None:
+            scorer = similarity_calculator.row_scorer(strings)
+        blocks = math.ceil(pair_count(count, start) / PAIRS_PER_BLOCK)
+        for rows in balanced_row_blocks(count, max(1, blocks), start):
+            yield scorer.score_rows(rows, score_threshold, start)
+        stats.update(_scorer_stats(scorer))
+        return
+
+    similarity_calculator.warm_feature_cache(strings)
+    # Several blocks per worker keeps every core busy until the end
+    blocks = balanced_row_blocks(count, workers * 4, start)
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(strings, similarity_calculator),
+    ) as executor:
+        # map() yields blocks in row order, so the merged list is in the
+        # same (i, j) order as the serial loop before the stable sort
+        for block_pairs, block_stats in executor.map(
+            _score_block,
+            blocks,
+            [score_threshold] * len(blocks),
+            [start] * len(blocks),
+        ):
+            for key, value in block_stats.items():
+                stats[key] = stats.get(key, 0) + value
+            yield block_pairs
+
+
+def find_pairs_below_score(
+    strings,
+    score_threshold,
+    similarity_calculator,
+    workers=1,
+    stats=None,
+    start=0,
+    profiler=profiling.DISABLED,
+):
+    """Return ``((i, j), score)`` for every pair within the threshold.
+
+    If ``stats`` is a dict it is updated with the scorer's counters, such as
+    the BK-tree node visits.  With ``start`` only pairs whose second string
+    is at index ``start`` or later are scored.
+    """
+    scorer = None
+    if workers <= 1:
+        with profiler.phase("featurize"):
+            scorer = similarity_calculator.row_scorer(strings)
     pairs = []
-    for i in range(len(strings)):
-        for j in range(i + 1, len(strings)):
-            similarity = similarity_calculator.calculate_similarity(
-                strings[i], strings[j]
-            )
-            if similarity <= score_threshold:
-                pairs.append(((i, j), similarity))
-    pairs.sort(key=lambda x: x[1])
+    with profiler.phase("score"):
+        for block in iter_pair_blocks(
+            strings,
+            score_threshold,
+            similarity_calculator,
+            workers,
+            stats,
+            start,
+            scorer,
+        ):
+            pairs.extend(block)
+    with profiler.phase("sort"):
+        # By score, then row-major, whatever order the blocks arrived in
+        pairs.sort(key=lambda x: (x[1], x[0]))
     return pairs
 
 
+def cluster_below_score(
+    strings,
+    score_threshold,
+    similarity_calculator,
+    workers=1,
+    stats=None,
+    deduplicated=None,
+    profiler=profiling.DISABLED,
+):
+    """Return a :class:`~minortop.clusters.UnionFind` over ``strings`` that
+    joins every pair within the threshold.
+
+    Pairs are added block by block as they are scored, so the full list of
+    matches is never built.  With ``deduplicated`` only its distinct strings
+    are scored.
+    """
+    union_find = clusters.UnionFind(len(strings))
+    scored = strings if deduplicated is None else deduplicated.unique
+
+    scorer = None
+    if workers <= 1:
+        with profiler.phase("featurize"):
+            scorer = similarity_calculator.row_scorer(scored)
+    with profiler.phase("score"):
+        blocks = iter_pair_blocks(
+            scored,
+            score_threshold,
+            similarity_calculator,
+            workers,
+            stats,
+            scorer=scorer,
+        )
+        matches = ((i, j, score) for block in blocks for (i, j), score in block)
+        if deduplicated is None:
+            union_find.add_matches(matches)
+        else:
+
+            def self_match(k):
+                string = scored[k]
+                score = similarity_calculator.calculate_similarity(string, string)
+                return (score,) if score <= score_threshold else None
+
+            deduplicated.cluster(union_find, matches, self_match)
+    return union_find
+
+
 def quote_if_whitespace(word):
     if word[0].isspace() or word[-1].isspace():
         return f'"{word}"'
     return word
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="String similarity scoring using different algorithms."
     )
@@ -93,41 +559,156 @@ def main():
         default="levenshtein",
         help="Similarity calculation algorithm.",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--batched",
+        action="store_true",
+        help="Score cosine similarity with blocked matrix products"
+        " (matches the per-pair scores within floating-point tolerance).",
+    )
+    parser.add_argument(
+        "--bk-tree",
+        action="store_true",
+        help="Answer Levenshtein threshold queries from a BK-tree index.",
+    )
+    featurecache.add_feature_cache_arg(parser)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes used to score pairs.",
+    )
+    incremental.add_incremental_arg(parser)
+    dedupe.add_dedupe_args(parser)
+    clusters.add_cluster_arg(parser)
+    sinks.add_output_args(parser)
+    profiling.add_profile_args(parser)
+    args = parser.parse_args(argv)
+    sinks.check_output_args(parser, args)
+    if args.batched and args.algorithm != "cosine":
+        parser.error("--batched only applies to --algorithm cosine")
+    if args.incremental and (args.dedupe or args.nfkc):
+        parser.error("--dedupe cannot be combined with --incremental")
+    if args.cluster and (args.incremental or args.output_format != "text"):
+        parser.error("--cluster only writes text and cannot be incremental")
+    feature_cache = featurecache.from_args(args)
+    profiler = profiling.from_args(args)
 
     # Set up similarity calculator based on the chosen algorithm
-    if args.algorithm == "levenshtein":
+    if args.algorithm == "levenshtein" and args.bk_tree:
+        similarity_calculator = SimilarityCalculator(BKTreeLevenshteinAlgorithm())
+    elif args.algorithm == "levenshtein":
         similarity_calculator = SimilarityCalculator(LevenshteinAlgorithm())
     elif args.algorithm == "jaccard":
-        similarity_calculator = SimilarityCalculator(JaccardAlgorithm())
+        similarity_calculator = SimilarityCalculator(JaccardAlgorithm(feature_cache))
+    elif args.algorithm == "cosine" and args.batched:
+        similarity_calculator = SimilarityCalculator(
+            BatchedCosineSimilarityAlgorithm(feature_cache)
+        )
     elif args.algorithm == "cosine":
         similarity_calculator = SimilarityCalculator(CosineSimilarityAlgorithm())
     else:
         raise ValueError("Invalid algorithm choice.")
 
     # Read strings from the file
-    strings = read_file(args.file_path)
+    with profiler.phase("read"):
+        strings = read_file(args.file_path)
 
     # Count of the total number of items in data.txt
     total_items = len(strings)
 
+    # Score each distinct normalized string once
+    with profiler.phase("dedupe"):
+        deduplicated = dedupe.from_args(args, strings)
+    scored = strings if deduplicated is None else deduplicated.unique
+
+    if args.cluster:
+        stats = {}
+        union_find = cluster_below_score(
+            strings,
+            args.score,
+            similarity_calculator,
+            workers=args.workers,
+            stats=stats,
+            deduplicated=deduplicated,
+            profiler=profiler,
+        )
+        with profiler.phase("output"):
+            clusters.print_clusters(strings, union_find.components(), total_items)
+        profiler.add_pairs(len(scored) * (len(scored) - 1) // 2)
+        profiler.report()
+        return
+
+    # Resume from the previous run's matches if the file was only appended to
+    start, previous = 0, []
+    if args.incremental:
+        params = {"engine": "portflower", "algorithm": args.algorithm}
+        params.update(score=args.score, batched=args.batched)
+        start, previous = incremental.load_state(args.incremental, strings, params)
+
     # Find and print the pairs below the score threshold
+    stats = {}
     pairs_below_score = find_pairs_below_score(
-        strings, args.score, similarity_calculator
+        scored,
+        args.score,
+        similarity_calculator,
+        workers=args.workers,
+        stats=stats,
+        start=start,
+        profiler=profiler,
     )
+    profiler.add_pairs(len(scored) * (len(scored) - 1) // 2 - start * (start - 1) // 2)
+    if deduplicated is not None:
+
+        def self_match(k):
+            string = deduplicated.unique[k]
+            score = similarity_calculator.calculate_similarity(string, string)
+            return (score,) if score <= args.score else None
+
+        matches = ((u, v, score) for (u, v), score in pairs_below_score)
+        pairs_below_score = [
+            ((i, j), score) for i, j, score in deduplicated.expand(matches, self_match)
+        ]
+        pairs_below_score.sort(key=lambda x: (x[1], x[0]))
+    profiler.add_matches(len(pairs_below_score))
+    if args.incremental:
+        pairs_below_score += [((i, j), score) for i, j, score in previous]
+        # Same order as a full run: by score, then row-major
+        pairs_below_score.sort(key=lambda x: (x[1], x[0]))
+        incremental.save_state(
+            args.incremental,
+            strings,
+            params,
+            [(i, j, score) for (i, j), score in pairs_below_score],
+        )
     count_below_score = len(pairs_below_score)
 
-    for (i, j), similarity in pairs_below_score:
+    def format_match(i, j, similarity):
         quoted_str1 = quote_if_whitespace(strings[i])
         quoted_str2 = quote_if_whitespace(strings[j])
-        print(f"score: {similarity:,.2f}\n{quoted_str1}\n{quoted_str2}\n")
+        return f"score: {similarity:,.2f}\n{quoted_str1}\n{quoted_str2}\n\n"
+
+    with profiler.phase("output"), sinks.from_args(args, strings, format_match) as sink:
+        for (i, j), similarity in pairs_below_score:
+            sink.write(i, j, similarity)
 
     print(
         "Number of items found within score "
         f"threshold {args.score:,.2f}: {count_below_score:,d}\n"
-        f"Total number of items in {args.file_path}: {total_items:,d}\n"
+        f"Total number of items in {args.file_path}: {total_items:,d}\n",
+        file=sink.report_file,
     )
 
+    if "nodes visited" in stats:
+        brute_force = stats["queries"] * len(scored)
+        print(
+            f"BK-tree nodes visited: {stats['nodes visited']:,d}"
+            f" of {brute_force:,d} brute-force comparisons"
+            f" ({stats['nodes visited'] / max(brute_force, 1):.1%})\n",
+            file=sink.report_file,
+        )
+
+    profiler.report()
+
 
 if __name__ == "__main__":
     # Set up logging if logging is enabled
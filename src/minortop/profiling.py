@@ -0,0 +1,138 @@
+# phase timing and throughput instrumentation
+
+import contextlib
+import cProfile
+import json
+import resource
+import sys
+import time
+
+
+def add_profile_args(parser):
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Report per-phase wall/CPU time, throughput and peak memory"
+        " on stderr, as a summary and as JSON.",
+    )
+    parser.add_argument(
+        "--profile-stats",
+        default=None,
+        metavar="PATH",
+        help="Also dump cProfile statistics to PATH (implies --profile).",
+    )
+
+
+def from_args(args):
+    if not (args.profile or args.profile_stats):
+        return DISABLED
+    return Profiler(stats_path=args.profile_stats)
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class Profiler:
+    """Collect per-phase timings and pair counters for one run.
+
+    CPU time is that of the current process, so work done by ``--workers``
+    processes shows up as wall time only.
+    """
+
+    enabled = True
+
+    def __init__(self, stats_path=None):
+        self.phases = []
+        self.pairs = 0
+        self.matches = 0
+        self.stats_path = stats_path
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._cprofile = None
+        if stats_path is not None:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.phases.append(
+                {
+                    "phase": name,
+                    "wall_seconds": time.perf_counter() - wall,
+                    "cpu_seconds": time.process_time() - cpu,
+                    "peak_rss_bytes": peak_rss_bytes(),
+                }
+            )
+
+    def add_pairs(self, count):
+        self.pairs += count
+
+    def add_matches(self, count):
+        self.matches += count
+
+    def summary(self):
+        wall = time.perf_counter() - self._wall
+        return {
+            "phases": self.phases,
+            "wall_seconds": wall,
+            "cpu_seconds": time.process_time() - self._cpu,
+            "pairs_evaluated": self.pairs,
+            "pairs_per_second": self.pairs / wall if wall else 0.0,
+            "matches_kept": self.matches,
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+
+    def report(self, file=None):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.stats_path)
+
+        file = sys.stderr if file is None else file
+        summary = self.summary()
+        print(
+            f"{'phase':<12} {'wall (s)':>10} {'cpu (s)':>10} {'peak MiB':>10}",
+            file=file,
+        )
+        for phase in summary["phases"] + [dict(summary, phase="total")]:
+            print(
+                f"{phase['phase']:<12} {phase['wall_seconds']:>10.3f}"
+                f" {phase['cpu_seconds']:>10.3f}"
+                f" {phase['peak_rss_bytes'] / 2**20:>10.1f}",
+                file=file,
+            )
+        print(
+            f"pairs evaluated: {summary['pairs_evaluated']:,}"
+            f" ({summary['pairs_per_second']:,.0f} pairs/s),"
+            f" matches kept: {summary['matches_kept']:,}",
+            file=file,
+        )
+        print(json.dumps(summary), file=file)
+
+
+class _DisabledProfiler:
+    """Stand-in used when profiling is off; every hook is a no-op."""
+
+    enabled = False
+    _null = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self._null
+
+    def add_pairs(self, count):
+        pass
+
+    def add_matches(self, count):
+        pass
+
+    def report(self, file=None):
+        pass
+
+
+DISABLED = _DisabledProfiler()
@@ -3,37 +3,227 @@
 import argparse
 
 import jarowinkler
+import numpy
 
+from . import clusters, corpus, dedupe, incremental, profiling, sinks
 
-def compare_strings(strings_to_compare, similarity_threshold):
-    # Create a list of tuples containing the original
+# jarowinkler_similarity defaults: prefix weight and longest prefix rewarded
+PREFIX_WEIGHT = 0.1
+MAX_PREFIX = 4
+
+# Slack so that rounding in the library never makes the bound too tight
+BOUND_EPSILON = 1e-9
+
+
+def common_prefix_length(string1, string2, limit=MAX_PREFIX):
+    length = 0
+    for char1, char2 in zip(string1[:limit], string2[:limit]):
+        if char1 != char2:
+            break
+        length += 1
+    return length
+
+
+def jarowinkler_upper_bound(len1, len2, prefix=MAX_PREFIX):
+    """Upper bound on the Jaro-Winkler similarity of two strings.
+
+    At most ``min(len1, len2)`` characters can match, so Jaro is at most
+    ``(2 + min / max) / 3``; the Winkler boost then adds at most
+    ``prefix * PREFIX_WEIGHT * (1 - jaro)``.
+    """
+    if len1 == 0 or len2 == 0:
+        return 1.0 if len1 == len2 else 0.0
+    jaro = (2.0 + min(len1, len2) / max(len1, len2)) / 3.0
+    return jaro + prefix * PREFIX_WEIGHT * (1.0 - jaro)
+
+
+# Fields of the match rows handed to the result sink
+FIELDS = ("jaro", "jaro_winkler")
+
+
+def match_formatter(strings_to_compare):
+    def format_match(i, j, jaro_sim, jarowinkler_sim):
+        return (
+            f"score1: {jaro_sim:.3f}, score2: {jarowinkler_sim:.3f}\n"
+            f"{strings_to_compare[i]}\n{strings_to_compare[j]}\n\n"
+        )
+
+    return format_match
+
+
+def length_spans(lengths, similarity_threshold):
+    """Sort string indices by length and find, for each length, the slice
+    of that order holding every length the bound lets it match.
+
+    Returns ``(order, spans)``: the indices sorted by length and a dict from
+    each length to a ``(begin, end)`` slice of ``order``.  The bound falls
+    as lengths move apart, so each span is grown outwards one distinct
+    length at a time until the bound drops below the threshold.
+    """
+    threshold = similarity_threshold - BOUND_EPSILON
+    lengths = numpy.asarray(lengths, dtype=numpy.intp)
+    order = numpy.argsort(lengths, kind="stable")
+    sorted_lengths = lengths[order]
+    distinct = numpy.unique(lengths).tolist()
+
+    spans = {}
+    for a, length in enumerate(distinct):
+        if jarowinkler_upper_bound(length, length) < threshold:
+            spans[length] = (0, 0)
+            continue
+        low = a
+        while (
+            low > 0 and jarowinkler_upper_bound(length, distinct[low - 1]) >= threshold
+        ):
+            low -= 1
+        high = a
+        while (
+            high + 1 < len(distinct)
+            and jarowinkler_upper_bound(length, distinct[high + 1]) >= threshold
+        ):
+            high += 1
+        spans[length] = (
+            int(numpy.searchsorted(sorted_lengths, distinct[low], "left")),
+            int(numpy.searchsorted(sorted_lengths, distinct[high], "right")),
+        )
+    return order, spans
+
+
+def iter_similar_pairs(strings, similarity_threshold, start=0, counts=None):
+    """Yield ``(i, j, jaro, jaro_winkler)`` for pairs at or above the threshold.
+
+    Pairs are generated in row-major order; with ``start`` only pairs whose
+    second string is at index ``start`` or later are compared.  If
+    ``counts`` is a dict its ``"total"`` and ``"pruned"`` comparison counts
+    are increased.
+    """
+    total_comparisons = 0
+    pruned_comparisons = 0
+
+    # Lowercase once; comparisons are case-insensitive
+    lowered = [string.lower() for string in strings]
+    lengths = [len(string) for string in lowered]
+    order, spans = length_spans(lengths, similarity_threshold)
+    threshold = similarity_threshold - BOUND_EPSILON
+
+    try:
+        for i in range(len(strings) - 1):
+            first = max(i + 1, start)
+            if first >= len(strings):
+                continue
+            total_comparisons += len(strings) - first
+
+            # Lengths the bound rules out are skipped a whole span at a time
+            begin, end = spans[lengths[i]]
+            candidates = order[begin:end]
+            candidates = numpy.sort(candidates[candidates >= first])
+            pruned_comparisons += len(strings) - first - len(candidates)
+
+            for j in candidates.tolist():
+                # Then skip pairs the actual common prefix rules out
+                prefix = common_prefix_length(lowered[i], lowered[j])
+                if jarowinkler_upper_bound(lengths[i], lengths[j], prefix) < threshold:
+                    pruned_comparisons += 1
+                    continue
+
+                jarowinkler_sim = jarowinkler.jarowinkler_similarity(
+                    lowered[i], lowered[j]
+                )
+
+                # Yield the pair if similarity is above the threshold
+                if jarowinkler_sim >= similarity_threshold:
+                    jaro_sim = jarowinkler.jaro_similarity(lowered[i], lowered[j])
+                    yield i, j, jaro_sim, jarowinkler_sim
+    finally:
+        if counts is not None:
+            counts["total"] = counts.get("total", 0) + total_comparisons
+            counts["pruned"] = counts.get("pruned", 0) + pruned_comparisons
+
+
+def self_match(string, similarity_threshold):
+    """``(jaro, jaro_winkler)`` of a string against itself, if it matches."""
+    lowered = string.lower()
+    jarowinkler_sim = jarowinkler.jarowinkler_similarity(lowered, lowered)
+    if jarowinkler_sim < similarity_threshold:
+        return None
+    return jarowinkler.jaro_similarity(lowered, lowered), jarowinkler_sim
+
+
+def cluster_strings(
+    strings_to_compare,
+    similarity_threshold,
+    profiler=profiling.DISABLED,
+    deduplicated=None,
+):
+    """Return a :class:`~minortop.clusters.UnionFind` joining every pair at
+    or above the threshold, added as the pairs are found."""
+    union_find = clusters.UnionFind(len(strings_to_compare))
+    scored = strings_to_compare if deduplicated is None else deduplicated.unique
+    counts = {}
+    with profiler.phase("score"):
+        matches = iter_similar_pairs(scored, similarity_threshold, counts=counts)
+        if deduplicated is None:
+            union_find.add_matches(matches)
+        else:
+            deduplicated.cluster(
+                union_find,
+                matches,
+                lambda k: self_match(scored[k], similarity_threshold),
+            )
+    profiler.add_pairs(counts["total"])
+    return union_find
+
+
+def compare_strings(
+    strings_to_compare,
+    similarity_threshold,
+    state_path=None,
+    profiler=profiling.DISABLED,
+    deduplicated=None,
+    sink=None,
+):
+    if sink is None:
+        sink = sinks.TextSink(
+            strings_to_compare, match_formatter(strings_to_compare), FIELDS
+        )
+
+    # Resume from a previous run's matches when only new lines were appended
+    start, previous = 0, []
+    if state_path is not None:
+        params = {"engine": "reasonlabel", "similarity_threshold": similarity_threshold}
+        start, previous = incremental.load_state(state_path, strings_to_compare, params)
+
+    # With deduplication only the distinct normalized strings are compared
+    scored = strings_to_compare if deduplicated is None else deduplicated.unique
+
+    # Create a list of tuples containing the indices of the
     # strings and their Jaro-Winkler distances
-    similarities = []
-    total_comparisons = 0  # Initialize the total comparisons count
-
-    for i in range(len(strings_to_compare) - 1):
-        for j in range(i + 1, len(strings_to_compare)):
-            total_comparisons += 1  # Increment the total comparisons count
-            string1 = strings_to_compare[i]
-            string2 = strings_to_compare[j]
-
-            # Calculate the Jaro and Jaro-Winkler Similarities (case-insensitive)
-            jaro_sim = jarowinkler.jaro_similarity(string1.lower(), string2.lower())
-            jarowinkler_sim = jarowinkler.jarowinkler_similarity(
-                string1.lower(), string2.lower()
+    similarities = list(previous)
+    counts = {}
+    with profiler.phase("score"):
+        similarities += iter_similar_pairs(scored, similarity_threshold, start, counts)
+    total_comparisons = counts["total"]
+    pruned_comparisons = counts["pruned"]
+
+    if deduplicated is not None:
+        similarities = list(
+            deduplicated.expand(
+                similarities, lambda k: self_match(scored[k], similarity_threshold)
             )
+        )
 
-            # Append the tuple to the list if similarity is above the threshold
-            if jarowinkler_sim >= similarity_threshold:
-                similarities.append((string1, string2, jaro_sim, jarowinkler_sim))
+    # Sort the list of tuples based on Jaro-Winkler similarities in ascending
+    # order, ties in the order the pairs are generated
+    with profiler.phase("sort"):
+        similarities.sort(key=lambda x: (x[3], x[0], x[1]))
 
-    # Sort the list of tuples based on Jaro-Winkler similarities in ascending order
-    similarities.sort(key=lambda x: x[3])
+    if state_path is not None:
+        incremental.save_state(state_path, strings_to_compare, params, similarities)
 
     # Print the sorted list in the specified format
-    for similarity in similarities:
-        print(f"score1: {similarity[2]:.3f}, score2: {similarity[3]:.3f}")
-        print(f"{similarity[0]}\n{similarity[1]}\n")
+    with profiler.phase("output"), sink:
+        for match in similarities:
+            sink.write(*match)
 
     # Report counts
     total_strings_count = len(strings_to_compare)
@@ -41,12 +231,21 @@ def compare_strings(strings_to_compare, similarity_threshold):
         1 for sim in similarities if sim[3] >= similarity_threshold
     )
 
-    print(f"Total Comparisons Made: {total_comparisons:,}")
-    print(f"Total Strings Count: {total_strings_count:,}")
-    print(f"Above Threshold Count: {above_threshold_count:,}")
+    report = sink.report_file
+    print(f"Total Comparisons Made: {total_comparisons:,}", file=report)
+    print(f"Pruned Comparisons: {pruned_comparisons:,}", file=report)
+    print(
+        f"Evaluated Comparisons: {total_comparisons - pruned_comparisons:,}",
+        file=report,
+    )
+    print(f"Total Strings Count: {total_strings_count:,}", file=report)
+    print(f"Above Threshold Count: {above_threshold_count:,}", file=report)
 
+    profiler.add_pairs(total_comparisons)
+    profiler.add_matches(above_threshold_count)
 
-if __name__ == "__main__":
+
+def main(argv=None):
     # Set up argparse for command line arguments
     parser = argparse.ArgumentParser(
         description="Compare strings using Jaro-Winkler similarity."
@@ -54,11 +253,50 @@ if __name__ == "__main__":
     parser.add_argument(
         "--similarity-threshold", type=float, default=0.8, help="Similarity threshold"
     )
-    args = parser.parse_args()
+    incremental.add_incremental_arg(parser)
+    dedupe.add_dedupe_args(parser)
+    clusters.add_cluster_arg(parser)
+    sinks.add_output_args(parser)
+    profiling.add_profile_args(parser)
+    args = parser.parse_args(argv)
+    sinks.check_output_args(parser, args)
+    if args.incremental and (args.dedupe or args.nfkc):
+        parser.error("--dedupe cannot be combined with --incremental")
+    if args.cluster and (args.incremental or args.output_format != "text"):
+        parser.error("--cluster only writes text and cannot be incremental")
+    profiler = profiling.from_args(args)
 
     # Read data from the file
-    with open("data.txt", "r") as file:
-        strings_to_compare = [line.strip() for line in file]
+    with profiler.phase("read"):
+        strings_to_compare = corpus.load("data.txt", strip=True).tolist()
+
+    with profiler.phase("dedupe"):
+        deduplicated = dedupe.from_args(args, strings_to_compare)
+
+    if args.cluster:
+        union_find = cluster_strings(
+            strings_to_compare, args.similarity_threshold, profiler, deduplicated
+        )
+        with profiler.phase("output"):
+            clusters.print_clusters(
+                strings_to_compare, union_find.components(), len(strings_to_compare)
+            )
+        profiler.report()
+        return
 
     # Call the comparison function
-    compare_strings(strings_to_compare, args.similarity_threshold)
+    compare_strings(
+        strings_to_compare,
+        args.similarity_threshold,
+        args.incremental,
+        profiler,
+        deduplicated,
+        sinks.from_args(
+            args, strings_to_compare, match_formatter(strings_to_compare), FIELDS
+        ),
+    )
+    profiler.report()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,12 +5,14 @@ import itertools
 import typing
 
 import Bio.Align
+import numpy
+
+from . import corpus, dedupe, profiling, sinks
 
 
 def read_data(filename: str) -> typing.List[str]:
     """Read data from the file."""
-    with open(filename, "r") as file:
-        return file.read().splitlines()
+    return corpus.load(filename).tolist()
 
 
 def calculate_similarity(seq1: str, seq2: str) -> int:
@@ -20,20 +22,297 @@ def calculate_similarity(seq1: str, seq2: str) -> int:
     return alignments[0].score
 
 
-def filter_by_similarity(data: typing.List[str], threshold: int) -> typing.List[tuple]:
-    """Filter pairs with similarity greater than
-    the threshold and order by similarity."""
-    pairs = list(itertools.combinations(data, 2))
-    result = [
-        (pair[0], pair[1], calculate_similarity(pair[0], pair[1])) for pair in pairs
+def make_aligner() -> Bio.Align.PairwiseAligner:
+    """Create the aligner shared by every comparison in a worker."""
+    return Bio.Align.PairwiseAligner()
+
+
+# Strings are bucketed by length in steps of BUCKET_WIDTH; a kernel call
+# covers at most BATCH_CELLS matrix cells and a block of rows at most
+# BLOCK_SCORES scores
+BUCKET_WIDTH = 8
+BATCH_CELLS = 1 << 21
+BLOCK_SCORES = 1 << 22
+
+
+def linear_scoring(
+    aligner: Bio.Align.PairwiseAligner,
+) -> typing.Optional[typing.Tuple[float, float, float]]:
+    """Return the ``(match, mismatch, gap)`` scores of an aligner that
+    :func:`batch_scores` can reproduce, or None.
+
+    That is a global aligner with neither a substitution matrix nor a
+    wildcard and the same score for every kind of gap.
+    """
+    if (
+        aligner.mode != "global"
+        or aligner.substitution_matrix is not None
+        or aligner.wildcard is not None
+    ):
+        return None
+    try:
+        gap_score = aligner.gap_score
+    except ValueError:  # Open, extend or end gaps score differently
+        return None
+    return aligner.match_score, aligner.mismatch_score, gap_score
+
+
+def score_dtype(scoring: typing.Tuple[float, float, float], longest: int) -> type:
+    """The narrowest dtype that holds every score of strings up to
+    ``longest`` characters exactly."""
+    if not all(float(score).is_integer() for score in scoring):
+        return numpy.float64
+    bound = 2 * max(longest, 1) * max(abs(score) for score in scoring)
+    if bound < 2**15:
+        return numpy.int16
+    if bound < 2**31:
+        return numpy.int32
+    return numpy.float64
+
+
+def batch_scores(
+    queries: numpy.ndarray,
+    query_lengths: numpy.ndarray,
+    targets: numpy.ndarray,
+    target_lengths: numpy.ndarray,
+    scoring: typing.Tuple[float, float, float] = (1.0, 0.0, -1.0),
+    dtype: type = numpy.float64,
+) -> numpy.ndarray:
+    """Global alignment scores of a batch of query/target pairs.
+
+    Column ``p`` of ``queries`` and of ``targets`` holds the padded codes of
+    the two strings of pair ``p``, whose lengths are ``query_lengths[p]``
+    and ``target_lengths[p]``; one query against many targets is the case
+    where every column of ``queries`` is the same.  ``scoring`` is
+    ``(match, mismatch, gap)``.
+
+    The matrices of every pair are filled together, one anti-diagonal at a
+    time, so each step is a handful of array operations over the whole
+    batch.  Each pair's score is read from its own last cell, which padding
+    never reaches.
+
+    Raises ValueError for an empty string, as ``PairwiseAligner`` does.
+    """
+    if not (numpy.all(query_lengths) and numpy.all(target_lengths)):
+        raise ValueError("sequence has zero length")
+    match_score, mismatch_score, gap_score = scoring
+    query_width, batch = queries.shape
+    width = targets.shape[0]
+
+    # substitution[q * width + t, p] scores query q against target t of pair p
+    substitution = (queries[:, None, :] == targets[None, :, :]).astype(dtype)
+    if match_score - mismatch_score != 1:
+        substitution *= dtype(match_score - mismatch_score)
+    if mismatch_score:
+        substitution += dtype(mismatch_score)
+    substitution = substitution.reshape(query_width * width, batch)
+    # Cells (q, d - q) of an anti-diagonal are width - 1 rows apart
+    step = max(width - 1, 1)
+
+    diagonals = [numpy.empty((query_width + 1, batch), dtype) for _ in range(3)]
+    gapped = numpy.empty((query_width, batch), dtype)
+    gap = dtype(gap_score)
+    scores = numpy.empty(batch, dtype)
+    ends = query_lengths + target_lengths
+    order = numpy.argsort(ends, kind="stable")
+    bounds = numpy.searchsorted(ends[order], numpy.arange(query_width + width + 2))
+
+    for d in range(query_width + width + 1):
+        # Row q of these holds cell (q, d - q), (q, d - 1 - q), (q, d - 2 - q)
+        current = diagonals[d % 3]
+        previous, before = diagonals[(d - 1) % 3], diagonals[(d - 2) % 3]
+        low, high = max(0, d - width), min(query_width, d)
+        if low == 0:
+            current[0] = d * gap_score
+        if high == d:
+            current[d] = d * gap_score
+
+        first, last = max(low, 1), min(high, d - 1)
+        if first <= last:
+            start = (first - 1) * width + d - first - 1
+            diagonal = substitution[start : start + step * (last - first) + 1 : step]
+            moves = gapped[: last - first + 1]
+            numpy.maximum(
+                previous[first - 1 : last], previous[first : last + 1], out=moves
+            )
+            moves += gap
+            cells = current[first : last + 1]
+            numpy.add(before[first - 1 : last], diagonal, out=cells)
+            numpy.maximum(cells, moves, out=cells)
+
+        done = order[bounds[d] : bounds[d + 1]]
+        if len(done):
+            scores[done] = current[query_lengths[done], done]
+
+    return scores
+
+
+def bucket_by_length(
+    data: typing.Sequence[str],
+) -> typing.List[typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]]:
+    """Group strings whose lengths fall in the same ``BUCKET_WIDTH`` step.
+
+    Each bucket is ``(indices, codes, lengths)``: the ascending indices of
+    its strings, a ``(width, count)`` array with each string's character
+    codes in a column, padded to the longest, and the string lengths.
+    Characters are numbered over the whole of ``data``.
+    """
+    lengths = numpy.fromiter(map(len, data), numpy.intp, len(data))
+    keys = (lengths + BUCKET_WIDTH - 1) // BUCKET_WIDTH
+    buckets = []
+    for key in numpy.unique(keys):
+        indices = numpy.flatnonzero(keys == key)
+        width = max(int(lengths[indices].max()), 1)
+        points = numpy.array([data[k] for k in indices], dtype=f"<U{width}")
+        points = points.view(numpy.uint32).reshape(len(indices), width)
+        buckets.append((indices, points.T, lengths[indices]))
+
+    # Compact code points so the comparisons move as few bytes as possible
+    alphabet = numpy.unique(numpy.concatenate([p.ravel() for _, p, _ in buckets]))
+    dtype = numpy.uint8 if len(alphabet) <= 256 else numpy.uint16
+    return [
+        (indices, numpy.searchsorted(alphabet, points).astype(dtype), lengths)
+        for indices, points, lengths in buckets
     ]
-    result = [(seq1, seq2, score) for seq1, seq2, score in result if score > threshold]
-    return pairs, sorted(
-        result, key=lambda x: x[2], reverse=True
-    )  # Sort by similarity in descending order
 
 
-def main():
+def iter_batched_indices(
+    data: typing.Sequence[str],
+    threshold: int,
+    scoring: typing.Tuple[float, float, float],
+) -> typing.Iterator[tuple]:
+    """Yield ``(i, j, score)`` like :func:`iter_similar_indices`, with the
+    scores computed by :func:`batch_scores`.
+
+    Rows of the triangle are scored a block at a time: the pairs between
+    each two length buckets form one batch, split to at most
+    ``BATCH_CELLS`` cells, and the block's matches are then yielded row by
+    row.
+    """
+    count = len(data)
+    if count < 2:
+        return
+    buckets = bucket_by_length(data)
+    dtype = score_dtype(scoring, max(map(len, data)))
+    block_rows = max(1, BLOCK_SCORES // count)
+
+    for block in range(0, count - 1, block_rows):
+        scores = numpy.full((min(block_rows, count - block), count), -numpy.inf)
+        for rows, row_codes, row_lengths in buckets:
+            rows_in_block = slice(
+                *numpy.searchsorted(rows, [block, block + block_rows])
+            )
+            rows, row_codes = rows[rows_in_block], row_codes[:, rows_in_block]
+            row_lengths = row_lengths[rows_in_block]
+            if not len(rows):
+                continue
+            for columns, column_codes, column_lengths in buckets:
+                # Every pair (i, j) with i < j between the two buckets
+                i, j = numpy.nonzero(rows[:, None] < columns[None, :])
+                size = max(1, BATCH_CELLS // (len(row_codes) * len(column_codes)))
+                for start in range(0, len(i), size):
+                    a, b = i[start : start + size], j[start : start + size]
+                    scores[rows[a] - block, columns[b]] = batch_scores(
+                        row_codes.take(a, axis=1),
+                        row_lengths[a],
+                        column_codes.take(b, axis=1),
+                        column_lengths[b],
+                        scoring,
+                        dtype,
+                    )
+
+        for offset, row in enumerate(scores):
+            for j in numpy.flatnonzero(row > threshold).tolist():
+                yield block + offset, j, float(row[j])
+
+
+def iter_similar_indices(
+    data: typing.List[str],
+    threshold: int,
+    aligner: typing.Optional[Bio.Align.PairwiseAligner] = None,
+) -> typing.Iterator[tuple]:
+    """Yield ``(i, j, score)`` for pairs with similarity greater than the
+    threshold.
+
+    Only the score is computed, using a single aligner, and pairs are
+    filtered as they are generated so no list of all pairs is built.
+    Without an aligner, the default aligner's scores are computed a block
+    of rows at a time by :func:`iter_batched_indices`.
+    """
+    if aligner is None:
+        aligner = make_aligner()
+        scoring = linear_scoring(aligner)
+        if scoring is not None:
+            yield from iter_batched_indices(data, threshold, scoring)
+            return
+    for i, j in itertools.combinations(range(len(data)), 2):
+        score = aligner.score(data[i], data[j])
+        if score > threshold:
+            yield i, j, score
+
+
+def iter_similar_pairs(
+    data: typing.List[str],
+    threshold: int,
+    aligner: typing.Optional[Bio.Align.PairwiseAligner] = None,
+) -> typing.Iterator[tuple]:
+    """Yield pairs with similarity greater than the threshold."""
+    for i, j, score in iter_similar_indices(data, threshold, aligner):
+        yield data[i], data[j], score
+
+
+def filter_similar_indices(
+    data: typing.List[str],
+    threshold: int,
+    deduplicated: typing.Optional[dedupe.Deduplicated] = None,
+) -> typing.Tuple[int, typing.List[tuple]]:
+    """Return the number of comparisons made and the ``(i, j, score)`` of
+    the pairs above the threshold, by descending similarity.
+
+    With ``deduplicated`` only its distinct strings are aligned and the
+    matches are expanded back to the lines of ``data``.
+    """
+    if deduplicated is None:
+        comparisons = len(data) * (len(data) - 1) // 2
+        return comparisons, sorted(
+            iter_similar_indices(data, threshold), key=lambda x: x[2], reverse=True
+        )  # Sort by similarity in descending order
+
+    unique = deduplicated.unique
+    comparisons = len(unique) * (len(unique) - 1) // 2
+    aligner = make_aligner()
+
+    def self_match(k):
+        score = aligner.score(unique[k], unique[k])
+        return (score,) if score > threshold else None
+
+    matches = deduplicated.expand(iter_similar_indices(unique, threshold), self_match)
+    # Descending similarity, ties in the order the pairs are generated
+    return comparisons, sorted(matches, key=lambda x: (-x[2], x[0], x[1]))
+
+
+def filter_by_similarity(
+    data: typing.List[str],
+    threshold: int,
+    deduplicated: typing.Optional[dedupe.Deduplicated] = None,
+) -> typing.Tuple[int, typing.List[tuple]]:
+    """Filter pairs with similarity greater than
+    the threshold and order by similarity.
+
+    Returns ``(comparisons, matches)``: the number of pairs compared and the
+    ``(seq1, seq2, score)`` matches, by descending score.  The first element
+    used to be the list of every pair compared; only its length was used,
+    and building it took memory quadratic in ``len(data)``.
+    """
+    comparisons, matches = filter_similar_indices(data, threshold, deduplicated)
+    return comparisons, [(data[i], data[j], score) for i, j, score in matches]
+
+
+def format_match(seq1: str, seq2: str, score: float) -> str:
+    return f"score: {score}\n{seq1}\n{seq2}\n\n"
+
+
+def main(argv=None):
     # Set up argparse
     parser = argparse.ArgumentParser(
         description="Calculate and filter string pairs based on similarity."
@@ -49,37 +328,56 @@ def main():
         default=10,
         help="Threshold for similarity score",
     )
-    args = parser.parse_args()
+    dedupe.add_dedupe_args(parser)
+    sinks.add_output_args(parser)
+    profiling.add_profile_args(parser)
+    args = parser.parse_args(argv)
+    sinks.check_output_args(parser, args)
+    profiler = profiling.from_args(args)
 
     # Read data from file
-    data = read_data(args.input_filename)
+    with profiler.phase("read"):
+        data = read_data(args.input_filename)
+
+    with profiler.phase("dedupe"):
+        deduplicated = dedupe.from_args(args, data)
 
     # Filter pairs by similarity and order by similarity
-    comparisons, result = filter_by_similarity(data, args.similarity_threshold)
+    with profiler.phase("score"):
+        comparisons, result = filter_similar_indices(
+            data, args.similarity_threshold, deduplicated
+        )
 
     # Print results
-    for seq1, seq2, score in result:
-        print(f"score: {score}")
-        print(seq1)
-        print(seq2)
-        print()
+    sink = sinks.from_args(
+        args, data, lambda i, j, score: format_match(data[i], data[j], score)
+    )
+    with profiler.phase("output"), sink:
+        for i, j, score in result:
+            sink.write(i, j, score)
 
     # Report statistics
-    print(f"Total number of strings: {len(data):,}")
-    print(f"Total number of comparisons: {len(comparisons):,}")
+    report = sink.report_file
+    print(f"Total number of strings: {len(data):,}", file=report)
+    print(f"Total number of comparisons: {comparisons:,}", file=report)
 
     if result:
         min_score = min(result, key=lambda x: x[2])[2]
         max_score = max(result, key=lambda x: x[2])[2]
-        print(f"Minimum score: {min_score:,}")
-        print(f"Maximum score: {max_score:,}")
+        print(f"Minimum score: {min_score:,}", file=report)
+        print(f"Maximum score: {max_score:,}", file=report)
 
     count_above_threshold = len(result)
     print(
         f"Number of pairs above similarity threshold"
-        f" {args.similarity_threshold}: {count_above_threshold:,}"
+        f" {args.similarity_threshold}: {count_above_threshold:,}",
+        file=report,
     )
 
+    profiler.add_pairs(comparisons)
+    profiler.add_matches(count_above_threshold)
+    profiler.report()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,262 @@
+# result sinks shared by the engines
+
+import abc
+import csv
+import json
+import sys
+
+import numpy
+
+FORMATS = ("text", "jsonl", "csv", "npz", "parquet")
+BATCH_ROWS = 8192
+
+
+class ResultSink(abc.ABC):
+    """Collects ``(i, j, *values)`` match rows and writes them in batches.
+
+    ``values`` are named by ``fields``, most often just ``("score",)``.
+    Subclasses implement :meth:`_write_batch`; rows reach it ``BATCH_ROWS``
+    at a time and once more on :meth:`close`.
+    """
+
+    binary = False
+
+    def __init__(self, strings, fields=("score",), path=None):
+        self.check(path)
+        self.strings = strings
+        self.fields = tuple(fields)
+        self.path = path
+        self.count = 0
+        self._rows = []
+        if not self.binary:
+            self.file = sys.stdout if path is None else open(path, "w", newline="")
+
+    @classmethod
+    def check(cls, path):
+        """Raise ValueError if the sink cannot write to ``path``."""
+        if path is None and cls.binary:
+            raise ValueError(f"{cls.format} output needs --output PATH")
+
+    @property
+    def report_file(self):
+        """Where engines print their summary, kept apart from streamed rows."""
+        if self.path is None and self.format != "text":
+            return sys.stderr
+        return sys.stdout
+
+    def write(self, i, j, *values):
+        self._rows.append((i, j, *values))
+        self.count += 1
+        if len(self._rows) >= BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            self._write_batch(self._rows)
+            self._rows = []
+
+    def close(self):
+        self.flush()
+        if not self.binary and self.path is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @abc.abstractmethod
+    def _write_batch(self, rows):
+        """Write a list of ``(i, j, *values)`` rows."""
+
+
+class TextSink(ResultSink):
+    """The engine's own human-readable format, from ``format_match(*row)``."""
+
+    format = "text"
+
+    def __init__(self, strings, format_match, fields=("score",), path=None):
+        super().__init__(strings, fields, path)
+        self.format_match = format_match
+
+    def _write_batch(self, rows):
+        self.file.write("".join(self.format_match(*row) for row in rows))
+
+
+class JsonlSink(ResultSink):
+    """One JSON object per match, with both strings.
+
+    Records are assembled from pre-encoded pieces rather than with
+    ``json.dumps`` per row; each string is encoded once.
+    """
+
+    format = "jsonl"
+
+    def __init__(self, strings, fields=("score",), path=None):
+        super().__init__(strings, fields, path)
+        self._keys = [json.dumps(name) for name in self.fields]
+        self._encoded = {}
+
+    def _string(self, i):
+        encoded = self._encoded.get(i)
+        if encoded is None:
+            encoded = self._encoded[i] = json.dumps(self.strings[i])
+        return encoded
+
+    def _write_batch(self, rows):
+        lines = []
+        for i, j, *values in rows:
+            scores = "".join(
+                f", {key}: {float(value)!r}" for key, value in zip(self._keys, values)
+            )
+            lines.append(
+                f'{{"i": {int(i)}, "j": {int(j)}{scores},'
+                f' "string1": {self._string(i)}, "string2": {self._string(j)}}}\n'
+            )
+        self.file.write("".join(lines))
+
+
+class CsvSink(ResultSink):
+    format = "csv"
+
+    def __init__(self, strings, fields=("score",), path=None):
+        super().__init__(strings, fields, path)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(("i", "j") + self.fields + ("string1", "string2"))
+
+    def _write_batch(self, rows):
+        self.writer.writerows(
+            row + (self.strings[row[0]], self.strings[row[1]]) for row in rows
+        )
+
+
+def _columns(rows, fields):
+    # int64 line indices followed by one float64 column per field
+    arrays = {
+        "i": numpy.array([row[0] for row in rows], numpy.int64),
+        "j": numpy.array([row[1] for row in rows], numpy.int64),
+    }
+    for k, name in enumerate(fields, 2):
+        arrays[name] = numpy.array([row[k] for row in rows], numpy.float64)
+    return arrays
+
+
+class NpzSink(ResultSink):
+    """``i``, ``j`` and one array per field, saved with ``numpy.savez``.
+
+    Batches are kept as packed arrays rather than Python tuples and are
+    concatenated once, when the sink is closed.
+    """
+
+    format = "npz"
+    binary = True
+
+    def __init__(self, strings, fields=("score",), path=None):
+        super().__init__(strings, fields, path)
+        self._batches = []
+
+    def _write_batch(self, rows):
+        self._batches.append(_columns(rows, self.fields))
+
+    def close(self):
+        self.flush()
+        batches = self._batches or [_columns([], self.fields)]
+        numpy.savez(
+            self.path,
+            **{
+                name: numpy.concatenate([batch[name] for batch in batches])
+                for name in batches[0]
+            },
+        )
+
+
+class ParquetSink(ResultSink):
+    """The same columns as :class:`NpzSink`, one Parquet row group per batch."""
+
+    format = "parquet"
+    binary = True
+
+    @classmethod
+    def check(cls, path):
+        """Also raise ImportError if the ``parquet`` extra is not installed."""
+        super().check(path)
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError as error:
+            raise ImportError(
+                "parquet output requires pyarrow (pip install minortop[parquet])"
+            ) from error
+
+    def __init__(self, strings, fields=("score",), path=None):
+        super().__init__(strings, fields, path)
+        import pyarrow
+        import pyarrow.parquet
+
+        self._pyarrow = pyarrow
+        self.schema = pyarrow.schema(
+            [("i", pyarrow.int64()), ("j", pyarrow.int64())]
+            + [(name, pyarrow.float64()) for name in self.fields]
+        )
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def _write_batch(self, rows):
+        self.writer.write_table(
+            self._pyarrow.table(_columns(rows, self.fields), schema=self.schema)
+        )
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+SINKS = {
+    "jsonl": JsonlSink,
+    "csv": CsvSink,
+    "npz": NpzSink,
+    "parquet": ParquetSink,
+}
+
+
+def add_output_args(parser):
+    parser.add_argument(
+        "--output-format",
+        choices=FORMATS,
+        default="text",
+        help="Format of the matches: the readable text (default), JSONL or"
+        " CSV rows, or columnar i/j/score arrays in .npz or Parquet.",
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        metavar="PATH",
+        help="Write the matches to PATH instead of stdout (required for npz"
+        " and parquet).",
+    )
+
+
+def check_output_args(parser, args):
+    """Report an output the sink could not write as a usage error."""
+    if args.output_format == "text":
+        return
+    try:
+        SINKS[args.output_format].check(args.output)
+    except (ValueError, ImportError) as error:
+        parser.error(str(error))
+
+
+def open_sink(output_format, strings, format_match, fields=("score",), path=None):
+    """Open a sink for ``output_format``, writing to ``path`` or stdout.
+
+    ``format_match(i, j, *values)`` renders one match in the engine's text
+    format, including its trailing newline.  Raises ValueError when a binary
+    format has no ``path`` and ImportError when its optional dependency is
+    missing; :func:`check_output_args` reports both before any work is done.
+    """
+    if output_format == "text":
+        return TextSink(strings, format_match, fields, path)
+    return SINKS[output_format](strings, fields, path)
+
+
+def from_args(args, strings, format_match, fields=("score",)):
+    return open_sink(args.output_format, strings, format_match, fields, args.output)
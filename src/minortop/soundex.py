@@ -4,17 +4,52 @@ import argparse
 
 import jellyfish
 
+from . import corpus, dedupe, featurecache, profiling, sinks
+
 
 def read_strings_from_file(file_path):
-    with open(file_path, "r") as file:
-        return [line.strip() for line in file]
+    return corpus.load(file_path, strip=True)
 
 
 def calculate_similarity(string1, string2):
     return jellyfish.soundex(string1.lower()) == jellyfish.soundex(string2.lower())
 
 
-def main():
+def soundex_codes(strings, feature_cache=None):
+    if feature_cache is None:
+        return [jellyfish.soundex(string.lower()) for string in strings]
+    codes = feature_cache.features(
+        strings,
+        "soundex",
+        lambda string: [jellyfish.soundex(string)],
+        dtype=str,
+        normalize=featurecache.lowercase,
+    )
+    return [str(code[0]) for code in codes]
+
+
+def build_soundex_index(strings, feature_cache=None):
+    """Map each Soundex code to the indices of the strings that share it.
+
+    Every string is encoded exactly once, or read from ``feature_cache``.
+    Indices within a bucket are in ascending order, so pairs taken from a
+    bucket always have ``i < j``.
+    """
+    index = {}
+    for i, code in enumerate(soundex_codes(strings, feature_cache)):
+        index.setdefault(code, []).append(i)
+    return index
+
+
+def iter_bucket_pairs(index):
+    """Yield every ``(i, j)`` pair of indices that share a bucket."""
+    for members in index.values():
+        for a in range(len(members) - 1):
+            for b in range(a + 1, len(members)):
+                yield members[a], members[b]
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="String similarity using Soundex algorithm"
     )
@@ -29,39 +64,103 @@ def main():
         default=10,
         help="Threshold for similarity comparison (default: 10)",
     )
+    parser.add_argument(
+        "--blocking",
+        action="store_true",
+        help="Encode each string once and only compare strings within the"
+        " same Soundex bucket",
+    )
+    featurecache.add_feature_cache_arg(parser)
+    dedupe.add_dedupe_args(parser)
+    sinks.add_output_args(parser)
+    profiling.add_profile_args(parser)
+
+    args = parser.parse_args(argv)
+    sinks.check_output_args(parser, args)
+    if args.blocking and args.similarity_threshold <= 0:
+        # Pairs across buckets score 0, so they match too, and blocking
+        # never compares them
+        parser.error("--blocking needs a --similarity_threshold above 0")
+    profiler = profiling.from_args(args)
+
+    with profiler.phase("read"):
+        strings = read_strings_from_file(args.file_path)
+    total_strings = len(strings)
 
-    args = parser.parse_args()
+    # Score each distinct normalized string once
+    with profiler.phase("dedupe"):
+        deduplicated = dedupe.from_args(args, strings)
+    scored = strings if deduplicated is None else deduplicated.unique
+
+    matches = []
+
+    if args.blocking:
+        with profiler.phase("featurize"):
+            index = build_soundex_index(scored, featurecache.from_args(args))
+        with profiler.phase("score"):
+            # Every pair within a bucket shares its code, so it scores True,
+            # that is 1, and pairs across buckets score 0
+            if args.similarity_threshold <= 1:
+                for i, j in iter_bucket_pairs(index):
+                    matches.append((i, j, True))
+        profiler.add_pairs(
+            sum(len(bucket) * (len(bucket) - 1) // 2 for bucket in index.values())
+        )
+    else:
+        # Every string is used n times, so decode them all once
+        if deduplicated is None:
+            scored = strings = strings.tolist()
+        with profiler.phase("score"):
+            for i in range(len(scored) - 1):
+                for j in range(i + 1, len(scored)):
+                    similarity_score = calculate_similarity(scored[i], scored[j])
+                    if similarity_score >= args.similarity_threshold:
+                        matches.append((i, j, similarity_score))
+        profiler.add_pairs(len(scored) * (len(scored) - 1) // 2)
+
+    if deduplicated is not None:
+
+        def self_match(k):
+            similarity_score = calculate_similarity(scored[k], scored[k])
+            if similarity_score >= args.similarity_threshold:
+                return (similarity_score,)
+            return None
 
-    strings = read_strings_from_file(args.file_path)
-    total_strings = len(strings)
+        matches = deduplicated.expand(matches, self_match)
 
-    results = []
+    results = [(score, strings[i], strings[j], i, j) for i, j, score in matches]
 
-    for i in range(total_strings - 1):
-        for j in range(i + 1, total_strings):
-            similarity_score = calculate_similarity(strings[i], strings[j])
-            if similarity_score >= args.similarity_threshold:
-                results.append((similarity_score, strings[i], strings[j]))
+    with profiler.phase("sort"):
+        results.sort()
 
-    results.sort()
+    sink = sinks.from_args(
+        args, strings, lambda i, j, score: f"{strings[i]}\n{strings[j]}\n\n"
+    )
+    with profiler.phase("output"), sink:
+        for score, _string1, _string2, i, j in results:
+            sink.write(i, j, score)
 
     if results:
         min_score = results[0][0]
         max_score = results[-1][0]
 
-        for score, string1, string2 in results:
-            print(string1)
-            print(string2)
-            print()
-
-        print(f"Total strings: {total_strings:,}")
-        print(f"Total comparisons made: {total_strings * (total_strings - 1) // 2:,}")
+        report = sink.report_file
+        print(f"Total strings: {total_strings:,}", file=report)
+        if args.blocking:
+            print(f"Soundex buckets: {len(index):,}", file=report)
+        else:
+            comparisons = len(scored) * (len(scored) - 1) // 2
+            print(f"Total comparisons made: {comparisons:,}", file=report)
         print(
             "Strings with similarity score greater than"
-            f"{args.similarity_threshold}: {len(results):,}"
+            f"{args.similarity_threshold}: {len(results):,}",
+            file=report,
         )
-        print(f"Min similarity score: {min_score}")
-        print(f"Max similarity score: {max_score}")
+        print(f"Min similarity score: {min_score}", file=report)
+        print(f"Max similarity score: {max_score}", file=report)
+
+    profiler.add_matches(len(results))
+    profiler.report()
 
 
 if __name__ == "__main__":
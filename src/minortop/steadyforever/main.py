@@ -1,67 +1,438 @@
 import argparse
+import asyncio
+import hashlib
+import json
 import logging
 import os
 import pathlib
-import pickle
+import shutil
+import sys
 import time
 
 import jinja2
 import openai
+from openai.types.chat import ChatCompletion
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_MODEL = "gpt-4"
 
-def load_most_recent_pkl():
-    bash_glob = f"chat_{'[0-9]' * 9}*.pkl"  # chat_1699976041*.pkl
-    pkl_files = list(pathlib.Path(".").glob(bash_glob))
-    if not pkl_files:
-        return None
+# Failures worth another attempt: dropped connections and timeouts, rate
+# limits and server errors
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
 
-    recent = max(pkl_files, key=os.path.getmtime)
-    if recent:
-        with open(recent, "rb") as file:
-            loaded_data = pickle.load(file)
-        return loaded_data
 
-    return None
+class CompletionCache:
+    """Completions stored as JSON under a hash of the prompt and model.
 
+    ``index.json`` maps each key to its file and creation time, so a lookup
+    reads the index once instead of listing and stat-ing the cache
+    directory.  Entries older than ``ttl`` seconds are ignored and
+    dropped, and past ``max_entries`` the oldest are evicted.
+    """
 
-def gen_chat_content():
-    sect1 = pathlib.Path("chat_instructions.txt").read_text()
-    sect2 = pathlib.Path("chat_recipe.txt").read_text()
+    def __init__(self, path=".chat_cache", ttl=None, max_entries=256):
+        self.path = pathlib.Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.index_path = self.path / "index.json"
+        self._index = None
+
+    @staticmethod
+    def key(chat_content, model):
+        data = json.dumps({"model": model, "prompt": chat_content}, sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    @property
+    def index(self):
+        if self._index is None:
+            try:
+                self._index = json.loads(self.index_path.read_text())
+            except (FileNotFoundError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _expired(self, entry, now):
+        return self.ttl is not None and now - entry["created"] > self.ttl
+
+    def get(self, chat_content, model):
+        key = self.key(chat_content, model)
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry, time.time()):
+            self._remove(key)
+            self._save_index()
+            return None
+        try:
+            data = json.loads((self.path / entry["file"]).read_text())
+        except (FileNotFoundError, ValueError):
+            self._remove(key)
+            self._save_index()
+            return None
+        return ChatCompletion.model_validate(data)
+
+    def put(self, chat_content, model, completion):
+        key = self.key(chat_content, model)
+        self.path.mkdir(parents=True, exist_ok=True)
+        file_name = f"{key}.json"
+        (self.path / file_name).write_text(completion.model_dump_json())
+        self.index[key] = {"file": file_name, "created": time.time()}
+        self._evict()
+        self._save_index()
+
+    def _evict(self):
+        now = time.time()
+        expired = [key for key in self.index if self._expired(self.index[key], now)]
+        for key in expired:
+            self._remove(key)
+        if self.max_entries is not None and len(self.index) > self.max_entries:
+            oldest = sorted(self.index, key=lambda key: self.index[key]["created"])
+            for key in oldest[: len(self.index) - self.max_entries]:
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self.index.pop(key)
+        (self.path / entry["file"]).unlink(missing_ok=True)
+
+    def _save_index(self):
+        # Replace the index in one step so a reader never sees half of it
+        temporary = self.index_path.with_suffix(".tmp")
+        temporary.write_text(json.dumps(self.index))
+        os.replace(temporary, self.index_path)
 
+
+def render_prompt(sect1, sect2, template_path="template.tmpl"):
     # Use Jinja2 template for combined content
-    template_path = "template.tmpl"
     template = jinja2.Template(pathlib.Path(template_path).read_text())
-
     data = {"sect1": sect1, "sect2": sect2}
-    combined_content = template.render(data=data)
+    return template.render(data=data)
+
+
+def gen_chat_content():
+    sect1 = pathlib.Path("chat_instructions.txt").read_text()
+    sect2 = pathlib.Path("chat_recipe.txt").read_text()
+    combined_content = render_prompt(sect1, sect2)
 
     pathlib.Path("chat.txt").write_text(combined_content)
     return combined_content
 
 
-def generate_chat_completion(client, chat_content):
+def chat_messages(chat_content):
+    return [
+        {
+            "role": "user",
+            "content": chat_content,
+        },
+    ]
+
+
+def generate_chat_completion(client, chat_content, model=DEFAULT_MODEL):
     completion = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {
-                "role": "user",
-                "content": chat_content,
-            },
-        ],
+        model=model,
+        messages=chat_messages(chat_content),
     )
     return completion
 
 
-def pickle_completion(completion):
-    serialized_object = pickle.dumps(completion)
-    epoch_timestamp = int(time.time())
-    file_name = f"chat_{epoch_timestamp}.pkl"
-    out = pathlib.Path(file_name)
-    out.write_bytes(serialized_object)
-    return completion
+def _has_line_break(text):
+    # Whether str.splitlines() would split text or drop a trailing separator
+    return text.splitlines()[:1] != [text]
+
+
+class StreamedText:
+    """Completion text that arrives in pieces, as template data.
+
+    ``splitlines()`` yields each line, split as ``str.splitlines`` would,
+    once its line break has arrived, so a template that loops over
+    ``data.splitlines()`` can be rendered with ``Template.generate`` while
+    the response is still streaming.  Lines are kept, so every call yields
+    all of them.
+    """
+
+    def __init__(self, pieces):
+        self._pieces = iter(pieces)
+        self._parts = []
+        self._lines = []
+        self._source = self._split()
+
+    def _split(self):
+        pending = []
+        for piece in self._pieces:
+            if not piece:
+                continue
+            self._parts.append(piece)
+            pending.append(piece)
+            # A \r ending the previous piece may be the start of \r\n
+            if not _has_line_break(piece) and not (
+                len(pending) > 1 and pending[-2].endswith("\r")
+            ):
+                continue
+            text = "".join(pending)
+            last = text.splitlines(keepends=True)[-1]
+            keep = "" if _has_line_break(last) and last[-1] != "\r" else last
+            yield from text[: len(text) - len(keep)].splitlines()
+            pending = [keep] if keep else []
+        yield from "".join(pending).splitlines()
+
+    def splitlines(self):
+        index = 0
+        while True:
+            if index == len(self._lines):
+                line = next(self._source, None)
+                if line is None:
+                    return
+                self._lines.append(line)
+            yield self._lines[index]
+            index += 1
+
+    def finish(self):
+        """Read whatever the template did not, and return the full text."""
+        self._parts.extend(self._pieces)
+        return "".join(self._parts)
+
+
+def streams_lines(environment, source):
+    """Whether a template reads ``data`` only through ``data.splitlines()``,
+    which :class:`StreamedText` can render before the text is complete."""
+    tree = environment.parse(source)
+    streamed = set()
+    for call in tree.find_all(jinja2.nodes.Call):
+        method = call.node
+        if (
+            isinstance(method, jinja2.nodes.Getattr)
+            and method.attr == "splitlines"
+            and isinstance(method.node, jinja2.nodes.Name)
+            and not (call.args or call.kwargs or call.dyn_args or call.dyn_kwargs)
+        ):
+            streamed.add(id(method.node))
+    return all(
+        id(name) in streamed
+        for name in tree.find_all(jinja2.nodes.Name)
+        if name.name == "data"
+    )
+
+
+def stream_chat_completion(
+    client,
+    chat_content,
+    model=DEFAULT_MODEL,
+    template_path="template.j2",
+    output_path="results.txt",
+):
+    """Stream a completion, rendering it to ``output_path`` line by line.
+
+    Lines are written to ``output_path`` as they arrive.  The previous file
+    is copied to ``output_path`` with ``.bak`` appended and restored if the
+    stream fails, so a failed stream leaves ``output_path`` as it was.
+    Templates that use ``data`` other
+    than through ``data.splitlines()`` are rendered once the text is
+    complete.  Logs the time to the first token and the total latency, and
+    returns the assembled completion.
+    """
+    start = time.perf_counter()
+    stream = client.chat.completions.create(
+        model=model,
+        messages=chat_messages(chat_content),
+        stream=True,
+    )
+    chunks = []
+    timings = {}
+
+    def contents():
+        for chunk in stream:
+            chunks.append(chunk)
+            for choice in chunk.choices:
+                if choice.delta.content:
+                    timings.setdefault("first", time.perf_counter() - start)
+                    yield choice.delta.content
+
+    text = StreamedText(contents())
+    environment = jinja2.Environment()
+    source = pathlib.Path(template_path).read_text()
+    template = environment.from_string(source)
+    data = text if streams_lines(environment, source) else text.finish()
+
+    # The previous output is kept aside until the stream has completed
+    output_path = pathlib.Path(output_path)
+    backup = output_path.with_name(f"{output_path.name}.bak")
+    if output_path.exists():
+        shutil.copyfile(output_path, backup)
+    try:
+        with open(output_path, "w") as file:
+            for piece in template.generate(data=data):
+                file.write(piece)
+                file.flush()
+        content = text.finish()
+    except BaseException:
+        if backup.exists():
+            os.replace(backup, output_path)
+        else:
+            output_path.unlink(missing_ok=True)
+        raise
+    backup.unlink(missing_ok=True)
+    total = time.perf_counter() - start
+
+    logger.info(
+        "Time to first token: %.3fs, total latency: %.3fs",
+        timings.get("first", total),
+        total,
+    )
+    finish_reason = next(
+        (
+            choice.finish_reason
+            for chunk in reversed(chunks)
+            for choice in chunk.choices
+            if choice.finish_reason
+        ),
+        "stop",
+    )
+    last = chunks[-1] if chunks else None
+    return ChatCompletion.model_validate(
+        {
+            "id": last.id if last else "",
+            "object": "chat.completion",
+            "created": last.created if last else int(time.time()),
+            "model": last.model if last else model,
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": finish_reason,
+                    "message": {"role": "assistant", "content": content},
+                }
+            ],
+        }
+    )
+
+
+async def generate_chat_completion_async(
+    client, chat_content, semaphore, retries=3, backoff=1.0, model=DEFAULT_MODEL
+):
+    """Request a completion once a slot of ``semaphore`` is free.
+
+    Retryable errors are retried up to ``retries`` times, waiting
+    ``backoff`` seconds and doubling the wait after every attempt.  The slot
+    is given back while waiting.
+    """
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                return await client.chat.completions.create(
+                    model=model,
+                    messages=chat_messages(chat_content),
+                )
+        except RETRYABLE_ERRORS as error:
+            if attempt == retries:
+                raise
+            delay = backoff * 2**attempt
+            logger.warning("Retrying in %.1fs after %s", delay, error)
+            await asyncio.sleep(delay)
+
+
+def read_recipes(path):
+    """Recipe files from a directory of ``*.txt`` files or from a manifest
+    listing one path per line, relative to the manifest.
+
+    Blank lines and lines starting with ``#`` in a manifest are skipped.
+    """
+    path = pathlib.Path(path)
+    if path.is_dir():
+        return sorted(path.glob("*.txt"))
+
+    recipes = []
+    for line in path.read_text().splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            recipes.append(path.parent / line)
+    return recipes
+
+
+async def run_batch(
+    client,
+    recipes,
+    instructions,
+    output_dir,
+    concurrency=4,
+    retries=3,
+    backoff=1.0,
+    model=DEFAULT_MODEL,
+    cache=None,
+    refresh=False,
+):
+    """Complete every recipe concurrently through one client and render
+    each result to ``output_dir/<recipe name>.txt``.
+
+    Completions found in ``cache`` are reused unless ``refresh`` is set, and
+    new ones are added to it.  Returns a dict mapping each recipe to its
+    output path, or to the exception that made it fail.
+    """
+    output_dir = pathlib.Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def complete(recipe):
+        chat_content = render_prompt(instructions, recipe.read_text())
+        completion = None
+        if cache is not None and not refresh:
+            completion = cache.get(chat_content, model)
+        if completion is None:
+            completion = await generate_chat_completion_async(
+                client, chat_content, semaphore, retries, backoff, model
+            )
+            if cache is not None:
+                cache.put(chat_content, model, completion)
+        output_path = output_dir / f"{recipe.stem}.txt"
+        content = completion.choices[0].message.content
+        write_to_file(render_template(data=content), output_path)
+        logger.debug("Wrote %s", output_path)
+        return output_path
+
+    results = await asyncio.gather(
+        *(complete(recipe) for recipe in recipes), return_exceptions=True
+    )
+    return dict(zip(recipes, results))
+
+
+async def main_batch(args):
+    recipes = read_recipes(args.batch)
+    stems = [recipe.stem for recipe in recipes]
+    if len(set(stems)) != len(stems):
+        sys.exit("steadyforever: batch recipes need distinct file names")
+    instructions = pathlib.Path("chat_instructions.txt").read_text()
+
+    # One client, so every request shares its pool of HTTP connections;
+    # retries are left to generate_chat_completion_async
+    async with openai.AsyncOpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        base_url=args.base_url,
+        max_retries=0,
+    ) as client:
+        results = await run_batch(
+            client,
+            recipes,
+            instructions,
+            args.output_dir,
+            args.concurrency,
+            args.retries,
+            args.backoff,
+            args.model,
+            cache_from_args(args),
+            args.no_cache,
+        )
+
+    failed = 0
+    for recipe, result in results.items():
+        if isinstance(result, Exception):
+            failed += 1
+            logger.error("%s failed: %s", recipe, result)
+    logger.info("Completed %d of %d recipes", len(results) - failed, len(results))
+    if failed:
+        sys.exit(f"steadyforever: {failed} of {len(results)} recipes failed")
 
 
 def render_template(data, template_path="template.j2"):
@@ -74,41 +445,121 @@ def write_to_file(content, output_path="results.txt"):
         file.write(content)
 
 
-def main():
+def cache_from_args(args):
+    return CompletionCache(args.cache_dir, args.cache_ttl, args.cache_max_entries)
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description="chat completion")
     parser.add_argument(
         "--no-cache",
         action="store_true",
         help="Skip cache and generate a new completion.",
     )
+    parser.add_argument(
+        "--cache-dir",
+        default=".chat_cache",
+        help="Directory of cached completions, keyed by prompt and model.",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Ignore and drop cached completions older than this.",
+    )
+    parser.add_argument(
+        "--cache-max-entries",
+        type=int,
+        default=256,
+        help="Evict the oldest cached completions beyond this many.",
+    )
     parser.add_argument(
         "--verbose", action="store_true", help="Enable verbose logging (debug level)."
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--model", default=DEFAULT_MODEL, help="Chat model to complete with."
+    )
+    parser.add_argument(
+        "--base-url",
+        default=None,
+        help="API base URL, for a proxy or a local server (default: the"
+        " OpenAI API or OPENAI_BASE_URL).",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream the completion, writing results.txt as lines arrive, and"
+        " log the time to first token and the total latency.",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="PATH",
+        help="Complete every recipe in PATH, a directory of .txt recipes or a"
+        " manifest listing one recipe file per line, concurrently.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="results",
+        help="Directory for the rendered batch results, one file per recipe.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Most batch requests in flight at once.",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="Retries of a batch request after a connection, rate-limit or"
+        " server error.",
+    )
+    parser.add_argument(
+        "--backoff",
+        type=float,
+        default=1.0,
+        help="Seconds before the first retry, doubled for each further one.",
+    )
+    args = parser.parse_args(argv)
 
     logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
 
+    if args.batch:
+        if args.stream:
+            parser.error("--stream does not apply to --batch")
+        asyncio.run(main_batch(args))
+        return
+
     completion = None
+    streamed = False
+    cache = cache_from_args(args)
+    chat_content = gen_chat_content()
 
     if not args.no_cache:
-        completion = load_most_recent_pkl()
-        logger.debug("Loaded most recent pickle file.")
+        completion = cache.get(chat_content, args.model)
+        logger.debug("Cache %s.", "miss" if completion is None else "hit")
 
     if completion is None:
         api_key = os.environ.get("OPENAI_API_KEY")
-        client = openai.OpenAI(api_key=api_key)
-        chat_content = gen_chat_content()
-        completion = generate_chat_completion(client, chat_content)
-        pickle_completion(completion)
-        logger.debug("Generated new completion and saved to pickle file.")
+        client = openai.OpenAI(api_key=api_key, base_url=args.base_url)
+        if args.stream:
+            completion = stream_chat_completion(client, chat_content, args.model)
+            streamed = True
+        else:
+            completion = generate_chat_completion(client, chat_content, args.model)
+        cache.put(chat_content, args.model, completion)
+        logger.debug("Generated new completion and saved it to the cache.")
 
     logger.debug("+" * 20)
     logger.debug(completion.choices[0].message)
     logger.debug("-" * 20)
 
-    content = completion.choices[0].message.content
-    rendered_content = render_template(data=content)
-    write_to_file(rendered_content)
+    if not streamed:
+        content = completion.choices[0].message.content
+        rendered_content = render_template(data=content)
+        write_to_file(rendered_content)
 
 
 if __name__ == "__main__":
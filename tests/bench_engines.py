@@ -0,0 +1,352 @@
+"""Benchmark every engine on seeded synthetic ingredient corpora.
+
+Each case runs in a fresh process so its peak RSS can be measured, and
+reports the number of pairs covered per second; imports and input
+preparation are not timed.  Quadratic cases whose pair count exceeds their
+own cap are skipped; ``--max-pairs`` sets one cap for all of them.
+
+Run with ``python tests/bench_engines.py``; ``--save baseline.json``
+records the results and ``--compare baseline.json`` fails when throughput
+drops by more than ``--tolerance``.  tests/bench_baseline.json was recorded
+with ``--sizes 1000`` on a single-core machine; compare against it with the
+same sizes, and re-record it when the benchmarking machine changes.
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import multiprocessing
+import pathlib
+import random
+import resource
+import sys
+import tempfile
+import time
+
+DATA_PATH = pathlib.Path(__file__).resolve().parents[1] / "data.txt"
+
+FALLBACK_LINES = [
+    "All Purpose Flour",
+    "Almond Milk",
+    "Apple Cider Vinegar",
+    "Coconut Milk",
+    "Red Wine Vinegar",
+    "Sea Salt",
+    "Kaffir lime leaves",
+    "Oil-packed anchovy fillets",
+]
+
+
+def make_corpus(lines, seed=0, template=None):
+    """Generate ingredient-like lines modeled on the words of data.txt.
+
+    Word counts per line and the vocabulary follow the template lines; about
+    a fifth of the lines are case or one-character variants of an earlier
+    line so that the engines find near-duplicates at a realistic rate.
+    """
+    if template is None:
+        template = (
+            DATA_PATH.read_text().splitlines() if DATA_PATH.exists() else []
+        ) or FALLBACK_LINES
+    template = [line for line in template if line.strip()]
+    words = sorted({word for line in template for word in line.split()})
+    word_counts = [len(line.split()) for line in template]
+
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(lines):
+        if corpus and rng.random() < 0.2:
+            line = rng.choice(corpus)
+            if rng.random() < 0.5:
+                line = line.lower() if rng.random() < 0.5 else line.title()
+            else:
+                position = rng.randrange(len(line))
+                line = line[:position] + rng.choice(line) + line[position + 1 :]
+        else:
+            line = " ".join(rng.choice(words) for _ in range(rng.choice(word_counts)))
+        corpus.append(line)
+    return corpus
+
+
+def triangle(count):
+    return count * (count - 1) // 2
+
+
+# Every case imports its engine and prepares its inputs, then returns the
+# callable that is timed; it returns the number of pairs it covered
+
+
+def bench_portflower(algorithm_name):
+    def prepare(strings, path):
+        from minortop import portflower
+
+        algorithm = {
+            "levenshtein": portflower.LevenshteinAlgorithm,
+            "jaccard": portflower.JaccardAlgorithm,
+            "cosine": portflower.CosineSimilarityAlgorithm,
+            "batched-cosine": portflower.BatchedCosineSimilarityAlgorithm,
+        }[algorithm_name]()
+        calculator = portflower.SimilarityCalculator(algorithm)
+        threshold = 1 if algorithm_name == "levenshtein" else 0.1
+
+        def run():
+            portflower.find_pairs_below_score(strings, threshold, calculator)
+            return triangle(len(strings))
+
+        return run
+
+    return prepare
+
+
+def bench_reasonlabel(strings, path):
+    from minortop import reasonlabel
+
+    def run():
+        reasonlabel.compare_strings(strings, 0.9)
+        return triangle(len(strings))
+
+    return run
+
+
+def bench_needleman_wunsch(strings, path):
+    from minortop import britishcouch
+
+    # Kernel throughput does not depend on the corpus size, so score a fixed
+    # sample of adjacent pairs with the kernel the engine picks for them
+    pairs = list(zip(strings, strings[1:]))[:1000]
+    alphabet = britishcouch.build_alphabet(
+        string.lower() for pair in pairs for string in pair
+    )
+
+    def run():
+        for str1, str2 in pairs:
+            britishcouch.calculate_similarity(str1, str2, alphabet)
+        return len(pairs)
+
+    return run
+
+
+def bench_needleman_wunsch_kernel(kernel, length):
+    """Score 200 pairs of ``length``-character slices of the corpus with one
+    kernel; the scalar and vectorized cases at the same length show where
+    ``britishcouch.SCALAR_MAX_LENGTH`` belongs."""
+
+    def prepare(strings, path):
+        from minortop import britishcouch
+
+        text = " ".join(strings)
+        slices = [text[i : i + length] for i in range(0, len(text), length)]
+        slices = [piece for piece in slices if len(piece) == length][:400]
+        pairs = list(zip(slices[::2], slices[1::2]))
+        if kernel == "scalar":
+
+            def run():
+                for str1, str2 in pairs:
+                    britishcouch.needleman_wunsch(str1, str2)
+                return len(pairs)
+
+            return run
+
+        # As in iter_similar_pairs, the alphabet and buffers are built once
+        alphabet = britishcouch.build_alphabet(slices)
+        codes = [
+            (britishcouch.encode(str1, alphabet), britishcouch.encode(str2, alphabet))
+            for str1, str2 in pairs
+        ]
+        buffers = britishcouch.ScoreBuffers.for_codes(
+            [code for pair in codes for code in pair]
+        )
+
+        def run():
+            for codes1, codes2 in codes:
+                britishcouch.needleman_wunsch_codes(codes1, codes2, buffers=buffers)
+            return len(codes)
+
+        return run
+
+    return prepare
+
+
+def bench_refuseapprove(streamed):
+    def prepare(strings, path):
+        from minortop import refuseapprove
+
+        # PairwiseAligner rejects empty sequences
+        data = [string for string in strings if string]
+
+        def run():
+            if streamed:
+                # An explicit aligner scores pair by pair instead of in NumPy
+                # blocks
+                aligner = refuseapprove.make_aligner()
+                for _pair in refuseapprove.iter_similar_pairs(data, 10, aligner):
+                    pass
+            else:
+                refuseapprove.filter_by_similarity(data, 10)
+            return triangle(len(data))
+
+        return run
+
+    return prepare
+
+
+def bench_bootfamily(strings, path):
+    from minortop import bootfamily
+
+    def run():
+        bootfamily.main(0.9, path)
+        return triangle(len(strings))
+
+    return run
+
+
+def bench_soundex(strings, path):
+    from minortop import soundex
+
+    def run():
+        # Blocking only compares the pairs within each soundex bucket
+        index = soundex.build_soundex_index(strings)
+        return sum(1 for _pair in soundex.iter_bucket_pairs(index))
+
+    return run
+
+
+def bench_cosine_similarity(strings, path):
+    from minortop import cosine_similarity
+
+    def run():
+        cosine_similarity.main(["--data-path", path, "--chunk-size", "256"])
+        return triangle(len(strings))
+
+    return run
+
+
+# name -> (function, default --max-pairs, None when the cost does not grow
+# with the number of pairs); the caps keep the per-pair Python loops off the
+# corpora where they would take more than a few minutes, and portflower,
+# which holds every match in memory, off the 100k corpus
+CASES = {
+    "portflower-levenshtein": (bench_portflower("levenshtein"), 5e7),
+    "portflower-jaccard": (bench_portflower("jaccard"), 5e7),
+    "portflower-cosine": (bench_portflower("cosine"), 2e6),
+    "portflower-batched-cosine": (bench_portflower("batched-cosine"), 5e7),
+    "reasonlabel": (bench_reasonlabel, 5e7),
+    "britishcouch-needleman-wunsch": (bench_needleman_wunsch, None),
+    **{
+        f"britishcouch-{kernel}-{length}": (
+            bench_needleman_wunsch_kernel(kernel, length),
+            None,
+        )
+        for length in (8, 16, 30, 100)
+        for kernel in ("scalar", "vectorized")
+    },
+    "refuseapprove": (bench_refuseapprove(streamed=False), 2e6),
+    "refuseapprove-streamed": (bench_refuseapprove(streamed=True), 2e6),
+    "bootfamily": (bench_bootfamily, 5e9),
+    "soundex-blocking": (bench_soundex, None),
+    "cosine-similarity": (bench_cosine_similarity, 5e9),
+}
+
+
+MIN_SECONDS = 0.5
+
+
+def run_case(name, path):
+    """Run one case in the current (fresh) process."""
+    strings = pathlib.Path(path).read_text().splitlines()
+    prepare, _max_pairs = CASES[name]
+    with contextlib.redirect_stdout(io.StringIO()):
+        function = prepare(strings, path)
+        # Repeat cases that finish within MIN_SECONDS and keep the fastest run,
+        # so that millisecond timings are not dominated by noise
+        seconds = float("inf")
+        total = 0
+        while total < MIN_SECONDS:
+            start = time.perf_counter()
+            pairs = function()
+            elapsed = time.perf_counter() - start
+            seconds = min(seconds, elapsed)
+            total += elapsed
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    return {
+        "seconds": seconds,
+        "pairs": pairs,
+        "pairs_per_second": pairs / seconds if seconds else float("inf"),
+        "peak_rss_bytes": peak_rss,
+    }
+
+
+def run_isolated(name, path):
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as executor:
+        return executor.submit(run_case, name, path).result()
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if not previous or "pairs_per_second" not in result:
+            continue
+        ratio = result["pairs_per_second"] / previous["pairs_per_second"]
+        if ratio < 1 - tolerance:
+            regressions.append((key, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--cases", default=",".join(CASES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--max-pairs",
+        type=float,
+        help="skip quadratic cases above this many pairs (default: per case)",
+    )
+    parser.add_argument("--save", metavar="JSON", help="write results to JSON")
+    parser.add_argument("--compare", metavar="JSON", help="baseline to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.4)
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in (int(size) for size in args.sizes.split(",")):
+            path = str(pathlib.Path(directory) / f"corpus_{size}.txt")
+            corpus = make_corpus(size, args.seed)
+            pathlib.Path(path).write_text("\n".join(corpus) + "\n")
+
+            for name in args.cases.split(","):
+                key = f"{name}/{size}"
+                max_pairs = CASES[name][1]
+                if max_pairs is not None and args.max_pairs is not None:
+                    max_pairs = args.max_pairs
+                if max_pairs is not None and triangle(size) > max_pairs:
+                    results[key] = {"skipped": f"more than {max_pairs:g} pairs"}
+                    print(f"{key:<40} skipped")
+                    continue
+                result = results[key] = run_isolated(name, path)
+                print(
+                    f"{key:<40} {result['seconds']:>9.3f} s"
+                    f" {result['pairs_per_second']:>14,.0f} pairs/s"
+                    f" {result['peak_rss_bytes'] / 2**20:>9.1f} MiB"
+                )
+
+    if args.save:
+        pathlib.Path(args.save).write_text(json.dumps(results, indent=2) + "\n")
+
+    if args.compare:
+        baseline = json.loads(pathlib.Path(args.compare).read_text())
+        regressions = compare(results, baseline, args.tolerance)
+        for key, ratio in regressions:
+            print(f"REGRESSION {key}: {ratio:.0%} of baseline throughput")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import random
+
+import numpy
+import pytest
+
+from minortop import britishcouch
+
+PAIRS = [
+    ("", ""),
+    ("", "abc"),
+    ("abc", ""),
+    ("a", "a"),
+    ("a", "b"),
+    ("kitten", "sitting"),
+    ("all purpose flour", "all-purpose flour"),
+    ("almond milk", "coconut milk"),
+    ("Apple Cider Vinegar", "apple cider vinegar"),
+    ("crème fraîche", "creme fraiche"),
+]
+
+
+def reference_needleman_wunsch(
+    str1, str2, match_score=2, mismatch_score=-1, gap_penalty=-1
+):
+    """The original full-matrix needleman_wunsch, which every kernel must
+    reproduce."""
+    len_str1 = len(str1) + 1
+    len_str2 = len(str2) + 1
+
+    # Initialize the scoring matrix
+    score_matrix = numpy.zeros((len_str1, len_str2), dtype=int)
+
+    for i in range(1, len_str1):
+        for j in range(1, len_str2):
+            match = score_matrix[i - 1, j - 1] + (
+                match_score if str1[i - 1] == str2[j - 1] else mismatch_score
+            )
+            delete = score_matrix[i - 1, j] + gap_penalty
+            insert = score_matrix[i, j - 1] + gap_penalty
+            score_matrix[i, j] = max(match, delete, insert)
+
+    return score_matrix[len_str1 - 1, len_str2 - 1]
+
+
+@pytest.mark.parametrize("str1, str2", PAIRS)
+def test_kernels_match_reference(str1, str2):
+    expected = reference_needleman_wunsch(str1, str2)
+    assert britishcouch.needleman_wunsch(str1, str2) == expected
+    assert britishcouch.needleman_wunsch(str2, str1) == expected
+    assert britishcouch.needleman_wunsch_vectorized(str1, str2) == expected
+    assert britishcouch.needleman_wunsch_vectorized(str2, str1) == expected
+
+
+@pytest.mark.parametrize(
+    "match_score, mismatch_score, gap_penalty",
+    [(2, -1, -1), (1, 0, 0), (3, -2, -4), (1, -1, 1)],
+)
+def test_kernels_match_reference_random(match_score, mismatch_score, gap_penalty):
+    rng = random.Random(1234)
+    for _ in range(200):
+        str1 = "".join(rng.choice("abcd ") for _ in range(rng.randint(0, 30)))
+        str2 = "".join(rng.choice("abcd ") for _ in range(rng.randint(0, 30)))
+        scoring = (match_score, mismatch_score, gap_penalty)
+        expected = reference_needleman_wunsch(str1, str2, *scoring)
+        assert britishcouch.needleman_wunsch(str1, str2, *scoring) == expected
+        actual = britishcouch.needleman_wunsch_vectorized(str1, str2, *scoring)
+        assert actual == expected
+
+
+def test_calculate_similarity_is_bit_identical():
+    str1, str2 = "Oil-packed anchovy fillets", "anchovy fillets"
+    expected = reference_needleman_wunsch(str1.lower(), str2.lower()) / len(str1)
+    assert britishcouch.calculate_similarity(str1, str2) == expected
+
+
+def test_calculate_similarity_picks_kernel_by_length(monkeypatch):
+    vectorized = []
+    original = britishcouch.needleman_wunsch_vectorized
+
+    def spy(*args, **kwargs):
+        vectorized.append(args[:2])
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(britishcouch, "needleman_wunsch_vectorized", spy)
+    cutoff = britishcouch.SCALAR_MAX_LENGTH
+    short, long = "b" + "a" * (cutoff - 1), "a" * cutoff + "b"
+    alphabet = britishcouch.build_alphabet([short, long])
+    for str1, str2 in [(short, short[::-1]), (short, long), (long, long[::-1])]:
+        expected = reference_needleman_wunsch(str1, str2) / max(len(str1), len(str2))
+        assert britishcouch.calculate_similarity(str1, str2, alphabet) == expected
+    assert vectorized == [(short, long), (long, long[::-1])]
+
+
+def test_encode_uses_uint8_codes():
+    alphabet = britishcouch.build_alphabet(["abc", "cab"])
+    codes = britishcouch.encode("cab", alphabet)
+    assert codes.dtype == "uint8"
+    assert codes.tolist() == [2, 0, 1]
+
+
+def test_floor_stops_only_alignments_that_cannot_exceed_it():
+    rng = random.Random(99)
+    alphabet = {char: code for code, char in enumerate("abcd ")}
+    for _ in range(300):
+        str1 = "".join(rng.choice("abcd ") for _ in range(rng.randint(0, 25)))
+        str2 = "".join(rng.choice("abcd ") for _ in range(rng.randint(0, 25)))
+        codes1 = britishcouch.encode(str1, alphabet)
+        codes2 = britishcouch.encode(str2, alphabet)
+        score = reference_needleman_wunsch(str1, str2)
+        assert score <= britishcouch.score_upper_bound(len(str1), len(str2))
+        floor = rng.randint(-10, 30)
+        pruned = britishcouch.needleman_wunsch_codes(codes1, codes2, floor=floor)
+        if pruned is None:
+            assert score <= floor
+        else:
+            assert pruned == score
+
+
+@pytest.mark.parametrize("threshold", [-0.5, 0.0, 0.5, 0.9, 1.5])
+def test_pruned_pairs_match_exhaustive_scoring(threshold):
+    rng = random.Random(7)
+    strings = [
+        "".join(rng.choice("abAB ") for _ in range(rng.randint(0, 12)))
+        for _ in range(40)
+    ]
+    # Lowercasing lengthens this one, so its score and length groups differ
+    strings.append("\u0130ab")
+    expected = [
+        (britishcouch.calculate_similarity(strings[i], strings[j]), i, j)
+        for i in range(len(strings))
+        for j in range(i + 1, len(strings))
+    ]
+    expected = [match for match in expected if match[0] > threshold]
+
+    counts = {}
+    matches = list(britishcouch.iter_similar_pairs(strings, threshold, counts=counts))
+    assert matches == expected
+    assert counts["total"] == len(strings) * (len(strings) - 1) // 2
+    assert counts["pruned"] + counts["stopped"] <= counts["total"] - len(matches)
+
+
+def alignment_score(columns, codes1, codes2, match=2, mismatch=-1, gap=-1):
+    # A leading run of gaps in one string is free, as in reference_needleman_wunsch
+    kind = None if not columns else (columns[0][0] is None, columns[0][1] is None)
+    start = 0
+    while start < len(columns) and kind != (False, False):
+        if (columns[start][0] is None, columns[start][1] is None) != kind:
+            break
+        start += 1
+    score = 0
+    for i, j in columns[start:]:
+        if i is None or j is None:
+            score += gap
+        else:
+            score += match if codes1[i] == codes2[j] else mismatch
+    return score
+
+
+def test_alignment_columns_reach_the_score(monkeypatch):
+    # Recurse down to tiny halves
+    monkeypatch.setattr(britishcouch, "FULL_CELLS", 4)
+    rng = random.Random(42)
+    alphabet = {char: code for code, char in enumerate("abcd ")}
+    for _ in range(200):
+        str1 = "".join(rng.choice("abcd ") for _ in range(rng.randint(0, 25)))
+        str2 = "".join(rng.choice("abcd ") for _ in range(rng.randint(0, 25)))
+        codes1 = britishcouch.encode(str1, alphabet)
+        codes2 = britishcouch.encode(str2, alphabet)
+        columns = britishcouch.alignment_columns(codes1, codes2)
+        assert [i for i, _ in columns if i is not None] == list(range(len(str1)))
+        assert [j for _, j in columns if j is not None] == list(range(len(str2)))
+        expected = reference_needleman_wunsch(str1, str2)
+        assert alignment_score(columns, codes1, codes2) == expected
+
+
+def test_format_alignment():
+    assert britishcouch.format_alignment("Basil", "Fresh Basil") == (
+        "------Basil\n      |||||\nFresh Basil\n"
+    )
+
+
+def test_top_n_keeps_highest_scores(tmp_path, capsys):
+    data = tmp_path / "data.txt"
+    data.write_text("Salt\nsalt\nSea salt\nSea Salt\nPepper\n")
+    britishcouch.main(["--file-path", str(data), "--similarity-threshold", "0.5"])
+    everything = capsys.readouterr().out
+    britishcouch.main(
+        ["--file-path", str(data), "--similarity-threshold", "0.5", "--top-n", "1"]
+    )
+    top = capsys.readouterr().out
+
+    assert "score: 2.000\nSea salt\nSea Salt\n" in top
+    assert top.count("\nscore:") == 1
+    # Statistics cover every match, not only the N displayed
+    assert top.splitlines()[-4:] == everything.splitlines()[-4:]
+
+
+def test_top_n_needs_sorted_output(capsys):
+    with pytest.raises(SystemExit):
+        britishcouch.main(["--top-n", "1", "--stream"])
+    assert "--top-n cannot be combined with --stream" in capsys.readouterr().err
@@ -0,0 +1,66 @@
+from minortop import (
+    bootfamily,
+    clusters,
+    cosine_similarity,
+    dedupe,
+    portflower,
+    reasonlabel,
+)
+
+STRINGS = ["salt", "Sea Salt", "malt", "pepper", "peppers", "Salt", "thyme", "halt"]
+
+
+def components_of(pairs, count):
+    union_find = clusters.UnionFind(count)
+    union_find.add_matches(pairs)
+    return union_find.components()
+
+
+def test_union_find():
+    union_find = clusters.UnionFind(6)
+    union_find.union(4, 5)
+    union_find.union(0, 4)
+    union_find.union(5, 0)
+    union_find.union(2, 3)
+    assert union_find.unions == 3
+    assert union_find.components() == [[0, 4, 5], [2, 3]]
+    assert union_find.find(5) == union_find.find(0)
+
+
+def test_portflower_clusters_match_pairs():
+    calculator = portflower.SimilarityCalculator(portflower.LevenshteinAlgorithm())
+    pairs = portflower.find_pairs_below_score(STRINGS, 1, calculator)
+    expected = components_of(((i, j) for (i, j), _score in pairs), len(STRINGS))
+    assert expected == [[0, 2, 5, 7], [3, 4]]
+
+    union_find = portflower.cluster_below_score(STRINGS, 1, calculator)
+    assert union_find.components() == expected
+
+    deduplicated = dedupe.Deduplicated(STRINGS)
+    union_find = portflower.cluster_below_score(
+        STRINGS, 1, calculator, deduplicated=deduplicated
+    )
+    assert union_find.components() == expected
+
+
+def test_reasonlabel_and_bootfamily_clusters_match_pairs():
+    pairs = list(reasonlabel.iter_similar_pairs(STRINGS, 0.8))
+    union_find = reasonlabel.cluster_strings(STRINGS, 0.8)
+    assert union_find.components() == components_of(pairs, len(STRINGS))
+
+    counts = cosine_similarity.count_matrix(STRINGS)
+    pairs = bootfamily.similar_pairs(counts, 0.5)
+    assert list(bootfamily.iter_similar_pairs(counts, 0.5, chunk_size=3)) == pairs
+    assert components_of(pairs, len(STRINGS)) == [[0, 1, 5]]
+
+
+def test_print_clusters(capsys):
+    clusters.print_clusters(STRINGS, [[3, 4]], len(STRINGS))
+    assert capsys.readouterr().out.splitlines() == [
+        "Cluster 1: 2 strings, representative: pepper",
+        "  pepper",
+        "  peppers",
+        "",
+        "Clusters: 1",
+        "Clustered strings: 2 of 8",
+    ]
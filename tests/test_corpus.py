@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from minortop import corpus
+
+TEXT = "Sea Salt\r\n  Almond Milk \n\nété\nno newline"
+
+
+def test_text_corpus_matches_splitlines(tmp_path):
+    path = tmp_path / "data.txt"
+    path.write_bytes(TEXT.encode())
+
+    strings = corpus.load(path)
+    assert strings.tolist() == TEXT.splitlines()
+    assert strings[-1] == "no newline"
+    assert strings[1:3] == ["  Almond Milk ", ""]
+    with pytest.raises(IndexError):
+        strings[5]
+
+    stripped = corpus.load(path, strip=True)
+    assert stripped.tolist() == [line.strip() for line in TEXT.splitlines()]
+
+
+def test_binary_corpus_round_trip(tmp_path):
+    text = tmp_path / "data.txt"
+    text.write_bytes(TEXT.encode())
+    binary = tmp_path / "data.corpus"
+
+    assert corpus.pack(text, binary) == 5
+    assert corpus.load(binary).tolist() == corpus.load(text).tolist()
+
+    data, starts, ends = corpus.load(binary).packed()
+    assert data[starts[3] : ends[3]].tobytes().decode() == "été"
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_bytes(b"")
+    assert len(corpus.load(path)) == 0
+
+    corpus.pack(path, tmp_path / "empty.corpus")
+    assert len(corpus.load(tmp_path / "empty.corpus")) == 0
+
+
+SEPARATORS = ["\n", "\r\n", "\r", "\v", "\f", "\x1c", "\x1d", "\x1e"]
+SEPARATORS += ["\x85", "\u2028", "\u2029"]
+
+
+@pytest.mark.parametrize("scan_bytes", [1, 2, 3, 1 << 24])
+def test_lines_split_as_splitlines(tmp_path, monkeypatch, scan_bytes):
+    # Small scan chunks split \r\n and multi-byte separators between chunks
+    monkeypatch.setattr(corpus, "SCAN_BYTES", scan_bytes)
+    rng = random.Random(scan_bytes)
+    pieces = ["a", "é", "\u2030", " "] + SEPARATORS
+    path = tmp_path / "data.txt"
+    for _ in range(50):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randrange(12)))
+        path.write_bytes(text.encode())
+        assert corpus.load(path).tolist() == text.splitlines(), repr(text)
+
+
+def test_text_starting_with_magic_is_text(tmp_path):
+    path = tmp_path / "data.txt"
+    path.write_bytes(b"MTCORPUS notes\nsalt\n")
+    assert corpus.load(path).tolist() == ["MTCORPUS notes", "salt"]
+
+
+def test_invalid_binary_corpus(tmp_path):
+    text = tmp_path / "data.txt"
+    text.write_bytes(TEXT.encode())
+    binary = tmp_path / "data.corpus"
+    corpus.pack(text, binary)
+    packed = binary.read_bytes()
+
+    for damaged in (packed[:-1], packed[:30], packed[:9] + b"\x02" + packed[10:]):
+        binary.write_bytes(damaged)
+        with pytest.raises(ValueError, match="not a valid version 1 binary corpus"):
+            corpus.load(binary)
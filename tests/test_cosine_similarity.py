@@ -0,0 +1,50 @@
+import random
+
+import pytest
+import sklearn.preprocessing
+
+from minortop import cosine_similarity
+
+WORDS = ["salt", "sea", "black", "pepper", "oil", "olive", "red", "chili", "lime"]
+
+
+def brute_force(counts):
+    """Every pair with its score, most similar first, ties by (i, j)."""
+    normalized = sklearn.preprocessing.normalize(counts)
+    scores = (normalized @ normalized.T).toarray()
+    pairs = [
+        (i, j, scores[i, j])
+        for i in range(len(scores))
+        for j in range(i + 1, len(scores))
+    ]
+    return sorted(pairs, key=lambda pair: (-pair[2], pair[0], pair[1]))
+
+
+@pytest.mark.parametrize(
+    "top, bottom, chunk_size", [(5, 5, 3), (10, 0, 7), (0, 40, 64)]
+)
+def test_top_bottom_pairs_match_brute_force(top, bottom, chunk_size):
+    rng = random.Random(top + bottom)
+    strings = [
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 3))) for _ in range(30)
+    ]
+    counts = cosine_similarity.count_matrix(strings)
+    pairs = brute_force(counts)
+    ascending = sorted(pairs, key=lambda pair: (pair[2], pair[0], pair[1]))
+
+    best, worst = cosine_similarity.top_bottom_pairs(counts, top, bottom, chunk_size)
+    assert best == pairs[:top]
+    assert worst == ascending[:bottom]
+
+
+def test_main_top_bottom(tmp_path, capsys):
+    data = tmp_path / "data.txt"
+    data.write_text("sea salt\nsalt\nblack pepper\nolive oil\n")
+    cosine_similarity.main(["--data-path", str(data), "--top", "1", "--bottom", "1"])
+    assert capsys.readouterr().out.splitlines() == [
+        "Top 1 items and scores:",
+        "Items: 'sea salt' and 'salt', Score = 0.7071067811865475",
+        "",
+        "Bottom 1 items and scores:",
+        "Items: 'sea salt' and 'black pepper', Score = 0.0",
+    ]
@@ -0,0 +1,47 @@
+from minortop import dedupe, portflower, refuseapprove
+
+
+def test_normalize():
+    assert dedupe.normalize("  Sea\tSALT ") == "sea salt"
+    assert dedupe.normalize("Straße") == "strasse"
+    assert dedupe.normalize("Ｓａｌｔ") == "ｓａｌｔ"
+    assert dedupe.normalize("Ｓａｌｔ", nfkc=True) == "salt"
+
+
+def test_groups_and_expand():
+    strings = ["Salt", "pepper", "salt ", "SALT", "Pepper", "malt"]
+    deduplicated = dedupe.Deduplicated(strings)
+    assert deduplicated.unique == ["salt", "pepper", "malt"]
+    assert deduplicated.groups == [[0, 2, 3], [1, 4], [5]]
+    assert deduplicated.multiplicity(0) == 3
+
+    matches = deduplicated.expand([(0, 2, 1.0)], lambda k: (0.0,) if k == 0 else None)
+    assert sorted(matches) == [
+        (0, 2, 0.0),
+        (0, 3, 0.0),
+        (0, 5, 1.0),
+        (2, 3, 0.0),
+        (2, 5, 1.0),
+        (3, 5, 1.0),
+    ]
+
+
+def test_expanded_matches_equal_scoring_every_line():
+    strings = ["salt", "Salt", "malt", "halt ", "pepper", "SALT", "salts"]
+    normalized = [dedupe.normalize(string) for string in strings]
+    deduplicated = dedupe.Deduplicated(normalized)
+
+    # Scoring the deduplicated strings gives the same pairs as scoring every
+    # (already normalized) line
+    calculator = portflower.SimilarityCalculator(portflower.LevenshteinAlgorithm())
+    full = portflower.find_pairs_below_score(normalized, 1, calculator)
+    unique = portflower.find_pairs_below_score(deduplicated.unique, 1, calculator)
+    expanded = deduplicated.expand(
+        ((u, v, score) for (u, v), score in unique),
+        lambda k: (0,),
+    )
+    assert sorted(full) == sorted(((i, j), score) for i, j, score in expanded)
+
+    comparisons, pairs = refuseapprove.filter_by_similarity(normalized, 3, deduplicated)
+    assert comparisons == 10
+    assert pairs == refuseapprove.filter_by_similarity(normalized, 3)[1]
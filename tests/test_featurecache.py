@@ -0,0 +1,84 @@
+import numpy
+
+from minortop import featurecache
+
+
+def char_codes(string):
+    return [ord(char) for char in sorted(set(string.lower()))]
+
+
+def test_features_are_reused_across_runs(tmp_path):
+    cache = featurecache.FeatureCache(tmp_path)
+    first = cache.features(["Salt", "salt", ""], "chars", char_codes, dtype="uint32")
+    assert [array.tolist() for array in first] == [
+        [97, 108, 115, 116],
+        [97, 108, 115, 116],
+        [],
+    ]
+    assert (cache.hits, cache.misses) == (0, 3)
+
+    rerun = featurecache.FeatureCache(tmp_path)
+    second = rerun.features(["Salt", "Pepper"], "chars", char_codes, dtype="uint32")
+    assert (rerun.hits, rerun.misses) == (1, 1)
+    assert isinstance(second[0], numpy.memmap)
+    assert second[1].tolist() == [101, 112, 114]
+
+
+def test_params_are_part_of_the_key(tmp_path):
+    cache = featurecache.FeatureCache(tmp_path)
+    cache.features(["Salt"], "chars", char_codes, params=(1,))
+    cache.features(["Salt"], "chars", char_codes, params=(2,))
+    assert cache.misses == 2
+
+
+def test_least_recently_used_segments_are_evicted(tmp_path):
+    cache = featurecache.FeatureCache(tmp_path, max_bytes=1)
+    cache.features(["a" * 100], "chars", char_codes)
+    cache.features(["b" * 100], "chars", char_codes)
+    assert len(cache._segments()) == 1
+    cache.features(["b" * 100], "chars", char_codes)
+    assert cache.hits == 1
+
+
+def test_normalized_strings_share_an_entry(tmp_path):
+    cache = featurecache.FeatureCache(tmp_path)
+    tokens = cache.features(
+        ["Sea  salt", "sea salt", "SEA SALT "],
+        "words",
+        lambda string: string.split(),
+        dtype=str,
+        normalize=featurecache.lowercase_words,
+    )
+    assert [array.tolist() for array in tokens] == [["sea", "salt"]] * 3
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_segments_are_compacted(tmp_path):
+    cache = featurecache.FeatureCache(tmp_path)
+    for number in range(featurecache.MAX_SEGMENTS + 1):
+        cache.features([str(number)], "chars", char_codes)
+    assert len(cache._segments("chars")) == 1
+
+    rerun = featurecache.FeatureCache(tmp_path)
+    codes = rerun.features(["0", "8"], "chars", char_codes)
+    assert [array.tolist() for array in codes] == [[48], [56]]
+    assert rerun.misses == 0
+
+
+def test_keys_are_searched_in_sorted_order(tmp_path, monkeypatch):
+    # Digests ending in NUL bytes, which numpy strips from S16 items
+    monkeypatch.setattr(
+        featurecache,
+        "feature_key",
+        lambda string, feature, params: string.encode().ljust(16, b"\0"),
+    )
+    cache = featurecache.FeatureCache(tmp_path)
+    cache.features(["c", "a", "b"], "chars", char_codes)
+    cache.features(["d", "a"], "chars", char_codes)
+    keys = [numpy.load(path / "keys.npy") for path in cache._segments("chars")]
+    assert sorted(key.tolist() for key in keys) == [[b"a", b"b", b"c"], [b"d"]]
+
+    rerun = featurecache.FeatureCache(tmp_path)
+    codes = rerun.features(["d", "b", "z", "a"], "chars", char_codes)
+    assert [array.tolist() for array in codes] == [[100], [98], [122], [97]]
+    assert (rerun.hits, rerun.misses) == (3, 1)
@@ -0,0 +1,56 @@
+import pytest
+
+from minortop import bootfamily, cosine_similarity, incremental, portflower
+
+PARAMS = {"engine": "test", "threshold": 0.5}
+
+
+def test_appended_corpus_resumes(tmp_path):
+    state = tmp_path / "state.json"
+    incremental.save_state(state, ["a", "b"], PARAMS, [(0, 1, 0.25)])
+
+    start, matches = incremental.load_state(state, ["a", "b", "c"], PARAMS)
+    assert start == 2
+    assert matches == [(0, 1, 0.25)]
+
+
+def test_unusable_state_starts_over(tmp_path):
+    state = tmp_path / "state.json"
+    assert incremental.load_state(state, ["a"], PARAMS) == (0, [])
+
+    incremental.save_state(state, ["a", "b"], PARAMS, [(0, 1, 0.25)])
+    assert incremental.load_state(state, ["a", "B", "c"], PARAMS) == (0, [])
+    assert incremental.load_state(state, ["a"], PARAMS) == (0, [])
+    assert incremental.load_state(state, ["a", "b"], {"engine": "other"}) == (0, [])
+
+
+def test_start_only_scores_new_pairs():
+    strings = ["salt", "malt", "halt", "pepper", "salts"]
+    calculator = portflower.SimilarityCalculator(portflower.LevenshteinAlgorithm())
+    full = portflower.find_pairs_below_score(strings, 1, calculator)
+    new = portflower.find_pairs_below_score(strings, 1, calculator, start=3)
+    assert new == [pair for pair in full if pair[0][1] >= 3]
+
+
+@pytest.mark.parametrize("start", [0, 1, 3, 7, 8])
+@pytest.mark.parametrize("chunk_size", [1, 3, 1024])
+def test_bootfamily_start_only_scores_new_pairs(start, chunk_size):
+    strings = ["salt", "Sea Salt", "malt", "salt sea", "pepper", "Salt", "sea", "s"]
+    counts = cosine_similarity.count_matrix(strings)
+    full = bootfamily.similar_pairs(counts, 0.3)
+    new = bootfamily.iter_similar_pairs(counts, 0.3, start, chunk_size)
+    assert list(new) == [pair for pair in full if pair[1] >= start]
+
+
+@pytest.mark.parametrize("count, start", [(40, 30), (40, 1), (12, 11), (5, 5)])
+def test_balanced_row_blocks_over_new_pairs(count, start):
+    ranges = portflower.balanced_row_blocks(count, 4, start)
+    assert [i for rows in ranges for i in rows] == list(range(count))
+
+    # Rows before start each hold count - start pairs, so they are spread
+    # over the blocks instead of all falling into the first one
+    total = portflower.pair_count(count, start)
+    assert total == sum(count - max(i + 1, start) for i in range(count))
+    for rows in ranges:
+        pairs = sum(count - max(i + 1, start) for i in rows)
+        assert pairs <= total / 4 + count - 1
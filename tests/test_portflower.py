@@ -0,0 +1,155 @@
+import random
+
+import pytest
+
+from minortop import portflower
+
+
+def random_strings(seed, count=120):
+    rng = random.Random(seed)
+    alphabet = "abcdeABCDE -éß" + "".join(chr(c) for c in range(0x100, 0x160))
+    return [
+        "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 15)))
+        for _ in range(count)
+    ]
+
+
+def pairwise_reference(strings, score_threshold, algorithm):
+    calculator = portflower.SimilarityCalculator(algorithm)
+    scorer = portflower.PairwiseRowScorer(strings, calculator)
+    return sorted(
+        scorer.score_rows(range(len(strings)), score_threshold), key=lambda x: x[1]
+    )
+
+
+@pytest.mark.parametrize("score_threshold", [0.0, 0.25, 0.5, 1.0])
+def test_jaccard_bitset_matches_pairwise(score_threshold):
+    strings = random_strings(0)
+    algorithm = portflower.JaccardAlgorithm()
+    expected = pairwise_reference(strings, score_threshold, algorithm)
+    actual = portflower.find_pairs_below_score(
+        strings, score_threshold, portflower.SimilarityCalculator(algorithm)
+    )
+    assert actual == expected
+
+
+@pytest.mark.parametrize("score_threshold", [0.2, 0.5, 0.9, 2.0])
+def test_batched_cosine_matches_pairwise(score_threshold):
+    strings = random_strings(1)
+    # Short strings over few characters tie exactly at 0.5 many times
+    strings += ["ab", "ba", "ac", "abab", "aabb", "cd", "a", "b", ""]
+    calculator = portflower.SimilarityCalculator(portflower.CosineSimilarityAlgorithm())
+    expected = portflower.find_pairs_below_score(strings, score_threshold, calculator)
+    calculator = portflower.SimilarityCalculator(
+        portflower.BatchedCosineSimilarityAlgorithm()
+    )
+    actual = portflower.find_pairs_below_score(strings, score_threshold, calculator)
+    assert actual == expected
+
+
+def test_batched_cosine_blocks_and_start(monkeypatch):
+    monkeypatch.setattr(portflower.CosineMatrixScorer, "block_size", 7)
+    strings = random_strings(2, count=40)
+    reference = pairwise_reference(strings, 2.0, portflower.CosineSimilarityAlgorithm())
+    expected = {pair: similarity for pair, similarity in reference if pair[1] >= 25}
+    scorer = portflower.CosineMatrixScorer(strings)
+    actual = dict(scorer.score_rows(range(len(strings)), 2.0, start=25))
+    assert actual == expected
+
+
+def test_batched_needs_cosine(capsys):
+    with pytest.raises(SystemExit):
+        portflower.main(["--algorithm", "jaccard", "--batched"])
+    assert "--batched only applies to --algorithm cosine" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("score_threshold", [0, 1, 2.5])
+def test_bk_tree_matches_pairwise(score_threshold):
+    strings = random_strings(2) + ["Salt", "salt", "Salt "]
+    algorithm = portflower.LevenshteinAlgorithm()
+    expected = pairwise_reference(strings, score_threshold, algorithm)
+    stats = {}
+    actual = portflower.find_pairs_below_score(
+        strings,
+        score_threshold,
+        portflower.SimilarityCalculator(portflower.BKTreeLevenshteinAlgorithm()),
+        stats=stats,
+    )
+    assert actual == expected
+    assert stats["queries"] == len(strings)
+
+
+def test_bk_tree_lookup():
+    tree = portflower.BKTree(["Salt", "Malt", "Pepper", "salt"])
+    assert sorted(tree.query("SALT", 1)) == [(0, 0), (1, 1), (3, 0)]
+    assert tree.visits <= 4
+
+
+@pytest.mark.parametrize("count, blocks", [(0, 3), (1, 3), (2, 4), (10, 3), (101, 8)])
+def test_balanced_row_blocks(count, blocks):
+    ranges = portflower.balanced_row_blocks(count, blocks)
+    # Contiguous, in order and covering every row
+    assert [i for rows in ranges for i in rows] == list(range(count))
+    assert len(ranges) <= blocks
+
+    # Each block holds about total / blocks pairs of the triangle: at most
+    # one row's worth (count - 1 pairs) more than an equal share
+    total = count * (count - 1) // 2
+    for rows in ranges:
+        pairs = sum(count - 1 - i for i in rows)
+        assert pairs <= total / blocks + count - 1
+
+
+def test_balanced_row_blocks_uneven():
+    # The rows of 7 strings hold 6, 5, ..., 0 pairs, 21 in all: the cuts
+    # nearest to 7 and 14 pairs give blocks of 6, 9 and 6 pairs
+    ranges = portflower.balanced_row_blocks(7, 3)
+    assert ranges == [range(0, 1), range(1, 3), range(3, 7)]
+
+
+@pytest.mark.parametrize("algorithm", ["levenshtein", "jaccard"])
+def test_workers_match_serial(tmp_path, algorithm):
+    data = tmp_path / "data.txt"
+    data.write_text("\n".join(random_strings(4, count=60)) + "\n")
+    outputs = []
+    for workers in ("1", "2"):
+        output = tmp_path / f"matches{workers}.csv"
+        portflower.main(
+            ["--file-path", str(data), "--algorithm", algorithm, "--score", "0.6"]
+            + ["--workers", workers, "--output-format", "csv"]
+            + ["--output", str(output)]
+        )
+        outputs.append(output.read_text())
+    assert outputs[0] == outputs[1]
+    assert len(outputs[0].splitlines()) > 1
+
+
+def test_batched_workers_match_serial_byte_for_byte(tmp_path):
+    data = tmp_path / "data.txt"
+    # Many exact ties at 0.5, which must come out in the same order
+    words = ["ab", "ba", "abab", "aabb", "ac", "ca", "abc", "cab", "bca", "cd"]
+    data.write_text("\n".join(words * 3) + "\n")
+    outputs = []
+    for workers in ("1", "3"):
+        output = tmp_path / f"matches{workers}.csv"
+        portflower.main(
+            ["--file-path", str(data), "--algorithm", "cosine", "--batched"]
+            + ["--score", "0.5", "--workers", workers, "--output-format", "csv"]
+            + ["--output", str(output)]
+        )
+        outputs.append(output.read_bytes())
+    assert outputs[0] == outputs[1]
+    assert len(outputs[0].splitlines()) > 100
+
+
+def test_workers_read_the_parents_feature_cache(tmp_path):
+    data = tmp_path / "data.txt"
+    data.write_text("\n".join(random_strings(5, count=40)) + "\n")
+    cache = tmp_path / "cache"
+    portflower.main(
+        ["--file-path", str(data), "--algorithm", "jaccard", "--score", "0.6"]
+        + ["--workers", "2", "--feature-cache", str(cache)]
+        + ["--output-format", "csv", "--output", str(tmp_path / "matches.csv")]
+    )
+    # Workers find every feature cached instead of each storing its own
+    assert len(list(cache.glob("char-set/*/keys.npy"))) == 1
@@ -0,0 +1,47 @@
+import io
+import json
+
+from minortop import britishcouch, profiling
+
+
+def test_profiler_reports_phases_and_throughput():
+    profiler = profiling.Profiler()
+    with profiler.phase("score"):
+        pass
+    profiler.add_pairs(10)
+    profiler.add_matches(3)
+
+    out = io.StringIO()
+    profiler.report(out)
+    summary = json.loads(out.getvalue().splitlines()[-1])
+    assert [phase["phase"] for phase in summary["phases"]] == ["score"]
+    assert summary["pairs_evaluated"] == 10
+    assert summary["matches_kept"] == 3
+    assert summary["peak_rss_bytes"] > 0
+
+
+def test_disabled_profiler_is_a_no_op():
+    profiler = profiling.DISABLED
+    with profiler.phase("score"):
+        profiler.add_pairs(10)
+    out = io.StringIO()
+    profiler.report(out)
+    assert out.getvalue() == ""
+
+
+def test_engine_profile_flag(tmp_path, capsys):
+    data = tmp_path / "data.txt"
+    data.write_text("salt\nsalts\npepper\n")
+    stats = tmp_path / "run.prof"
+
+    britishcouch.main(["--file-path", str(data), "--profile-stats", str(stats)])
+    captured = capsys.readouterr()
+    summary = json.loads(captured.err.splitlines()[-1])
+    assert {"read", "score", "sort", "output"} <= {
+        phase["phase"] for phase in summary["phases"]
+    }
+    assert summary["pairs_evaluated"] == 3
+    assert stats.exists()
+
+    britishcouch.main(["--file-path", str(data)])
+    assert capsys.readouterr().err == ""
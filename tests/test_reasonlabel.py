@@ -0,0 +1,58 @@
+import random
+
+import jarowinkler
+
+from minortop import reasonlabel
+
+
+def test_upper_bound_is_never_below_similarity():
+    rng = random.Random(0)
+    for _ in range(2000):
+        string1 = "".join(rng.choice("abc") for _ in range(rng.randint(0, 12)))
+        string2 = "".join(rng.choice("abc") for _ in range(rng.randint(0, 12)))
+        prefix = reasonlabel.common_prefix_length(string1, string2)
+        bound = reasonlabel.jarowinkler_upper_bound(len(string1), len(string2), prefix)
+        similarity = jarowinkler.jarowinkler_similarity(string1, string2)
+        assert similarity <= bound + reasonlabel.BOUND_EPSILON
+
+
+def test_compare_strings_reports_pruned_pairs(capsys):
+    reasonlabel.compare_strings(["Salt", "salt", "Sea salt flakes", "Pepper"], 0.9)
+    out = capsys.readouterr().out
+    assert "score1: 1.000, score2: 1.000\nSalt\nsalt\n" in out
+    assert "Total Comparisons Made: 6" in out
+    assert "Pruned Comparisons: 5" in out
+    assert "Above Threshold Count: 1" in out
+
+
+def test_pruned_pairs_match_every_pair():
+    rng = random.Random(3)
+    strings = [
+        "".join(rng.choice("abAB ") for _ in range(rng.randint(0, 14)))
+        for _ in range(80)
+    ]
+    lowered = [string.lower() for string in strings]
+    for threshold in (0.0, 0.7, 0.85, 0.95, 1.5):
+        for start in (0, 50):
+            expected = [
+                (i, j)
+                for i in range(len(strings))
+                for j in range(max(i + 1, start), len(strings))
+                if jarowinkler.jarowinkler_similarity(lowered[i], lowered[j])
+                >= threshold
+            ]
+            counts = {}
+            actual = reasonlabel.iter_similar_pairs(strings, threshold, start, counts)
+            assert [(i, j) for i, j, _, _ in actual] == expected
+            assert counts["total"] == sum(
+                len(strings) - max(i + 1, start) for i in range(len(strings) - 1)
+            )
+
+
+def test_length_spans():
+    order, spans = reasonlabel.length_spans([3, 10, 4, 3, 0, 20], 0.92)
+    assert order.tolist() == [4, 0, 3, 2, 1, 5]
+    # Lengths 3 and 4 can reach 0.92 together, 10 and 20 only on their own
+    assert spans[3] == spans[4] == (1, 4)
+    assert spans[10] == (4, 5)
+    assert spans[0] == (0, 1)
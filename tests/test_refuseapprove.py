@@ -0,0 +1,92 @@
+import itertools
+import random
+
+import Bio.Align
+import numpy
+import pytest
+
+from minortop import refuseapprove
+
+
+def random_strings(rng, count):
+    return [
+        "".join(rng.choice("abcé ") for _ in range(rng.randint(1, 30)))
+        for _ in range(count)
+    ]
+
+
+def columns(strings, alphabet, width):
+    """Padded character codes of strings, one string per column."""
+    rows = [[alphabet.index(char) for char in string] for string in strings]
+    return numpy.array([row + [0] * (width - len(row)) for row in rows]).T
+
+
+def test_batch_scores_match_default_aligner():
+    aligner = refuseapprove.make_aligner()
+    scoring = refuseapprove.linear_scoring(aligner)
+    query, targets = "café au lait", random_strings(random.Random(5), 50)
+    alphabet = sorted(set(query + "".join(targets)))
+
+    # One query against many targets
+    queries = columns([query] * len(targets), alphabet, len(query))
+    scores = refuseapprove.batch_scores(
+        queries,
+        numpy.full(len(targets), len(query)),
+        columns(targets, alphabet, 30),
+        numpy.array([len(target) for target in targets]),
+        scoring,
+    )
+    assert scores.tolist() == [aligner.score(query, target) for target in targets]
+
+
+def test_batched_pairs_match_aligner(monkeypatch):
+    # Small batches and blocks so that both are split
+    monkeypatch.setattr(refuseapprove, "BATCH_CELLS", 2000)
+    monkeypatch.setattr(refuseapprove, "BLOCK_SCORES", 200)
+    data = random_strings(random.Random(11), 60)
+    aligner = refuseapprove.make_aligner()
+    expected = list(refuseapprove.iter_similar_indices(data, 8, aligner))
+    batched = list(refuseapprove.iter_similar_indices(data, 8))
+    assert batched == expected
+    assert all(type(score) is float for _, _, score in batched)
+
+
+def test_empty_strings_are_rejected_like_the_aligner():
+    data = ["salt", "", "malt"]
+    aligner = refuseapprove.make_aligner()
+    for batched_or_aligner in (None, aligner):
+        with pytest.raises(ValueError, match="sequence has zero length"):
+            list(refuseapprove.iter_similar_indices(data, 0, batched_or_aligner))
+
+
+def test_batch_scores_other_linear_scoring():
+    aligner = Bio.Align.PairwiseAligner(match_score=3, mismatch_score=-2, gap_score=-4)
+    scoring = refuseapprove.linear_scoring(aligner)
+    assert scoring == (3, -2, -4)
+    data = random_strings(random.Random(3), 30)
+    batched = refuseapprove.iter_batched_indices(data, -numpy.inf, scoring)
+    assert [score for _, _, score in batched] == [
+        aligner.score(data[i], data[j])
+        for i in range(len(data))
+        for j in range(i + 1, len(data))
+    ]
+
+
+def test_linear_scoring_rejects_other_aligners():
+    assert refuseapprove.linear_scoring(Bio.Align.PairwiseAligner(mode="local")) is None
+    aligner = Bio.Align.PairwiseAligner(open_gap_score=-2, extend_gap_score=-1)
+    assert refuseapprove.linear_scoring(aligner) is None
+
+
+def test_filter_by_similarity_matches_align_loop():
+    data = random_strings(random.Random(8), 25)
+    aligner = Bio.Align.PairwiseAligner()
+    pairs = list(itertools.combinations(data, 2))
+    scored = [(seq1, seq2, aligner.align(seq1, seq2)[0].score) for seq1, seq2 in pairs]
+    expected = sorted(
+        [match for match in scored if match[2] > 6], key=lambda x: x[2], reverse=True
+    )
+
+    comparisons, matches = refuseapprove.filter_by_similarity(data, 6)
+    assert comparisons == len(pairs)
+    assert matches == expected
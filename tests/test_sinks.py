@@ -0,0 +1,95 @@
+import csv
+import importlib.util
+import json
+import sys
+
+import numpy
+import pytest
+
+from minortop import portflower, sinks
+
+STRINGS = ["salt", "Salt", 'say "cheese"', "salts"]
+ROWS = [(0, 1, 0.0), (0, 3, 0.2), (1, 2, 0.5)]
+
+
+def write_rows(sink):
+    with sink:
+        for row in ROWS:
+            sink.write(*row)
+
+
+def test_jsonl_and_csv(tmp_path):
+    path = tmp_path / "matches.jsonl"
+    write_rows(sinks.open_sink("jsonl", STRINGS, None, path=path))
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert records[2] == {
+        "i": 1,
+        "j": 2,
+        "score": 0.5,
+        "string1": "Salt",
+        "string2": 'say "cheese"',
+    }
+
+    path = tmp_path / "matches.csv"
+    write_rows(sinks.open_sink("csv", STRINGS, None, path=path))
+    with open(path, newline="") as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == ["i", "j", "score", "string1", "string2"]
+    assert rows[3] == ["1", "2", "0.5", "Salt", 'say "cheese"']
+
+
+def test_npz_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(sinks, "BATCH_ROWS", 2)
+    path = tmp_path / "matches.npz"
+    write_rows(sinks.open_sink("npz", STRINGS, None, ("distance",), path))
+    arrays = numpy.load(path)
+    assert arrays["i"].tolist() == [0, 0, 1]
+    assert arrays["j"].tolist() == [1, 3, 2]
+    assert arrays["distance"].tolist() == [0.0, 0.2, 0.5]
+
+    empty = tmp_path / "empty.npz"
+    sinks.open_sink("npz", STRINGS, None, path=empty).close()
+    assert numpy.load(empty)["i"].shape == (0,)
+
+
+def test_report_moves_to_stderr_when_rows_use_stdout(tmp_path):
+    assert sinks.open_sink("text", STRINGS, None).report_file is sys.stdout
+    assert sinks.open_sink("jsonl", STRINGS, None).report_file is sys.stderr
+    sink = sinks.open_sink("jsonl", STRINGS, None, path=tmp_path / "out.jsonl")
+    assert sink.report_file is sys.stdout
+    sink.close()
+
+
+def test_engine_jsonl_output(tmp_path, capsys):
+    data = tmp_path / "data.txt"
+    data.write_text("\n".join(STRINGS) + "\n")
+    portflower.main(["--file-path", str(data), "--output-format", "jsonl"])
+    captured = capsys.readouterr()
+    records = [json.loads(line) for line in captured.out.splitlines()]
+    assert [(r["i"], r["j"], r["score"]) for r in records] == [
+        (0, 1, 0),
+        (0, 3, 1),
+        (1, 3, 1),
+    ]
+    assert "Number of items found" in captured.err
+
+
+def test_unusable_outputs(capsys):
+    with pytest.raises(TypeError):
+        sinks.ResultSink(STRINGS)
+    with pytest.raises(ValueError, match="npz output needs --output PATH"):
+        sinks.open_sink("npz", STRINGS, None)
+
+    # Engines report them as usage errors before reading any input
+    with pytest.raises(SystemExit) as exit_info:
+        portflower.main(["--file-path", "missing.txt", "--output-format", "npz"])
+    assert exit_info.value.code == 2
+    assert "error: npz output needs --output PATH" in capsys.readouterr().err
+
+
+@pytest.mark.skipif(
+    importlib.util.find_spec("pyarrow") is not None, reason="pyarrow is installed"
+)
+def test_parquet_needs_pyarrow(tmp_path):
+    with pytest.raises(ImportError, match=r"pip install minortop\[parquet\]"):
+        sinks.open_sink("parquet", STRINGS, None, path=tmp_path / "out.parquet")
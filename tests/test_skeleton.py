@@ -1,3 +1,8 @@
+import json
+import subprocess
+import sys
+import time
+
 import pytest
 
 import minortop.main
@@ -54,3 +59,57 @@ def test_main_with_multiple_invalid_arguments(capsys, monkeypatch):
     # Optionally, you can also check the captured output
     captured = capsys.readouterr()
     assert "invalid choice:" in captured.err.strip()
+
+
+HEAVY_MODULES = ("numpy", "sklearn", "scipy", "Bio", "Levenshtein", "jellyfish")
+
+# Generous wall-clock budget for interpreter start, import and argument parsing
+STARTUP_BUDGET_SECONDS = 2.0
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import minortop.main
+try:
+    minortop.main.main([{option!r}])
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - start
+heavy = sorted({{m.split(".")[0] for m in sys.modules}} & set({heavy!r}))
+print(json.dumps({{"elapsed": elapsed, "heavy": heavy}}), file=sys.stderr)
+"""
+
+
+@pytest.mark.parametrize("option", ["--version", "--help"])
+def test_main_startup_stays_light(option):
+    """--version and --help must not import the engines' heavy dependencies"""
+    script = STARTUP_SCRIPT.format(option=option, heavy=HEAVY_MODULES)
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+    total = time.perf_counter() - start
+
+    report = json.loads(result.stderr.splitlines()[-1])
+    assert report["heavy"] == []
+    assert report["elapsed"] < STARTUP_BUDGET_SECONDS / 4
+    assert total < STARTUP_BUDGET_SECONDS
+
+
+def test_main_runs_lazy_subcommand(capsys, tmp_path):
+    """Subcommand arguments are passed through to the engine"""
+    data = tmp_path / "data.txt"
+    data.write_text("Salt\nsalt\nPepper\n")
+    minortop.main.main(["soundex", "--blocking", "--file_path", str(data)])
+    assert capsys.readouterr().out == ""
+    minortop.main.main(
+        [
+            "soundex",
+            "--blocking",
+            "--file_path",
+            str(data),
+            "--similarity_threshold",
+            "1",
+        ]
+    )
+    assert "Salt\nsalt\n" in capsys.readouterr().out
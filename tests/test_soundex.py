@@ -0,0 +1,41 @@
+import pytest
+
+from minortop import soundex
+
+STRINGS = ["Robert", "Rupert", "Rubin", "Ashcraft", "Ashcroft", "Tymczak", "robert"]
+
+
+def test_soundex_index_and_bucket_pairs():
+    index = soundex.build_soundex_index(STRINGS)
+    assert index == {
+        "R163": [0, 1, 6],
+        "R150": [2],
+        "A261": [3, 4],
+        "T522": [5],
+    }
+    assert sorted(soundex.iter_bucket_pairs(index)) == [(0, 1), (0, 6), (1, 6), (3, 4)]
+
+
+def test_blocking_matches_all_pairs(tmp_path):
+    data = tmp_path / "data.txt"
+    data.write_text("\n".join(STRINGS) + "\n")
+    outputs = {}
+    for mode in ([], ["--blocking"]):
+        output = tmp_path / f"matches{len(mode)}.csv"
+        soundex.main(
+            ["--file_path", str(data), "--similarity_threshold", "1"]
+            + ["--output-format", "csv", "--output", str(output)]
+            + mode
+        )
+        outputs[len(mode)] = output.read_text()
+    assert outputs[0] == outputs[1]
+    assert len(outputs[0].splitlines()) == 5
+
+
+@pytest.mark.parametrize("threshold", ["0", "-1"])
+def test_blocking_rejects_thresholds_matching_across_buckets(threshold, capsys):
+    with pytest.raises(SystemExit):
+        soundex.main(["--blocking", "--similarity_threshold", threshold])
+    assert "--blocking needs a --similarity_threshold above 0" in (
+        capsys.readouterr().err
+    )
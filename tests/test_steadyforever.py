@@ -0,0 +1,356 @@
+import http.server
+import json
+import logging
+import pathlib
+import random
+import threading
+import time
+
+import jinja2
+import pytest
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from minortop.steadyforever import main as steadyforever
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """Answers chat completions with the prompt's last line, upper-cased."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests.append(body)
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            fail = server.failures > 0
+            server.failures -= fail
+        time.sleep(0.05)
+        with server.lock:
+            server.active -= 1
+
+        if fail:
+            self.reply(500, {"error": {"message": "try again"}})
+            return
+        prompt = body["messages"][0]["content"]
+        if body.get("stream"):
+            self.stream(body["model"], server.answer or prompt.splitlines()[-1])
+            return
+        self.reply(
+            200,
+            {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {
+                            "role": "assistant",
+                            "content": prompt.splitlines()[-1].upper(),
+                        },
+                    }
+                ],
+            },
+        )
+
+    def reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream(self, model, answer):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        pieces = [answer[k : k + 3] for k in range(0, len(answer), 3)]
+        for piece in pieces:
+            self.event(model, {"content": piece}, None)
+            if "\n" in piece and not self.server.partial:
+                self.server.partial = self.wait_for_first_line(answer)
+        self.event(model, {}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def event(self, model, delta, finish_reason):
+        chunk = {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.flush()
+
+    @staticmethod
+    def wait_for_first_line(answer):
+        # Whether results.txt shows the first line before the rest is sent
+        expected = f"> {answer.splitlines()[0]}\n"
+        for _ in range(200):
+            path = pathlib.Path("results.txt")
+            if path.exists() and path.read_text() == expected:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.active = server.peak = server.failures = 0
+    server.answer = None
+    server.partial = False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    (tmp_path / "template.tmpl").write_text("{{ data.sect1 }}\n\n{{ data.sect2 }}")
+    (tmp_path / "template.j2").write_text(
+        "{% for line in data.splitlines() %}> {{ line }}\n{% endfor %}"
+    )
+    (tmp_path / "chat_instructions.txt").write_text("Shout the recipe.")
+    return tmp_path
+
+
+def test_read_recipes(tmp_path):
+    (tmp_path / "b.txt").write_text("b")
+    (tmp_path / "a.txt").write_text("a")
+    (tmp_path / "notes.md").write_text("")
+    assert steadyforever.read_recipes(tmp_path) == [
+        tmp_path / "a.txt",
+        tmp_path / "b.txt",
+    ]
+
+    manifest = tmp_path / "manifest"
+    manifest.write_text("# recipes\nb.txt\n\n  sub/c.txt\n")
+    assert steadyforever.read_recipes(manifest) == [
+        tmp_path / "b.txt",
+        tmp_path / "sub" / "c.txt",
+    ]
+
+
+def test_batch(stub_server, workdir):
+    recipes = workdir / "recipes"
+    recipes.mkdir()
+    for number in range(6):
+        (recipes / f"r{number}.txt").write_text(f"recipe {number}")
+    stub_server.failures = 1
+
+    steadyforever.main(
+        [
+            "--batch",
+            str(recipes),
+            "--base-url",
+            f"http://127.0.0.1:{stub_server.server_port}/v1",
+            "--concurrency",
+            "2",
+            "--backoff",
+            "0",
+            "--model",
+            "stub",
+        ]
+    )
+
+    for number in range(6):
+        output = workdir / "results" / f"r{number}.txt"
+        assert output.read_text() == f"> RECIPE {number}\n"
+    # Six recipes and the retry of the one that failed
+    assert len(stub_server.requests) == 7
+    assert {request["model"] for request in stub_server.requests} == {"stub"}
+    assert stub_server.peak == 2
+
+
+def test_batch_reports_failures(stub_server, workdir):
+    (workdir / "manifest").write_text("one.txt\n")
+    (workdir / "one.txt").write_text("one")
+    stub_server.failures = 3
+
+    with pytest.raises(SystemExit, match="1 of 1 recipes failed"):
+        steadyforever.main(
+            [
+                "--batch",
+                "manifest",
+                "--base-url",
+                f"http://127.0.0.1:{stub_server.server_port}/v1",
+                "--retries",
+                "2",
+                "--backoff",
+                "0",
+            ]
+        )
+    assert len(stub_server.requests) == 3
+    assert not (workdir / "results" / "one.txt").exists()
+
+
+def completion(content):
+    return ChatCompletion.model_validate(
+        {
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "stub",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ],
+        }
+    )
+
+
+def test_cache(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(steadyforever.time, "time", lambda: now[0])
+    cache = steadyforever.CompletionCache(tmp_path / "cache", ttl=60, max_entries=2)
+    assert cache.get("prompt", "stub") is None
+
+    cache.put("prompt", "stub", completion("one"))
+    assert cache.get("prompt", "stub") == completion("one")
+    assert cache.get("prompt", "other") is None
+    assert cache.get("other", "stub") is None
+
+    # A new instance finds the entry through the index
+    reopened = steadyforever.CompletionCache(tmp_path / "cache", ttl=60)
+    assert reopened.get("prompt", "stub").choices[0].message.content == "one"
+
+    # The oldest entry is evicted past max_entries
+    now[0] += 1
+    cache.put("second", "stub", completion("two"))
+    now[0] += 1
+    cache.put("third", "stub", completion("three"))
+    assert cache.get("prompt", "stub") is None
+    # Two entries and index.json
+    assert len(list((tmp_path / "cache").glob("*.json"))) == 3
+
+    # And entries expire after the TTL
+    now[0] += 60
+    assert cache.get("second", "stub") is None
+    assert cache.get("third", "stub") is not None
+
+
+def test_main_uses_cache(stub_server, workdir):
+    (workdir / "chat_recipe.txt").write_text("toast")
+    argv = ["--base-url", f"http://127.0.0.1:{stub_server.server_port}/v1"]
+
+    steadyforever.main(argv)
+    steadyforever.main(argv)
+    assert (workdir / "results.txt").read_text() == "> TOAST\n"
+    assert len(stub_server.requests) == 1
+
+    # A changed prompt misses the cache
+    (workdir / "chat_recipe.txt").write_text("jam")
+    steadyforever.main(argv)
+    assert (workdir / "results.txt").read_text() == "> JAM\n"
+    assert len(stub_server.requests) == 2
+
+    steadyforever.main(argv + ["--no-cache"])
+    assert len(stub_server.requests) == 3
+
+
+def test_stream(stub_server, workdir, caplog):
+    (workdir / "chat_recipe.txt").write_text("toast")
+    stub_server.answer = "Toast the bread.\nButter it\r\n\nServe warm"
+    argv = ["--base-url", f"http://127.0.0.1:{stub_server.server_port}/v1"]
+
+    with caplog.at_level(logging.INFO, logger=steadyforever.logger.name):
+        steadyforever.main(argv + ["--stream"])
+    expected = "> Toast the bread.\n> Butter it\n> \n> Serve warm\n"
+    assert (workdir / "results.txt").read_text() == expected
+    assert not (workdir / "results.txt.bak").exists()
+    assert stub_server.partial
+    assert "Time to first token" in caplog.text
+
+    # The assembled completion was cached and renders the same way
+    (workdir / "results.txt").unlink()
+    steadyforever.main(argv)
+    assert (workdir / "results.txt").read_text() == expected
+    assert len(stub_server.requests) == 1
+
+
+def test_streamed_lines_split_as_splitlines():
+    text = "a\r\nb\rc\n\nd\x0be\x0cf\x1cg\x85h\u2028i\u2029j\r"
+    rng = random.Random(0)
+    for _ in range(100):
+        cuts = sorted(rng.sample(range(1, len(text)), rng.randrange(len(text) - 1)))
+        pieces = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+        streamed = steadyforever.StreamedText(pieces)
+        assert list(streamed.splitlines()) == text.splitlines(), pieces
+        assert streamed.finish() == text
+
+
+def test_streams_lines():
+    environment = jinja2.Environment()
+    for source, expected in [
+        ("{% for line in data.splitlines() %}> {{ line }}\n{% endfor %}", True),
+        ("{{ data.splitlines()|join(', ') }}", True),
+        ("{{ data }}", False),
+        ("{{ data|length }}", False),
+        ("{% for line in data.splitlines(True) %}{{ line }}{% endfor %}", False),
+        ("{{ data.splitlines()|length }}: {{ data.upper() }}", False),
+    ]:
+        assert steadyforever.streams_lines(environment, source) is expected, source
+
+
+class FakeClient:
+    """Chat completions that stream ``pieces``, then raise ``error`` if set."""
+
+    def __init__(self, pieces, error=None):
+        self.pieces = pieces
+        self.error = error
+        self.chat = self.completions = self
+
+    def create(self, **kwargs):
+        for piece in self.pieces:
+            yield ChatCompletionChunk.model_validate(
+                {
+                    "id": "chatcmpl-test",
+                    "object": "chat.completion.chunk",
+                    "created": 0,
+                    "model": "stub",
+                    "choices": [{"index": 0, "delta": {"content": piece}}],
+                }
+            )
+        if self.error:
+            raise self.error
+
+
+def test_stream_renders_whole_text_and_keeps_output_on_failure(workdir):
+    (workdir / "template.j2").write_text("{{ data|length }}: {{ data }}")
+    client = FakeClient(["Toast", " it"])
+    completion = steadyforever.stream_chat_completion(client, "toast")
+    assert completion.choices[0].message.content == "Toast it"
+    assert (workdir / "results.txt").read_text() == "8: Toast it"
+
+    # A stream that fails after the first line was written to results.txt
+    (workdir / "template.j2").write_text(
+        "{% for line in data.splitlines() %}> {{ line }}\n{% endfor %}"
+    )
+    client = FakeClient(["Jam\n", "on"], ConnectionError("stream closed"))
+    with pytest.raises(ConnectionError):
+        steadyforever.stream_chat_completion(client, "jam")
+    assert (workdir / "results.txt").read_text() == "8: Toast it"
+    assert not (workdir / "results.txt.bak").exists()